@@ -1,4 +1,7 @@
+import asyncio
+import json
 import logging
+import time
 from typing import Optional, Dict, Any, List
 from contextlib import asynccontextmanager
 
@@ -7,7 +10,7 @@ from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel, Field
 
 from config import config
-from rag_pipeline import RAGPipeline
+from rag_pipeline import PromptBudgetError, RAGPipeline
 from embedding_service import EmbeddingService
 from retrieval_service import RetrievalService
 from llm_service import LLMService
@@ -28,31 +31,76 @@ llm_service: Optional[LLMService] = None
 rag_pipeline: Optional[RAGPipeline] = None
 
 
+# Startup progress, reported by /ready
+startup_state: Dict[str, Any] = {"ready": False, "timings": {}, "error": None}
+
+
+async def _timed(name: str, factory):
+    """Build a service in a worker thread and record how long it took."""
+    start = time.perf_counter()
+    service = await asyncio.to_thread(factory)
+    startup_state["timings"][name] = round(time.perf_counter() - start, 3)
+    return service
+
+
+async def initialize_services():
+    """
+    Load the three services concurrently, then warm up the embedding model.
+    
+    Heavy imports (torch, pinecone, groq) happen lazily inside the service
+    constructors, so each one is paid on its own thread.
+    """
+    global embedding_service, retrieval_service, llm_service, rag_pipeline
+    
+    start = time.perf_counter()
+    try:
+        embedding_service, retrieval_service, llm_service = await asyncio.gather(
+            _timed("embedding", EmbeddingService),
+            _timed("retrieval", RetrievalService),
+            _timed("llm", LLMService)
+        )
+        rag_pipeline = RAGPipeline(
+            embedding_service=embedding_service,
+            retrieval_service=retrieval_service,
+            llm_service=llm_service
+        )
+        
+        await _timed("warmup", embedding_service.warm_up)
+        await _timed("llm_routes", rag_pipeline.router.warm_up)
+        
+        startup_state["timings"]["total"] = round(time.perf_counter() - start, 3)
+        startup_state["ready"] = True
+        logger.info(f"Application ready, startup timings (s): {startup_state['timings']}")
+    
+    except Exception as e:
+        startup_state["error"] = str(e)
+        logger.error(f"Startup failed: {str(e)}")
+
+
+def _require_ready():
+    """Reject requests with 503 until startup has finished."""
+    if not startup_state["ready"]:
+        raise HTTPException(status_code=503, detail="Service is warming up")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     Application lifespan manager.
-    Loads models once at startup, cleans up at shutdown.
+    Starts loading models in the background so the server accepts
+    connections immediately; cleans up at shutdown.
     """
-    global embedding_service, retrieval_service, llm_service, rag_pipeline
-    
     logger.info("Starting application...")
     
-    # Initialize services once
-    embedding_service = EmbeddingService()
-    retrieval_service = RetrievalService()
-    llm_service = LLMService()
-    rag_pipeline = RAGPipeline(
-        embedding_service=embedding_service,
-        retrieval_service=retrieval_service,
-        llm_service=llm_service
-    )
-    
-    logger.info("Application started successfully")
+    startup_task = asyncio.create_task(initialize_services())
     
     yield
     
     logger.info("Shutting down application...")
+    if not startup_task.done():
+        startup_task.cancel()
+    if rag_pipeline:
+        rag_pipeline.close()
 
 
 # Initialize FastAPI app
@@ -85,6 +133,9 @@ class QueryRequest(BaseModel):
     query: str = Field(..., description="Search query", min_length=1)
     top_k: Optional[int] = Field(None, description="Number of results", ge=1, le=20)
     namespace: Optional[str] = Field(None, description="Pinecone namespace")
+    namespaces: Optional[List[str]] = Field(
+        None, description="Search several namespaces in parallel (overrides namespace)", min_items=1
+    )
     filter_metadata: Optional[Dict[str, Any]] = Field(None, description="Metadata filters")
     include_context: bool = Field(True, description="Include formatted context")
     include_scores: bool = Field(False, description="Include similarity scores in context")
@@ -94,14 +145,24 @@ class BatchQueryRequest(BaseModel):
     queries: List[str] = Field(..., description="List of search queries", min_items=1)
     top_k: Optional[int] = Field(None, description="Number of results per query", ge=1, le=20)
     namespace: Optional[str] = Field(None, description="Pinecone namespace")
+    namespaces: Optional[List[str]] = Field(
+        None, description="Search several namespaces in parallel (overrides namespace)", min_items=1
+    )
     filter_metadata: Optional[Dict[str, Any]] = Field(None, description="Metadata filters")
 
 
+class InvalidateRequest(BaseModel):
+    namespace: Optional[str] = Field(None, description="Pinecone namespace (empty = default namespace)")
+
+
 class GenerateRequest(BaseModel):
     query: str = Field(..., description="User's question", min_length=1)
     marks: int = Field(5, description="Mark allocation (1, 2, 3, 5, 7, 10, 15)", ge=1, le=20)
     top_k: Optional[int] = Field(None, description="Number of documents to retrieve", ge=1, le=20)
     namespace: Optional[str] = Field(None, description="Pinecone namespace")
+    namespaces: Optional[List[str]] = Field(
+        None, description="Search several namespaces in parallel (overrides namespace)", min_items=1
+    )
     filter_metadata: Optional[Dict[str, Any]] = Field(None, description="Metadata filters")
     custom_system_prompt: Optional[str] = Field(None, description="Override schema-based prompt")
     temperature: Optional[float] = Field(None, description="LLM temperature", ge=0, le=2)
@@ -109,14 +170,40 @@ class GenerateRequest(BaseModel):
     include_sources: bool = Field(True, description="Include source documents")
 
 
+class BatchGenerateItem(BaseModel):
+    query: str = Field(..., description="Question", min_length=1)
+    marks: int = Field(5, description="Mark allocation (1, 2, 3, 5, 7, 10, 15)", ge=1, le=20)
+    top_k: Optional[int] = Field(None, description="Number of documents to retrieve", ge=1, le=20)
+    custom_system_prompt: Optional[str] = Field(None, description="Override schema-based prompt")
+    temperature: Optional[float] = Field(None, description="LLM temperature", ge=0, le=2)
+    max_tokens: Optional[int] = Field(None, description="Maximum tokens for response", ge=1)
+
+
+class BatchGenerateRequest(BaseModel):
+    items: List[BatchGenerateItem] = Field(
+        ..., description="Questions of the paper", min_items=1, max_items=config.GENERATE_BATCH_MAX_ITEMS
+    )
+    namespace: Optional[str] = Field(None, description="Pinecone namespace")
+    namespaces: Optional[List[str]] = Field(
+        None, description="Search several namespaces in parallel (overrides namespace)", min_items=1
+    )
+    filter_metadata: Optional[Dict[str, Any]] = Field(None, description="Metadata filters")
+    include_sources: bool = Field(False, description="Include source documents")
+    concurrency: Optional[int] = Field(None, description="Answers generated at the same time", ge=1, le=32)
+
+
 class GenerateResponse(BaseModel):
     query: str
     answer: str
     marks: int
     schema: Dict[str, Any]
     context: str
+    context_tokens: Optional[Dict[str, Any]] = None
+    cache_status: Optional[str] = None
+    coalesced: Optional[bool] = None
     model: Dict[str, str]
     sources: Optional[List[Dict[str, Any]]] = None
+    semantic_cache: Optional[Dict[str, Any]] = None
 
 
 class QueryResponse(BaseModel):
@@ -138,6 +225,15 @@ async def root():
     }
 
 
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once models are loaded and warmed up, else 503."""
+    return JSONResponse(
+        status_code=200 if startup_state["ready"] else 503,
+        content=startup_state
+    )
+
+
 @app.post("/query", response_model=QueryResponse)
 async def query_documents(request: QueryRequest):
     """
@@ -145,11 +241,13 @@ async def query_documents(request: QueryRequest):
     
     Returns the most similar documents from the vector database.
     """
+    _require_ready()
+    
     try:
-        result = rag_pipeline.run(
+        result = await rag_pipeline.arun(
             query=request.query,
             top_k=request.top_k,
-            namespace=request.namespace,
+            namespace=request.namespaces or request.namespace,
             filter_metadata=request.filter_metadata,
             include_context=request.include_context,
             include_scores=request.include_scores
@@ -167,20 +265,33 @@ async def batch_query_documents(request: BatchQueryRequest):
     """
     Retrieve relevant documents for multiple queries in batch.
     
-    More efficient than making individual requests.
+    More efficient than making individual requests. Queries run
+    concurrently; a failing query is reported in "errors" (by index)
+    without failing the rest of the batch.
     """
+    _require_ready()
+    
     try:
-        results = rag_pipeline.retrieve_batch(
+        results = await rag_pipeline.aretrieve_batch(
             queries=request.queries,
             top_k=request.top_k,
-            namespace=request.namespace,
-            filter_metadata=request.filter_metadata
+            namespace=request.namespaces or request.namespace,
+            filter_metadata=request.filter_metadata,
+            return_exceptions=True
         )
         
+        # A failed query gets an empty result and an entry in "errors"
+        errors = {
+            str(i): str(documents)
+            for i, documents in enumerate(results)
+            if isinstance(documents, Exception)
+        }
+        
         return {
             "queries": request.queries,
-            "results": results,
-            "num_queries": len(request.queries)
+            "results": [[] if isinstance(documents, Exception) else documents for documents in results],
+            "num_queries": len(request.queries),
+            "errors": errors
         }
     
     except Exception as e:
@@ -198,16 +309,16 @@ async def embed_text(
     
     Useful for debugging or custom vector operations.
     """
+    _require_ready()
+    
     try:
         if use_cache:
-            embedding = embedding_service.embed_single(text)
+            embedding = (await rag_pipeline.aembed(text)).tolist()
         else:
             # Bypass cache
-            embedding = embedding_service.model.encode(
-                text,
-                normalize_embeddings=config.NORMALIZE_EMBEDDINGS,
-                show_progress_bar=False
-            ).tolist()
+            embedding = (await rag_pipeline.executor.run(
+                "embed", embedding_service.embed_uncached, text
+            )).tolist()
         
         return {
             "text": text,
@@ -225,10 +336,14 @@ async def embed_text(
 async def get_stats():
     """
     Get pipeline statistics including cache performance and index info.
+    
+    Served from memory (index stats are refreshed in the background), so
+    monitoring scrapes add no vector store load.
     """
+    _require_ready()
+    
     try:
-        stats = rag_pipeline.get_stats()
-        return stats
+        return rag_pipeline.get_stats()
     
     except Exception as e:
         logger.error(f"Error getting stats: {str(e)}")
@@ -238,12 +353,14 @@ async def get_stats():
 @app.post("/cache/clear")
 async def clear_cache():
     """
-    Clear the embedding cache.
+    Clear the embedding, retrieval and semantic result caches.
     
     Useful for testing or memory management.
     """
+    _require_ready()
+    
     try:
-        embedding_service.clear_cache()
+        rag_pipeline.clear_caches()
         return {"status": "success", "message": "Cache cleared"}
     
     except Exception as e:
@@ -251,8 +368,26 @@ async def clear_cache():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/cache/invalidate")
+async def invalidate_cache(request: InvalidateRequest):
+    """
+    Invalidate cached retrievals and answers for one namespace.
+    
+    Call after re-indexing a course so new documents are served.
+    """
+    _require_ready()
+    
+    try:
+        result = rag_pipeline.invalidate_namespace(request.namespace)
+        return {"status": "success", **result}
+    
+    except Exception as e:
+        logger.error(f"Error invalidating cache: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/generate", response_model=GenerateResponse)
-async def generate_answer(request: GenerateRequest):
+async def generate_answer(request: GenerateRequest, response: Response):
     """
     Generate an exam-style answer using RAG pipeline with schema-based formatting.
     
@@ -263,13 +398,19 @@ async def generate_answer(request: GenerateRequest):
     - 5 marks: Definition + Explanation + Multiple Examples
     - 7-10 marks: Comprehensive coverage
     - 15 marks: Essay-style with in-depth analysis
+    
+    The X-Cache header is HIT (answer cache), HIT-SEMANTIC (near-duplicate
+    question) or MISS. Identical requests arriving while one is in flight
+    share its result (X-Coalesced: true).
     """
+    _require_ready()
+    
     try:
-        result = rag_pipeline.generate_answer(
+        result = await rag_pipeline.agenerate_answer(
             query=request.query,
             marks=request.marks,
             top_k=request.top_k,
-            namespace=request.namespace,
+            namespace=request.namespaces or request.namespace,
             filter_metadata=request.filter_metadata,
             custom_system_prompt=request.custom_system_prompt,
             temperature=request.temperature,
@@ -277,8 +418,12 @@ async def generate_answer(request: GenerateRequest):
             include_sources=request.include_sources
         )
         
+        response.headers["X-Cache"] = result.get("cache_status", "MISS")
+        response.headers["X-Coalesced"] = str(result.get("coalesced", False)).lower()
         return GenerateResponse(**result)
     
+    except PromptBudgetError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         logger.error(f"Error generating answer: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -291,54 +436,82 @@ async def generate_answer_stream(request: GenerateRequest):
     
     Returns answer token-by-token for better UX.
     Follows mark-based schema just like /generate endpoint.
+    Cached answers are replayed as a fast chunked stream (X-Cache: HIT).
+    A request identical to one already streaming joins it: it receives the
+    tokens generated so far, then the live tail (X-Coalesced: true).
     """
     from fastapi.responses import StreamingResponse
-    from schema_service import SchemaService
+    
+    _require_ready()
     
     try:
-        # Validate marks
-        marks = SchemaService.validate_marks(request.marks)
-        
-        # Get schema configuration
-        temperature = request.temperature or SchemaService.get_temperature(marks)
-        max_tokens = request.max_tokens or SchemaService.get_max_tokens(marks)
-        
-        # Retrieve documents
-        documents = rag_pipeline.retrieve(
+        # Retrieval and prompt building happen here; the LLM streams lazily
+        stream = await rag_pipeline.astream_answer(
             query=request.query,
+            marks=request.marks,
             top_k=request.top_k,
-            namespace=request.namespace,
-            filter_metadata=request.filter_metadata
+            namespace=request.namespaces or request.namespace,
+            filter_metadata=request.filter_metadata,
+            custom_system_prompt=request.custom_system_prompt,
+            temperature=request.temperature,
+            max_tokens=request.max_tokens
         )
         
-        # Build context
-        context = rag_pipeline.build_context(documents=documents)
-        
-        # Build prompts
-        if request.custom_system_prompt:
-            system_prompt = request.custom_system_prompt
-            user_prompt = f"Context: {context}\n\nQuestion: {request.query}"
-        else:
-            system_prompt = SchemaService.build_system_prompt(marks)
-            user_prompt = SchemaService.build_user_prompt(request.query, context, marks)
-        
-        # Stream generation
-        def generate():
-            for chunk in llm_service.generate_stream(
-                prompt=user_prompt,
-                system_prompt=system_prompt,
-                temperature=temperature,
-                max_tokens=max_tokens
-            ):
-                yield chunk
-        
-        return StreamingResponse(generate(), media_type="text/plain")
+        return StreamingResponse(
+            stream,
+            media_type="text/plain",
+            headers={
+                "X-Cache": stream.cache_status,
+                "X-Coalesced": str(stream.coalesced).lower()
+            }
+        )
     
+    except PromptBudgetError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         logger.error(f"Error in streaming generation: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/generate/batch")
+async def generate_answer_batch(request: BatchGenerateRequest):
+    """
+    Generate answers for a whole question paper.
+    
+    Questions are embedded in one batch, identical retrievals run once and
+    answers are generated concurrently. The response is NDJSON: one line
+    per question as soon as its answer is ready (completion order, with
+    "index" into items), either {"index", "status": "ok", "result"} or
+    {"index", "status": "error", "error"}, then a final summary line
+    {"done": true, ...}. A failing question does not fail the paper.
+    """
+    from fastapi.responses import StreamingResponse
+    
+    _require_ready()
+    
+    async def lines():
+        start = time.perf_counter()
+        errors = 0
+        async for event in rag_pipeline.agenerate_batch(
+            items=[item.dict() for item in request.items],
+            namespace=request.namespaces or request.namespace,
+            filter_metadata=request.filter_metadata,
+            include_sources=request.include_sources,
+            concurrency=request.concurrency
+        ):
+            errors += event["status"] == "error"
+            yield json.dumps(event, default=str) + "\n"
+        
+        yield json.dumps({
+            "done": True,
+            "num_items": len(request.items),
+            "num_errors": errors,
+            "elapsed_s": round(time.perf_counter() - start, 3)
+        }) + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 # Error handlers
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
@@ -0,0 +1,80 @@
+"""
+CPU benchmark and fp32 parity check for embedding backends.
+
+Usage:
+    python benchmark_embeddings.py
+    python benchmark_embeddings.py --backends torch,torch-int8,onnx-int8 --runs 200
+"""
+
+import argparse
+import statistics
+import time
+
+from config import config
+from embedding_backends import BACKENDS, PARITY_SAMPLES, load_model, parity_check
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def benchmark(model, texts, runs: int, batch_size: int) -> dict:
+    """Measure single-query latency and batched throughput."""
+    # Warm-up (graph optimisation, allocator, thread pools)
+    model.encode(texts[:2], show_progress_bar=False)
+
+    latencies = []
+    for i in range(runs):
+        start = time.perf_counter()
+        model.encode(texts[i % len(texts)], show_progress_bar=False)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    batch = (texts * (batch_size // len(texts) + 1))[:batch_size]
+    start = time.perf_counter()
+    model.encode(batch, batch_size=batch_size, show_progress_bar=False)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(_percentile(latencies, 95), 2),
+        "single_qps": round(1000 / statistics.mean(latencies), 1),
+        "batch_qps": round(batch_size / elapsed, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--model", default=config.EMBEDDING_MODEL_NAME)
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=config.EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--threshold", type=float, default=config.EMBEDDING_PARITY_THRESHOLD)
+    args = parser.parse_args()
+
+    reference = load_model("torch", args.model, device="cpu")
+
+    print(f"{'backend':<12} {'p50 ms':>8} {'p95 ms':>8} {'qps':>8} {'batch qps':>10} {'min cos':>9}  parity")
+    for backend in args.backends.split(","):
+        backend = backend.strip()
+        try:
+            model = reference if backend == "torch" else load_model(
+                backend, args.model, device="cpu", onnx_file=config.EMBEDDING_ONNX_FILE
+            )
+        except Exception as e:
+            print(f"{backend:<12} unavailable: {e}")
+            continue
+
+        result = benchmark(model, PARITY_SAMPLES, args.runs, args.batch_size)
+        parity = parity_check(reference, model, threshold=args.threshold)
+
+        print(
+            f"{backend:<12} {result['p50_ms']:>8} {result['p95_ms']:>8} "
+            f"{result['single_qps']:>8} {result['batch_qps']:>10} "
+            f"{parity['min_cosine']:>9}  {'ok' if parity['passed'] else 'FAIL'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Offline latency and cost report for marks-based model routing.
+
+Runs each question through RAGPipeline.generate_answer at every marks
+level (answer/semantic caches off) and reports, per route, the model,
+latency percentiles, token usage and estimated cost. With --compare the
+same questions are also answered with routing off (GROQ_MODEL for every
+level) to show what the small-model routes save. Embedding, retrieval
+and other caches are cleared before each pass so neither pass answers
+from the other's warm caches; the pass order is printed (--baseline-first
+swaps it). --output writes the answers as JSON lines for side-by-side
+quality review.
+
+Usage:
+    python benchmark_routing.py
+    python benchmark_routing.py --questions questions.jsonl --compare --output answers.jsonl
+    python benchmark_routing.py --compare --baseline-first
+    GROQ_BASE_URL=http://localhost:8001 GROQ_API_KEY=fake VECTOR_BACKEND=fake python benchmark_routing.py
+
+questions.jsonl: one {"query": ..., "marks": ...} per line; marks is
+optional (the question is then asked at every level).
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from config import config
+from model_router import estimate_cost
+from schema_service import SchemaService
+
+SAMPLE_QUESTIONS = [
+    "What is a deadlock?",
+    "Explain paging in operating systems.",
+    "What is normalization in DBMS?",
+    "Describe the TCP three-way handshake.",
+    "What is a binary search tree?"
+]
+
+
+def load_questions(path: str):
+    """(query, marks or None) pairs from a JSON-lines file, or the samples."""
+    if not path:
+        return [(query, None) for query in SAMPLE_QUESTIONS]
+    with open(path) as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    return [(item["query"], item.get("marks")) for item in items]
+
+
+def run_route(pipeline, marks: int, queries, namespace, output) -> dict:
+    """Answer `queries` at `marks`; return latency, usage and cost of the route."""
+    service = pipeline.router.service_for(marks)
+    before = dict(service.usage)
+    latencies, errors = [], 0
+
+    for query in queries:
+        start = time.perf_counter()
+        try:
+            result = pipeline.generate_answer(query=query, marks=marks, namespace=namespace, include_sources=False)
+        except Exception as e:
+            errors += 1
+            result = {"error": str(e)}
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        if output:
+            output.write(json.dumps({
+                "query": query,
+                "marks": marks,
+                "model": service.model,
+                "routing": pipeline.router.enabled,
+                "answer": result.get("answer"),
+                "error": result.get("error"),
+                "latency_ms": round(latencies[-1], 1)
+            }) + "\n")
+
+    answered = max(1, len(queries) - errors)
+    prompt_tokens = service.usage["prompt_tokens"] - before["prompt_tokens"]
+    completion_tokens = service.usage["completion_tokens"] - before["completion_tokens"]
+    cost = estimate_cost(service.model, prompt_tokens, completion_tokens)
+
+    return {
+        "model": service.model,
+        "n": len(queries),
+        "errors": errors,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+        "prompt_tokens": round(prompt_tokens / answered),
+        "completion_tokens": round(completion_tokens / answered),
+        "cost_per_1k": round(cost / answered * 1000, 4) if cost is not None else None
+    }
+
+
+def report(title: str, rows: dict):
+    print(f"\n{title}")
+    print(
+        f"{'marks':>5}  {'model':<28} {'n':>4} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'in tok':>7} {'out tok':>8} {'$ / 1k answers':>15}"
+    )
+    for marks, row in rows.items():
+        cost = "n/a" if row["cost_per_1k"] is None else f"{row['cost_per_1k']:.4f}"
+        print(
+            f"{marks:>5}  {row['model']:<28} {row['n']:>4} {row['errors']:>4} {row['p50_ms']:>8} "
+            f"{row['p95_ms']:>8} {row['prompt_tokens']:>7} {row['completion_tokens']:>8} {cost:>15}"
+        )
+
+
+def run(pipeline, routing: bool, questions, levels, namespace, output) -> dict:
+    """One pass over every level, starting from cold caches."""
+    pipeline.clear_caches()
+    pipeline.router.enabled = routing
+    rows = {}
+    for marks in levels:
+        queries = [query for query, q_marks in questions if q_marks in (None, marks)]
+        if queries:
+            rows[marks] = run_route(pipeline, marks, queries, namespace, output)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--questions", default="", help="JSON lines with query and optional marks")
+    parser.add_argument("--marks", default="", help="comma-separated marks levels (default: all schemas)")
+    parser.add_argument("--namespace", default=None)
+    parser.add_argument("--compare", action="store_true", help="also run with routing off")
+    parser.add_argument("--baseline-first", action="store_true", help="with --compare, run the baseline pass first")
+    parser.add_argument("--output", default="", help="write answers as JSON lines")
+    args = parser.parse_args()
+
+    # Measure the model, not the caches
+    config.ENABLE_ANSWER_CACHE = False
+    config.ENABLE_SEMANTIC_CACHE = False
+
+    from rag_pipeline import RAGPipeline
+
+    pipeline = RAGPipeline()
+    pipeline.router.warm_up()
+    questions = load_questions(args.questions)
+    levels = [int(m) for m in args.marks.split(",") if m.strip()] or sorted(SchemaService.SCHEMAS)
+    output = open(args.output, "w") if args.output else None
+
+    try:
+        passes = [True, False] if args.compare else [True]
+        if args.baseline_first:
+            passes.reverse()
+
+        rows = {}
+        for routing in passes:
+            rows[routing] = run(pipeline, routing, questions, levels, args.namespace, output)
+            if routing:
+                report("Routed", rows[routing])
+            else:
+                report(f"Baseline ({pipeline.llm_service.model} for every level)", rows[routing])
+
+        if args.compare:
+            routed, baseline = rows[True], rows[False]
+            order = " -> ".join("routed" if routing else "baseline" for routing in passes)
+            print(f"\nPass order: {order} (caches cleared before each pass)")
+            print(f"{'marks':>5}  {'p50 speed-up':>13} {'cost saving':>12}")
+            for marks, row in routed.items():
+                base = baseline[marks]
+                speedup = base["p50_ms"] / row["p50_ms"] if row["p50_ms"] else float("nan")
+                saving = "n/a"
+                if row["cost_per_1k"] is not None and base["cost_per_1k"]:
+                    saving = f"{1 - row['cost_per_1k'] / base['cost_per_1k']:.0%}"
+                print(f"{marks:>5}  {speedup:>12.2f}x {saving:>12}")
+    finally:
+        if output:
+            output.close()
+        pipeline.close()
+
+
+if __name__ == "__main__":
+    main()
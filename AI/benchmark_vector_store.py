@@ -0,0 +1,80 @@
+"""
+Tail-latency benchmark of the vector store resilience settings.
+
+Runs the same queries against FakeVectorStore (injected latency spikes and
+errors) with no protection, with retries, and with retries + hedging.
+
+Usage:
+    python benchmark_vector_store.py
+    python benchmark_vector_store.py --queries 1000 --tail-ms 800 --tail-probability 0.02 --error-rate 0.05
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from config import config
+from resilient_store import ResilientVectorStore
+from vector_store import FakeVectorStore
+
+
+def run(store, vectors, top_k: int) -> dict:
+    """Query every vector sequentially; return latency percentiles and failures."""
+    latencies, failures = [], 0
+    for vector in vectors:
+        start = time.perf_counter()
+        try:
+            store.query(vector, top_k)
+        except Exception:
+            failures += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 1),
+        "failures": failures
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=config.DEFAULT_TOP_K)
+    parser.add_argument("--latency-ms", type=float, default=config.FAKE_STORE_LATENCY_MS)
+    parser.add_argument("--tail-ms", type=float, default=config.FAKE_STORE_TAIL_LATENCY_MS)
+    parser.add_argument("--tail-probability", type=float, default=config.FAKE_STORE_TAIL_PROBABILITY)
+    parser.add_argument("--error-rate", type=float, default=config.FAKE_STORE_ERROR_RATE)
+    parser.add_argument("--timeout", type=float, default=config.VECTOR_TIMEOUT_S)
+    args = parser.parse_args()
+
+    def fake():
+        return FakeVectorStore(
+            dimension=config.FAKE_STORE_DIMENSION,
+            latency_ms=args.latency_ms,
+            tail_latency_ms=args.tail_ms,
+            tail_probability=args.tail_probability,
+            error_rate=args.error_rate
+        )
+
+    vectors = np.random.default_rng(1).standard_normal((args.queries, config.FAKE_STORE_DIMENSION))
+    variants = {
+        "plain": fake(),
+        "retries": ResilientVectorStore(fake(), timeout=args.timeout, retries=config.VECTOR_RETRIES),
+        "hedged": ResilientVectorStore(fake(), timeout=args.timeout, retries=config.VECTOR_RETRIES, hedge=True)
+    }
+
+    print(f"{'variant':<10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'failures':>9} {'backend calls':>14}")
+    for name, store in variants.items():
+        result = run(store, vectors, args.top_k)
+        calls = store.store.calls if isinstance(store, ResilientVectorStore) else store.calls
+        print(
+            f"{name:<10} {result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} "
+            f"{result['failures']:>9} {calls:>14}"
+        )
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Export Pinecone namespaces into a local vector index (VECTOR_BACKEND=local).
+
+Usage:
+    python build_local_index.py                       # default namespace
+    python build_local_index.py --namespaces os,dbms --out local_index
+
+Uses Pinecone's list/fetch APIs (serverless indexes).
+"""
+
+import argparse
+import logging
+
+from config import config
+from vector_store import LocalVectorStore, PineconeVectorStore
+
+logger = logging.getLogger(__name__)
+
+
+def export_namespace(store: PineconeVectorStore, namespace: str, out: str, fetch_batch: int = 100):
+    """Copy every vector of one Pinecone namespace into `out`."""
+    ids, vectors, metadata = [], [], []
+
+    for id_batch in store.index.list(namespace=namespace or ""):
+        for start in range(0, len(id_batch), fetch_batch):
+            response = store.index.fetch(ids=id_batch[start:start + fetch_batch], namespace=namespace or "")
+            for vector_id, vector in response.vectors.items():
+                ids.append(vector_id)
+                vectors.append(vector.values)
+                metadata.append(vector.metadata or {})
+
+    logger.info(f"Fetched {len(ids)} vectors from namespace={namespace or '(default)'}")
+
+    LocalVectorStore.build(
+        out,
+        ids,
+        vectors,
+        metadata,
+        namespace=namespace or None,
+        ivf_min_vectors=config.LOCAL_INDEX_IVF_MIN_VECTORS
+    )
+
+
+def main():
+    logging.basicConfig(level=config.LOG_LEVEL, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--index", default=config.PINECONE_INDEX_NAME)
+    parser.add_argument("--namespaces", default="", help="Comma-separated, empty = default namespace")
+    parser.add_argument("--out", default=config.LOCAL_INDEX_PATH)
+    args = parser.parse_args()
+
+    store = PineconeVectorStore(args.index)
+    for namespace in args.namespaces.split(","):
+        export_namespace(store, namespace.strip(), args.out)
+
+
+if __name__ == "__main__":
+    main()
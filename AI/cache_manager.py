@@ -1,71 +1,251 @@
 import hashlib
 import logging
-from functools import lru_cache
-from typing import List, Optional
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
 import numpy as np
 
 logger = logging.getLogger(__name__)
 
 
+def make_cache_key(query: str, model_name: str) -> bytes:
+    """md5 digest of model name + query, shared by every embedding cache tier."""
+    content = f"{model_name}:{query}"
+    return hashlib.md5(content.encode()).digest()
+
+
+class TTLCache:
+    """
+    Bounded in-memory LRU cache with per-entry TTL expiry.
+
+    get/set/evict are all O(1): an OrderedDict keeps entries in recency
+    order, so the eviction victim is always at the front. Expired entries
+    are dropped lazily when they are looked up or reach the front.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: Optional[float] = None, name: str = "cache"):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.name = name
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None on miss/expiry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entry if full."""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            elif len(self._entries) >= self.max_size:
+                self._evict_one()
+            self._entries[key] = (value, expires_at)
+
+    def delete(self, key: Hashable) -> bool:
+        """Remove a single entry. Returns True if it existed."""
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def _evict_one(self):
+        """Drop the least recently used entry (caller holds the lock)."""
+        if not self._entries:
+            return
+
+        _, (_, expires_at) = self._entries.popitem(last=False)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.expirations += 1
+        else:
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all entries. Counters are kept."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """Return cache statistics."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "total_accesses": lookups
+        }
+
+
 class EmbeddingCache:
     """
-    In-memory LRU cache for query embeddings.
+    In-memory LRU cache for query embeddings with TTL expiry.
+
+    Vectors live in one preallocated, contiguous float32 matrix of shape
+    (max_size, dimension); the LRU index only maps keys to row slots.
+    That is ~4 bytes per dimension instead of a boxed Python float each.
     For production, replace with Redis.
     """
-    
-    def __init__(self, max_size: int = 1000):
+
+    def __init__(
+        self,
+        max_size: int = 1000,
+        dimension: Optional[int] = None,
+        ttl: Optional[float] = None
+    ):
         self.max_size = max_size
-        self._cache = {}
-        self._access_count = {}
-        logger.info(f"Initialized embedding cache with max_size={max_size}")
-    
-    def _generate_key(self, query: str, model_name: str) -> str:
-        """Generate cache key from query and model name."""
-        content = f"{model_name}:{query}"
-        return hashlib.md5(content.encode()).hexdigest()
-    
-    def get(self, query: str, model_name: str) -> Optional[List[float]]:
-        """Retrieve cached embedding."""
-        key = self._generate_key(query, model_name)
-        
-        if key in self._cache:
-            self._access_count[key] = self._access_count.get(key, 0) + 1
+        self.dimension = dimension
+        self.ttl = ttl
+
+        self._slots = OrderedDict()  # key -> row in _matrix, in recency order
+        self._free = list(range(max_size - 1, -1, -1))
+        self._expires = np.zeros(max_size, dtype=np.float64)
+        self._matrix = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        if dimension:
+            self._allocate(dimension)
+
+        logger.info(
+            f"Initialized embedding cache with max_size={max_size}, "
+            f"dimension={dimension}, ttl={ttl}"
+        )
+
+    def _allocate(self, dimension: int):
+        """Preallocate the backing float32 matrix."""
+        self.dimension = dimension
+        self._matrix = np.zeros((self.max_size, dimension), dtype=np.float32)
+
+    def get(self, query: str, model_name: str) -> Optional[np.ndarray]:
+        """
+        Retrieve cached embedding.
+
+        Returns a private copy of the matrix row, since the row is reused
+        as soon as the entry is evicted or overwritten.
+        """
+        embedding = self.get_key(make_cache_key(query, model_name))
+
+        if embedding is not None:
             logger.debug(f"Cache HIT for query: {query[:50]}...")
-            return self._cache[key]
-        
-        logger.debug(f"Cache MISS for query: {query[:50]}...")
-        return None
-    
-    def set(self, query: str, model_name: str, embedding: List[float]):
-        """Store embedding in cache."""
-        if len(self._cache) >= self.max_size:
-            self._evict_least_used()
-        
-        key = self._generate_key(query, model_name)
-        self._cache[key] = embedding
-        self._access_count[key] = 1
+        else:
+            logger.debug(f"Cache MISS for query: {query[:50]}...")
+        return embedding
+
+    def get_key(self, key: bytes) -> Optional[np.ndarray]:
+        """Retrieve cached embedding by precomputed cache key."""
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                self.misses += 1
+                return None
+
+            if self.ttl and self._expires[slot] <= time.monotonic():
+                del self._slots[key]
+                self._free.append(slot)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._slots.move_to_end(key)
+            self.hits += 1
+            return self._matrix[slot].copy()
+
+    def set(self, query: str, model_name: str, embedding):
+        """Store embedding in cache (copied into its matrix row)."""
+        self.set_key(make_cache_key(query, model_name), embedding)
         logger.debug(f"Cache SET for query: {query[:50]}...")
-    
-    def _evict_least_used(self):
-        """Remove least frequently used item."""
-        if not self._cache:
-            return
-        
-        least_used_key = min(self._access_count, key=self._access_count.get)
-        del self._cache[least_used_key]
-        del self._access_count[least_used_key]
-        logger.debug(f"Evicted least used cache entry")
-    
+
+    def set_key(self, key: bytes, embedding):
+        """Store embedding by precomputed cache key."""
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+
+        with self._lock:
+            if self._matrix is None:
+                self._allocate(vector.shape[0])
+            elif vector.shape[0] != self.dimension:
+                raise ValueError(
+                    f"Embedding dimension {vector.shape[0]} does not match "
+                    f"cache dimension {self.dimension}"
+                )
+
+            slot = self._slots.get(key)
+            if slot is None:
+                if not self._free:
+                    self._evict_one()
+                slot = self._free.pop()
+                self._slots[key] = slot
+            else:
+                self._slots.move_to_end(key)
+
+            self._matrix[slot] = vector
+            if self.ttl:
+                self._expires[slot] = time.monotonic() + self.ttl
+
+    def _evict_one(self):
+        """Release the least recently used slot (caller holds the lock)."""
+        _, slot = self._slots.popitem(last=False)
+        self._free.append(slot)
+        if self.ttl and self._expires[slot] <= time.monotonic():
+            self.expirations += 1
+        else:
+            self.evictions += 1
+
     def clear(self):
         """Clear all cached embeddings."""
-        self._cache.clear()
-        self._access_count.clear()
+        with self._lock:
+            self._slots.clear()
+            self._free = list(range(self.max_size - 1, -1, -1))
         logger.info("Cache cleared")
-    
+
     def stats(self) -> dict:
         """Return cache statistics."""
+        lookups = self.hits + self.misses
         return {
-            "size": len(self._cache),
+            "size": len(self._slots),
             "max_size": self.max_size,
-            "total_accesses": sum(self._access_count.values())
-        }
\ No newline at end of file
+            "dimension": self.dimension,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "total_accesses": lookups,
+            "memory_bytes": self._matrix.nbytes if self._matrix is not None else 0
+        }
@@ -0,0 +1,103 @@
+import logging
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+METHODS = ("threshold", "mmr")
+
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def dedup_chunks(
+    documents: List[Dict[str, Any]],
+    query_vector=None,
+    method: str = "threshold",
+    threshold: float = 0.95,
+    mmr_lambda: float = 0.7
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Drop near-duplicate retrieved chunks using their vectors.
+
+    All pairwise cosine similarities come from one (n, n) matrix product.
+    Methods:
+        threshold: walk the chunks best first and keep one unless it is at
+                   least `threshold` similar to a chunk already kept
+        mmr:       same duplicate cut, but the kept chunks are reordered by
+                   maximal marginal relevance, i.e. mmr_lambda * relevance to
+                   the query - (1 - mmr_lambda) * max similarity to the chunks
+                   picked so far, so token packing prefers diverse content
+
+    Documents without "values" are kept as they are.
+
+    Returns:
+        (kept, removed) document lists
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown dedup method '{method}', expected one of {METHODS}")
+
+    with_values = [i for i, doc in enumerate(documents) if doc.get("values") is not None]
+    if len(with_values) < 2:
+        return list(documents), []
+
+    vectors = _normalize([documents[i]["values"] for i in with_values])
+    similarity = vectors @ vectors.T
+
+    # Greedy duplicate cut in rank order (documents arrive best first)
+    kept_rows = []
+    for row in range(len(with_values)):
+        if not kept_rows or similarity[row, kept_rows].max() < threshold:
+            kept_rows.append(row)
+
+    if method == "mmr" and query_vector is not None and len(kept_rows) > 1:
+        kept_rows = _mmr_order(vectors, similarity, kept_rows, query_vector, mmr_lambda)
+
+    kept_ids = {with_values[row] for row in kept_rows}
+    removed = [
+        documents[i] for i in with_values if i not in kept_ids
+    ]
+    kept = [documents[with_values[row]] for row in kept_rows]
+    kept += [doc for i, doc in enumerate(documents) if doc.get("values") is None]
+
+    return kept, removed
+
+
+def _mmr_order(
+    vectors: np.ndarray,
+    similarity: np.ndarray,
+    rows: List[int],
+    query_vector,
+    mmr_lambda: float
+) -> List[int]:
+    """Order `rows` by maximal marginal relevance to the query."""
+    relevance = vectors[rows] @ _normalize(query_vector)[0]
+    pair = similarity[np.ix_(rows, rows)]
+
+    order = [int(np.argmax(relevance))]
+    redundancy = pair[order[0]].copy()  # max similarity to anything picked so far
+    remaining = np.ones(len(rows), dtype=bool)
+    remaining[order[0]] = False
+
+    while remaining.any():
+        score = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+        score[~remaining] = -np.inf
+        best = int(np.argmax(score))
+        order.append(best)
+        remaining[best] = False
+        np.maximum(redundancy, pair[best], out=redundancy)
+
+    return [rows[i] for i in order]
+
+
+def strip_values(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Copies of the documents without their vectors (for prompts/responses)."""
+    return [
+        {key: value for key, value in doc.items() if key != "values"}
+        for doc in documents
+    ]
@@ -13,25 +13,120 @@ class Config:
     PINECONE_INDEX_NAME: str = os.getenv("PINECONE_INDEX_NAME")
     PINECONE_NAMESPACE: Optional[str] = os.getenv("PINECONE_NAMESPACE", None)
     
+    # Vector store backend: "pinecone", "local" (in-process, memory-mapped from
+    # LOCAL_INDEX_PATH) or "fake" (latency/error injection for testing)
+    VECTOR_BACKEND: str = os.getenv("VECTOR_BACKEND", "pinecone")
+    LOCAL_INDEX_PATH: str = os.getenv("LOCAL_INDEX_PATH", "local_index")
+    LOCAL_INDEX_NPROBE: int = int(os.getenv("LOCAL_INDEX_NPROBE", "16"))  # IVF lists scanned per query
+    LOCAL_INDEX_IVF_MIN_VECTORS: int = int(os.getenv("LOCAL_INDEX_IVF_MIN_VECTORS", "50000"))
+    
+    # Remote vector store calls (pinecone, fake): connection pool, deadline,
+    # jittered exponential retries and optional hedging at the recent p95
+    PINECONE_POOL_THREADS: int = int(os.getenv("PINECONE_POOL_THREADS", "8"))
+    VECTOR_TIMEOUT_S: float = float(os.getenv("VECTOR_TIMEOUT_S", "2.0"))  # whole call incl. retries
+    VECTOR_RETRIES: int = int(os.getenv("VECTOR_RETRIES", "2"))
+    VECTOR_RETRY_BASE_MS: float = float(os.getenv("VECTOR_RETRY_BASE_MS", "50"))
+    VECTOR_RETRY_MAX_MS: float = float(os.getenv("VECTOR_RETRY_MAX_MS", "1000"))
+    VECTOR_HEDGE: bool = os.getenv("VECTOR_HEDGE", "false").lower() == "true"
+    VECTOR_HEDGE_PERCENTILE: float = float(os.getenv("VECTOR_HEDGE_PERCENTILE", "95"))
+    VECTOR_HEDGE_MIN_MS: float = float(os.getenv("VECTOR_HEDGE_MIN_MS", "20"))
+    # VECTOR_BACKEND=fake: random in-memory index with injected latency/errors
+    FAKE_STORE_DIMENSION: int = int(os.getenv("FAKE_STORE_DIMENSION", "768"))
+    FAKE_STORE_LATENCY_MS: float = float(os.getenv("FAKE_STORE_LATENCY_MS", "20"))
+    FAKE_STORE_TAIL_LATENCY_MS: float = float(os.getenv("FAKE_STORE_TAIL_LATENCY_MS", "500"))
+    FAKE_STORE_TAIL_PROBABILITY: float = float(os.getenv("FAKE_STORE_TAIL_PROBABILITY", "0.05"))
+    FAKE_STORE_ERROR_RATE: float = float(os.getenv("FAKE_STORE_ERROR_RATE", "0.02"))
+    
     # Embedding model settings
     EMBEDDING_MODEL_NAME: str = "sentence-transformers/all-mpnet-base-v2"
-    EMBEDDING_DEVICE: str = "cpu"  # Change to "cuda" for GPU
+    EMBEDDING_DEVICE: str = os.getenv("EMBEDDING_DEVICE", "cpu")  # Change to "cuda" for GPU
+    # Inference backend: "torch" (fp32), "torch-int8", "onnx", "onnx-int8"
+    EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "torch")
+    EMBEDDING_ONNX_FILE: str = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+    # Compare non-fp32 backends against fp32 at startup; fall back to fp32 below threshold
+    EMBEDDING_PARITY_CHECK: bool = os.getenv("EMBEDDING_PARITY_CHECK", "true").lower() == "true"
+    EMBEDDING_PARITY_THRESHOLD: float = float(os.getenv("EMBEDDING_PARITY_THRESHOLD", "0.99"))
     EMBEDDING_BATCH_SIZE: int = 32
     NORMALIZE_EMBEDDINGS: bool = True
+    # Coalesce concurrent single-query embeds into one forward pass
+    ENABLE_EMBEDDING_BATCHING: bool = os.getenv("ENABLE_EMBEDDING_BATCHING", "true").lower() == "true"
+    EMBEDDING_BATCH_MAX_WAIT_MS: float = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))
+    EMBEDDING_BATCH_MAX_SIZE: int = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", str(EMBEDDING_BATCH_SIZE)))
+    EMBEDDING_BATCH_TIMEOUT_S: float = float(os.getenv("EMBEDDING_BATCH_TIMEOUT_S", "30"))  # sync callers
     
     # Retrieval settings
     DEFAULT_TOP_K: int = 5
     MAX_TOP_K: int = 20
+    # Adaptive top_k (generation without an explicit top_k): fetch the schema's
+    # max chunks, then stop at the first big score drop (never below the min)
+    ENABLE_ADAPTIVE_TOP_K: bool = os.getenv("ENABLE_ADAPTIVE_TOP_K", "true").lower() == "true"
+    ADAPTIVE_RELATIVE_SCORE: float = float(os.getenv("ADAPTIVE_RELATIVE_SCORE", "0.85"))  # of best score
+    ADAPTIVE_SCORE_GAP: float = float(os.getenv("ADAPTIVE_SCORE_GAP", "0.08"))  # drop between neighbours
     
     # Cache settings
     ENABLE_CACHE: bool = True
-    CACHE_TTL: int = 3600  # 1 hour
-    CACHE_MAX_SIZE: int = 1000
+    CACHE_TTL: int = int(os.getenv("CACHE_TTL", "3600"))  # 1 hour, 0 disables expiry
+    # Entries are float32 rows of one preallocated matrix (~3 KB each for mpnet)
+    CACHE_MAX_SIZE: int = int(os.getenv("CACHE_MAX_SIZE", "10000"))
+    # "memory" = per-worker cache, "shared" = one mmap-backed table for all workers on the host
+    CACHE_BACKEND: str = os.getenv("CACHE_BACKEND", "memory")
+    SHARED_CACHE_PATH: str = os.getenv("SHARED_CACHE_PATH", "/dev/shm/rag-embedding-cache.bin")
+    # Optional append-only log used to warm the cache after restarts ("" disables)
+    CACHE_PERSIST_PATH: str = os.getenv("CACHE_PERSIST_PATH", "")
+    CACHE_PERSIST_COMPACT_RATIO: float = float(os.getenv("CACHE_PERSIST_COMPACT_RATIO", "2.0"))
+    
+    # Semantic cache: reuse retrievals/answers for near-duplicate questions
+    ENABLE_SEMANTIC_CACHE: bool = os.getenv("ENABLE_SEMANTIC_CACHE", "true").lower() == "true"
+    SEMANTIC_CACHE_THRESHOLD: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))  # cosine
+    SEMANTIC_CACHE_MAX_SIZE: int = int(os.getenv("SEMANTIC_CACHE_MAX_SIZE", "2000"))
+    SEMANTIC_CACHE_TTL: int = int(os.getenv("SEMANTIC_CACHE_TTL", str(CACHE_TTL)))
+    
+    # Exact retrieval-result cache (vector hash + top_k/namespace/filter)
+    ENABLE_RETRIEVAL_CACHE: bool = os.getenv("ENABLE_RETRIEVAL_CACHE", "true").lower() == "true"
+    RETRIEVAL_CACHE_MAX_SIZE: int = int(os.getenv("RETRIEVAL_CACHE_MAX_SIZE", "5000"))
+    RETRIEVAL_CACHE_TTL: int = int(os.getenv("RETRIEVAL_CACHE_TTL", "600"))
+    # Chunk vectors (include_values, for dedup) are cached once per chunk in a
+    # float32 matrix, not inside cached results: ~3KB per entry at 768-d
+    CHUNK_VECTOR_CACHE_SIZE: int = int(os.getenv("CHUNK_VECTOR_CACHE_SIZE", "5000"))
+    # Drop near-duplicate retrieved chunks (overlapping windows) before prompting.
+    # "threshold" keeps rank order, "mmr" also reorders for diversity
+    ENABLE_CHUNK_DEDUP: bool = os.getenv("ENABLE_CHUNK_DEDUP", "true").lower() == "true"
+    CHUNK_DEDUP_METHOD: str = os.getenv("CHUNK_DEDUP_METHOD", "threshold")
+    CHUNK_DEDUP_THRESHOLD: float = float(os.getenv("CHUNK_DEDUP_THRESHOLD", "0.95"))  # cosine
+    CHUNK_DEDUP_MMR_LAMBDA: float = float(os.getenv("CHUNK_DEDUP_MMR_LAMBDA", "0.7"))
+    # Exact answer cache (normalized query + marks + context hash + LLM settings)
+    ENABLE_ANSWER_CACHE: bool = os.getenv("ENABLE_ANSWER_CACHE", "true").lower() == "true"
+    ANSWER_CACHE_MAX_SIZE: int = int(os.getenv("ANSWER_CACHE_MAX_SIZE", "5000"))
+    ANSWER_CACHE_TTL: int = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+    ANSWER_REPLAY_CHUNK_CHARS: int = int(os.getenv("ANSWER_REPLAY_CHUNK_CHARS", "32"))  # /generate/stream hits
+    # Coalesce identical in-flight /generate and /generate/stream requests
+    ENABLE_SINGLE_FLIGHT: bool = os.getenv("ENABLE_SINGLE_FLIGHT", "true").lower() == "true"
+    # /generate/batch: questions per request, answers generated at the same time
+    GENERATE_BATCH_MAX_ITEMS: int = int(os.getenv("GENERATE_BATCH_MAX_ITEMS", "50"))
+    GENERATE_BATCH_CONCURRENCY: int = int(os.getenv("GENERATE_BATCH_CONCURRENCY", "8"))
+    # Short-answer schemas: keep only the chunk sentences closest to the query
+    ENABLE_SENTENCE_EXTRACTION: bool = os.getenv("ENABLE_SENTENCE_EXTRACTION", "false").lower() == "true"
+    SENTENCE_CACHE_MAX_SIZE: int = int(os.getenv("SENTENCE_CACHE_MAX_SIZE", "5000"))  # chunks
+    # Sharded retrieval (a list of namespaces, or "index:namespace" shards):
+    # parallel fan-out, shards slower than the deadline are left out
+    SHARD_MAX_WORKERS: int = int(os.getenv("SHARD_MAX_WORKERS", "16"))
+    SHARD_DEADLINE_S: float = float(os.getenv("SHARD_DEADLINE_S", "1.0"))
+    # /stats serves index stats from memory, refreshed in the background
+    INDEX_STATS_REFRESH_S: float = float(os.getenv("INDEX_STATS_REFRESH_S", "60"))
     
     # API settings
     API_HOST: str = "0.0.0.0"
     API_PORT: int = 8000
     API_WORKERS: int = 4
+    
+    # Async request path: blocking stages run in a bounded thread pool,
+    # each stage with its own concurrency limit
+    EXECUTOR_MAX_WORKERS: int = int(os.getenv("EXECUTOR_MAX_WORKERS", "16"))
+    EMBED_CONCURRENCY: int = int(os.getenv("EMBED_CONCURRENCY", "4"))
+    RETRIEVE_CONCURRENCY: int = int(os.getenv("RETRIEVE_CONCURRENCY", "12"))
+    LLM_CONCURRENCY: int = int(os.getenv("LLM_CONCURRENCY", "32"))
+    # Max concurrent vector store queries for one /query/batch request
+    BATCH_RETRIEVE_CONCURRENCY: int = int(os.getenv("BATCH_RETRIEVE_CONCURRENCY", "8"))
 
     # CORS settings (comma-separated origins in .env, e.g. "http://localhost:5173,http://localhost:5174")
     CORS_ORIGINS: list[str] = [
@@ -50,6 +145,35 @@ class Config:
     GROQ_MODEL: str = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
     GROQ_TEMPERATURE: float = float(os.getenv("GROQ_TEMPERATURE", "0.7"))
     GROQ_MAX_TOKENS: int = int(os.getenv("GROQ_MAX_TOKENS", "1024"))
+    # Marks-based model routing: schema model_tier -> model; MODEL_ROUTES
+    # overrides single marks levels, e.g. "5=large,10=llama-3.1-8b-instant"
+    ENABLE_MODEL_ROUTING: bool = os.getenv("ENABLE_MODEL_ROUTING", "true").lower() == "true"
+    GROQ_SMALL_MODEL: str = os.getenv("GROQ_SMALL_MODEL", "llama-3.1-8b-instant")
+    MODEL_ROUTES: str = os.getenv("MODEL_ROUTES", "")
+    GROQ_BASE_URL: str = os.getenv("GROQ_BASE_URL", "")  # "" = api.groq.com; e.g. http://localhost:8001 for fake_llm_server
+    # Pooled HTTP connections shared by all LLM requests of a process
+    LLM_MAX_CONNECTIONS: int = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+    LLM_MAX_KEEPALIVE: int = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+    LLM_TIMEOUT_S: float = float(os.getenv("LLM_TIMEOUT_S", "60"))
+    # Client-side rate limits per model and per process (0 = off); divide the
+    # account's limits by the number of workers
+    LLM_RPM: int = int(os.getenv("LLM_RPM", "0"))
+    LLM_TPM: int = int(os.getenv("LLM_TPM", "0"))
+    # 429s wait for Retry-After; 5xx/connection errors back off exponentially
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "3"))
+    LLM_RETRY_BASE_MS: float = float(os.getenv("LLM_RETRY_BASE_MS", "500"))
+    LLM_RETRY_MAX_MS: float = float(os.getenv("LLM_RETRY_MAX_MS", "8000"))
+    # fake_llm_server.py (local OpenAI-compatible stand-in for Groq)
+    FAKE_LLM_LATENCY_MS: float = float(os.getenv("FAKE_LLM_LATENCY_MS", "200"))  # time to first token
+    FAKE_LLM_TOKEN_MS: float = float(os.getenv("FAKE_LLM_TOKEN_MS", "10"))
+    FAKE_LLM_RPM: int = int(os.getenv("FAKE_LLM_RPM", "0"))  # 429 above this, 0 = unlimited
+    FAKE_LLM_ERROR_RATE: float = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))  # 503s
+    # Prompt budgeting: context is packed to fit min(schema context_tokens,
+    # LLM_CONTEXT_WINDOW - max_tokens - prompt overhead)
+    LLM_CONTEXT_WINDOW: int = int(os.getenv("LLM_CONTEXT_WINDOW", "8192"))
+    LLM_MAX_COMPLETION_TOKENS: int = int(os.getenv("LLM_MAX_COMPLETION_TOKENS", "8192"))  # max_tokens is capped here
+    TOKENIZER_NAME: str = os.getenv("TOKENIZER_NAME", "")  # HF tokenizer, "" = by model family
+    TOKEN_COUNT_CACHE_SIZE: int = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "20000"))
     
     # Logging
     LOG_LEVEL: str = "INFO"
@@ -0,0 +1,105 @@
+import logging
+from typing import TYPE_CHECKING, Dict, List
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+# Representative exam queries used for the fp32 parity check
+PARITY_SAMPLES = [
+    "What is deadlock?",
+    "Define normalization in DBMS with an example.",
+    "Explain the working of TCP three-way handshake.",
+    "Differentiate between process and thread.",
+    "What are the advantages of object oriented programming?",
+    "Explain paging and segmentation in operating systems.",
+    "Describe the phases of a compiler.",
+    "What is the time complexity of quicksort in the worst case?",
+    "Explain Ohm's law and its limitations.",
+    "What is an activation function in neural networks?",
+    "Discuss the OSI reference model in detail.",
+    "State and explain Kirchhoff's laws."
+]
+
+
+def load_model(
+    backend: str,
+    model_name: str,
+    device: str = "cpu",
+    onnx_file: str = None
+) -> "SentenceTransformer":
+    """
+    Load a SentenceTransformer for the given inference backend.
+
+    Backends:
+        torch:      full-precision PyTorch (reference)
+        torch-int8: PyTorch with dynamic int8 quantization of Linear layers (CPU)
+        onnx:       ONNX Runtime, fp32 graph
+        onnx-int8:  ONNX Runtime, dynamically quantized int8 graph (`onnx_file`)
+
+    All backends return the same SentenceTransformer interface, so encode()
+    and get_sentence_embedding_dimension() work unchanged.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {BACKENDS}")
+
+    # Imported lazily: pulls in torch/transformers (seconds of startup)
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(model_name, device=device)
+
+    if backend == "torch-int8":
+        import torch
+
+        model = SentenceTransformer(model_name, device="cpu")
+        torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+        return model
+
+    # ONNX Runtime (needs `pip install sentence-transformers[onnx]`)
+    model_kwargs = {"provider": "CPUExecutionProvider"}
+    if backend == "onnx-int8":
+        model_kwargs["file_name"] = onnx_file
+
+    return SentenceTransformer(
+        model_name,
+        device=device,
+        backend="onnx",
+        model_kwargs=model_kwargs
+    )
+
+
+def parity_check(
+    reference: "SentenceTransformer",
+    candidate: "SentenceTransformer",
+    texts: List[str] = None,
+    threshold: float = 0.99
+) -> Dict[str, float]:
+    """
+    Compare candidate embeddings against the fp32 reference.
+
+    Returns mean/min cosine similarity between matching rows and whether
+    the minimum clears `threshold`.
+    """
+    texts = texts or PARITY_SAMPLES
+
+    ref = reference.encode(texts, normalize_embeddings=True, show_progress_bar=False)
+    cand = candidate.encode(texts, normalize_embeddings=True, show_progress_bar=False)
+
+    cosines = np.sum(np.asarray(ref) * np.asarray(cand), axis=1)
+
+    return {
+        "samples": len(texts),
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "min_cosine": round(float(cosines.min()), 6),
+        "threshold": threshold,
+        "passed": bool(cosines.min() >= threshold)
+    }
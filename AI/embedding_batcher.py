@@ -0,0 +1,162 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent single-text embed requests into batched encodes.
+
+    Callers submit() a text and get a Future. A background thread waits
+    up to `max_wait_ms` after the first pending request (or until
+    `max_batch_size` texts are queued), encodes the batch in one forward
+    pass, and resolves every caller's future with its row.
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0
+    ):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+
+        self.batches = 0
+        self.items = 0
+        self.histogram = {}  # power-of-two bucket upper bound -> batch count
+        self._wait_total = 0.0
+
+        self._thread = threading.Thread(
+            target=self._run, name="embedding-batcher", daemon=True
+        )
+        self._thread.start()
+
+        logger.info(
+            f"Initialized embedding batcher with max_batch_size={max_batch_size}, "
+            f"max_wait_ms={max_wait_ms}"
+        )
+
+    def submit(self, text: str) -> Future:
+        """Queue a text for the next batch and return a future for its vector."""
+        future = Future()
+        if self._stopped.is_set():
+            future.set_exception(RuntimeError("Embedding batcher is stopped"))
+            return future
+
+        self._queue.put((text, future, time.monotonic()))
+        return future
+
+    def _collect(self) -> list:
+        """Block for the first request, then gather more until full or timed out."""
+        batch = [self._queue.get()]
+        if batch[0] is None:
+            return []
+
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._stopped.set()
+                break
+            batch.append(item)
+
+        return batch
+
+    @staticmethod
+    def _resolve(future: Future, result=None, error: BaseException = None):
+        """Settle one caller's future; a cancelled or broken one must not stop the worker."""
+        try:
+            if future.cancelled():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except Exception as e:
+            logger.warning(f"Could not resolve embedding future: {str(e)}")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._collect()
+            if not batch:
+                break
+
+            # Callers that gave up (e.g. client disconnect) are not encoded
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            # Identical texts within a window share one row
+            unique = list(dict.fromkeys(text for text, _, _ in batch))
+
+            try:
+                vectors = self.encode_fn(unique)
+            except Exception as e:
+                logger.error(f"Batched encoding failed: {str(e)}")
+                for _, future, _ in batch:
+                    self._resolve(future, error=e)
+                continue
+
+            rows = {text: vectors[i] for i, text in enumerate(unique)}
+            now = time.monotonic()
+            for text, future, queued_at in batch:
+                self._wait_total += now - queued_at
+                self._resolve(future, rows[text])
+
+            self._record(len(batch))
+
+    def _record(self, size: int):
+        self.batches += 1
+        self.items += size
+        bucket = 1
+        while bucket < size:
+            bucket *= 2
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def close(self):
+        """Stop the worker thread after draining queued requests."""
+        self._queue.put(None)
+        self._thread.join(timeout=5.0)
+        self._stopped.set()
+
+        # Anything submitted after the sentinel would otherwise wait forever
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self._resolve(item[1], error=RuntimeError("Embedding batcher is stopped"))
+
+    def stats(self) -> dict:
+        """Return batching statistics, including a batch-size histogram."""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "mean_wait_ms": round(self._wait_total / self.items * 1000.0, 3) if self.items else 0.0,
+            "pending": self._queue.qsize(),
+            "batch_size_histogram": {
+                f"<={bucket}": count for bucket, count in sorted(self.histogram.items())
+            }
+        }
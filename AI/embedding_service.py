@@ -1,9 +1,15 @@
+import asyncio
 import logging
-from typing import List, Union
-from sentence_transformers import SentenceTransformer
+from typing import List
+
+import numpy as np
 
 from config import config
-from cache_manager import EmbeddingCache
+from cache_manager import EmbeddingCache, make_cache_key
+from embedding_backends import PARITY_SAMPLES, load_model, parity_check
+from embedding_batcher import EmbeddingBatcher
+from persistent_cache import PersistentEmbeddingStore
+from shared_cache import SharedEmbeddingCache
 
 logger = logging.getLogger(__name__)
 
@@ -18,83 +24,254 @@ class EmbeddingService:
         self,
         model_name: str = None,
         device: str = None,
-        enable_cache: bool = None
+        enable_cache: bool = None,
+        backend: str = None
     ):
         self.model_name = model_name or config.EMBEDDING_MODEL_NAME
         self.device = device or config.EMBEDDING_DEVICE
+        self.backend = backend or config.EMBEDDING_BACKEND
         self.enable_cache = enable_cache if enable_cache is not None else config.ENABLE_CACHE
         
-        # Initialize cache
+        # Load model (happens once)
+        self._load_model()
+        
+        # Initialize cache (sized to the model's embedding dimension)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.store = None
         if self.enable_cache:
-            self.cache = EmbeddingCache(max_size=config.CACHE_MAX_SIZE)
+            self.cache = self._create_cache(self.dimension)
+            if config.CACHE_PERSIST_PATH:
+                self._load_store(self.dimension)
         else:
             self.cache = None
         
-        # Load model (happens once)
-        self._load_model()
+        # Coalesce concurrent embed_single calls into batched encodes
+        if config.ENABLE_EMBEDDING_BATCHING:
+            self.batcher = EmbeddingBatcher(
+                encode_fn=self._encode,
+                max_batch_size=config.EMBEDDING_BATCH_MAX_SIZE,
+                max_wait_ms=config.EMBEDDING_BATCH_MAX_WAIT_MS
+            )
+        else:
+            self.batcher = None
+    
+    def _create_cache(self, dimension: int):
+        """Build the configured cache backend, falling back to in-process memory."""
+        if config.CACHE_BACKEND == "shared":
+            try:
+                return SharedEmbeddingCache(
+                    path=config.SHARED_CACHE_PATH,
+                    dimension=dimension,
+                    max_size=config.CACHE_MAX_SIZE,
+                    ttl=config.CACHE_TTL
+                )
+            except (OSError, RuntimeError) as e:
+                logger.warning(f"Shared cache unavailable ({e}), using in-memory cache")
+        
+        return EmbeddingCache(
+            max_size=config.CACHE_MAX_SIZE,
+            dimension=dimension,
+            ttl=config.CACHE_TTL
+        )
+    
+    def _load_store(self, dimension: int):
+        """Open the persistent embedding log and warm the cache from it."""
+        self.store = PersistentEmbeddingStore(
+            path=config.CACHE_PERSIST_PATH,
+            dimension=dimension,
+            model_name=self.model_name,
+            max_records=config.CACHE_MAX_SIZE,
+            compact_ratio=config.CACHE_PERSIST_COMPACT_RATIO
+        )
+        
+        for key, embedding in self.store.load():
+            self.cache.set_key(key, embedding)
     
     def _load_model(self):
-        """Load the embedding model."""
+        """Load the embedding model on the configured inference backend."""
         logger.info(f"Loading embedding model: {self.model_name}")
-        logger.info(f"Device: {self.device}")
+        logger.info(f"Device: {self.device}, backend: {self.backend}")
         
-        self.model = SentenceTransformer(
+        self.model = load_model(
+            self.backend,
             self.model_name,
-            device=self.device
+            device=self.device,
+            onnx_file=config.EMBEDDING_ONNX_FILE
         )
         
+        # Quantized backends must agree with the fp32 model the index was built with
+        self.parity = None
+        if self.backend != "torch" and config.EMBEDDING_PARITY_CHECK:
+            reference = load_model("torch", self.model_name, device=self.device)
+            self.parity = parity_check(
+                reference,
+                self.model,
+                threshold=config.EMBEDDING_PARITY_THRESHOLD
+            )
+            logger.info(f"Embedding parity vs fp32: {self.parity}")
+            
+            if not self.parity["passed"]:
+                logger.error(
+                    f"Backend {self.backend} failed parity check, falling back to torch"
+                )
+                self.backend = "torch"
+                self.model = reference
+        
         logger.info("Embedding model loaded successfully")
     
-    def embed_single(self, query: str) -> List[float]:
+    def embed_single(self, query: str) -> np.ndarray:
         """
         Generate embedding for a single query.
         Uses cache if enabled.
+        
+        Returns a float32 vector (cached results are copies of the cache
+        row). Convert with .tolist() only at the API boundary.
         """
+        key = make_cache_key(query, self.model_name)
+        
         # Check cache first
         if self.cache:
-            cached_embedding = self.cache.get(query, self.model_name)
+            cached_embedding = self.cache.get_key(key)
             if cached_embedding is not None:
                 return cached_embedding
         
-        # Generate embedding
-        embedding = self.model.encode(
-            query,
-            normalize_embeddings=config.NORMALIZE_EMBEDDINGS,
-            show_progress_bar=False
-        )
+        # Generate embedding (shared forward pass with concurrent callers if batching)
+        if self.batcher:
+            embedding = self.batcher.submit(query).result(timeout=config.EMBEDDING_BATCH_TIMEOUT_S)
+        else:
+            embedding = self._encode([query])[0]
         
-        embedding_list = embedding.tolist()
+        self._remember(key, embedding)
+        return embedding
+    
+    async def aembed_single(self, query: str) -> np.ndarray:
+        """
+        Async embed_single for the micro-batching path.
+        
+        Awaits the batcher's future instead of parking a thread on it.
+        Without a batcher, callers should run embed_single in a thread pool.
+        """
+        if self.batcher is None:
+            raise RuntimeError("aembed_single requires embedding batching to be enabled")
+        
+        key = make_cache_key(query, self.model_name)
         
-        # Store in cache
         if self.cache:
-            self.cache.set(query, self.model_name, embedding_list)
+            cached_embedding = self.cache.get_key(key)
+            if cached_embedding is not None:
+                return cached_embedding
+        
+        embedding = await asyncio.wrap_future(self.batcher.submit(query))
         
-        return embedding_list
+        self._remember(key, embedding)
+        return embedding
+    
+    def warm_up(self):
+        """Run a few throwaway encodes so the first real request is not slow."""
+        self._encode(PARITY_SAMPLES[:1])
+        self._encode(PARITY_SAMPLES)
     
-    def embed_batch(self, queries: List[str]) -> List[List[float]]:
+    def embed_uncached(self, query: str) -> np.ndarray:
+        """Encode a single query, bypassing (and not populating) the cache."""
+        return self._encode([query])[0]
+    
+    def embed_batch_uncached(self, texts: List[str]) -> np.ndarray:
+        """Encode many texts in one call, bypassing (and not populating) the cache."""
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        return self._encode(texts)
+    
+    def embed_batch(self, queries: List[str]) -> np.ndarray:
         """
         Generate embeddings for multiple queries in batch.
         Much faster than individual encoding.
+        
+        Duplicate queries are encoded once, cached queries are served from
+        the cache, and only the misses go to the model (in one call).
+        Rows are returned in input order.
         """
-        logger.info(f"Batch encoding {len(queries)} queries")
+        unique = list(dict.fromkeys(queries))
+        keys = {query: make_cache_key(query, self.model_name) for query in unique}
+        
+        rows = {}
+        if self.cache:
+            for query in unique:
+                cached_embedding = self.cache.get_key(keys[query])
+                if cached_embedding is not None:
+                    rows[query] = cached_embedding
         
+        misses = [query for query in unique if query not in rows]
+        logger.info(
+            f"Batch encoding {len(queries)} queries "
+            f"({len(unique)} unique, {len(rows)} cached, {len(misses)} to encode)"
+        )
+        
+        if misses:
+            embeddings = self._encode(misses)
+            for query, embedding in zip(misses, embeddings):
+                rows[query] = embedding
+                self._remember(keys[query], embedding)
+        
+        if not queries:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        
+        return np.stack([rows[query] for query in queries])
+    
+    def _remember(self, key: bytes, embedding: np.ndarray):
+        """Store a fresh embedding in the cache and queue it for the on-disk log."""
+        if self.cache:
+            self.cache.set_key(key, embedding)
+            if self.store:
+                self.store.append(key, embedding)
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Run the model on a list of texts, returning a float32 matrix."""
         embeddings = self.model.encode(
-            queries,
+            texts,
             normalize_embeddings=config.NORMALIZE_EMBEDDINGS,
             batch_size=config.EMBEDDING_BATCH_SIZE,
             show_progress_bar=False
         )
         
-        return [emb.tolist() for emb in embeddings]
+        return embeddings.astype(np.float32, copy=False)
     
     def get_cache_stats(self) -> dict:
         """Return cache statistics."""
         if self.cache:
-            return self.cache.stats()
+            stats = self.cache.stats()
+            if self.store:
+                stats["persistent"] = self.store.stats()
+            return stats
         return {"cache_enabled": False}
     
+    def get_backend_info(self) -> dict:
+        """Return the active inference backend and its parity check result."""
+        return {
+            "backend": self.backend,
+            "device": self.device,
+            "parity": self.parity
+        }
+    
+    def get_batcher_stats(self) -> dict:
+        """Return micro-batching statistics."""
+        if self.batcher:
+            return self.batcher.stats()
+        return {"batching_enabled": False}
+    
     def clear_cache(self):
         """Clear the embedding cache."""
         if self.cache:
             self.cache.clear()
-            logger.info("Embedding cache cleared")
\ No newline at end of file
+            logger.info("Embedding cache cleared")
+    
+    def close(self):
+        """Stop the batcher, flush the persistent store and release the cache, if any."""
+        if self.batcher:
+            self.batcher.close()
+        if self.store:
+            self.store.close()
+        # The shared cache holds an mmap and lock fds; later calls run uncached
+        close_cache = getattr(self.cache, "close", None)
+        if close_cache:
+            self.cache = None
+            close_cache()
@@ -0,0 +1,124 @@
+"""
+Local stand-in for the Groq chat completions API, for tests and load runs.
+
+Speaks the OpenAI-compatible endpoint the Groq SDK calls
+(POST /openai/v1/chat/completions, plain and streamed), with configurable
+latency, per-token delay, an RPM limit answered with 429 + Retry-After,
+and random 503s. Answers echo the last user message, so no model is needed.
+
+Usage:
+    uvicorn fake_llm_server:app --port 8001
+    GROQ_BASE_URL=http://localhost:8001 GROQ_API_KEY=fake uvicorn api:app --port 8000
+
+    FAKE_LLM_RPM=30 FAKE_LLM_TOKEN_MS=5 uvicorn fake_llm_server:app --port 8001
+"""
+
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import deque
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from config import config
+
+app = FastAPI(title="Fake LLM API")
+
+# Arrival times of the requests of the last minute (RPM window)
+_recent = deque()
+_counters = {"requests": 0, "rate_limited": 0, "errors": 0}
+
+
+def _answer_words(messages: list, max_tokens: int) -> list:
+    prompt = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    words = f"Fake answer to: {prompt}".split()
+    return [word + " " for word in words[:max_tokens]]
+
+
+def _rate_limited() -> float:
+    """Seconds until the RPM window has room, or 0 if this request is admitted."""
+    if not config.FAKE_LLM_RPM:
+        return 0.0
+    now = time.monotonic()
+    while _recent and now - _recent[0] >= 60:
+        _recent.popleft()
+    if len(_recent) >= config.FAKE_LLM_RPM:
+        return 60 - (now - _recent[0])
+    _recent.append(now)
+    return 0.0
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    body = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    return f"data: {json.dumps(body)}\n\n"
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    _counters["requests"] += 1
+
+    retry_after = _rate_limited()
+    if retry_after:
+        _counters["rate_limited"] += 1
+        return JSONResponse(
+            status_code=429,
+            headers={"retry-after": f"{retry_after:.3f}"},
+            content={"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+        )
+
+    if random.random() < config.FAKE_LLM_ERROR_RATE:
+        _counters["errors"] += 1
+        return JSONResponse(
+            status_code=503,
+            content={"error": {"message": "Service unavailable", "type": "internal_server_error"}}
+        )
+
+    model = body.get("model", "fake")
+    words = _answer_words(body.get("messages", []), body.get("max_tokens") or 1024)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    await asyncio.sleep(config.FAKE_LLM_LATENCY_MS / 1000)
+
+    if body.get("stream"):
+        async def events():
+            yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+            for word in words:
+                await asyncio.sleep(config.FAKE_LLM_TOKEN_MS / 1000)
+                yield _chunk(completion_id, model, {"content": word})
+            yield _chunk(completion_id, model, {}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(len(words) * config.FAKE_LLM_TOKEN_MS / 1000)
+    prompt_tokens = sum(len(m.get("content", "")) // 4 for m in body.get("messages", []))
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "".join(words)},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words)
+        }
+    }
+
+
+@app.get("/stats")
+async def stats():
+    return dict(_counters)
@@ -1,8 +1,12 @@
+import asyncio
 import logging
+import random
+import time
 from typing import List, Dict, Any, Optional
-from groq import Groq
 
 from config import config
+from rate_limiter import get_rate_limiter, retry_after_seconds
+from token_counter import get_token_counter
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +15,11 @@ class LLMService:
     """
     Service for generating responses using Groq API.
     Supports various Groq models with streaming capabilities.
+    
+    Sync and async clients share pooled keep-alive connections. Every
+    completion passes the model's client-side RPM/TPM limiter first; a 429
+    pauses the limiter for the server's Retry-After and the request is
+    queued again, and 5xx/connection errors are retried with backoff.
     """
     
     def __init__(
@@ -27,15 +36,168 @@ class LLMService:
         
         # Initialize Groq client
         self._initialize_client()
+        
+        # Tokenizer of the model family, for prompt token budgeting
+        self.token_counter = get_token_counter(self.model)
+        
+        self.rate_limiter = get_rate_limiter(self.model)
+        self.calls = 0  # completions dispatched (before retries)
+        self.retries = 0
+        self.failures = 0
+        self.usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
     
     def _initialize_client(self):
         """Initialize Groq client."""
         logger.info(f"Initializing Groq client with model: {self.model}")
         
-        self.client = Groq(api_key=self.api_key)
+        # Imported lazily so importing this module stays cheap
+        import httpx
+        from groq import Groq, AsyncGroq, APIConnectionError
+        
+        limits = httpx.Limits(
+            max_connections=config.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=config.LLM_MAX_KEEPALIVE
+        )
+        timeout = httpx.Timeout(config.LLM_TIMEOUT_S, connect=5.0)
+        base_url = config.GROQ_BASE_URL or None
+        
+        # Retries are done here (rate-limit aware), not by the SDK
+        self.client = Groq(
+            api_key=self.api_key,
+            base_url=base_url,
+            max_retries=0,
+            http_client=httpx.Client(limits=limits, timeout=timeout)
+        )
+        self.async_client = AsyncGroq(
+            api_key=self.api_key,
+            base_url=base_url,
+            max_retries=0,
+            http_client=httpx.AsyncClient(limits=limits, timeout=timeout)
+        )
+        self._connection_errors = (APIConnectionError, httpx.TransportError)
         
         logger.info("Groq client initialized successfully")
     
+    def _count_prompt(self, messages: List[Dict[str, str]]) -> int:
+        return sum(self.token_counter.count(m["content"]) for m in messages)
+    
+    def _estimate_tokens(self, request: Dict[str, Any]) -> int:
+        """Tokens a request can use against TPM: prompt + max_tokens."""
+        return self._count_prompt(request["messages"]) + request["max_tokens"]
+    
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to back off before retrying `error`, or None to give up."""
+        status = getattr(error, "status_code", None)
+        rate_limited = status == 429
+        if not (rate_limited or (status or 0) >= 500 or isinstance(error, self._connection_errors)):
+            return None
+        if attempt >= config.LLM_MAX_RETRIES:
+            self.failures += 1
+            return None
+        
+        self.retries += 1
+        backoff = min(config.LLM_RETRY_MAX_MS, config.LLM_RETRY_BASE_MS * 2 ** attempt) / 1000
+        if rate_limited:
+            # Hold every queued request until the server's window reopens
+            response = getattr(error, "response", None)
+            self.rate_limiter.pause(retry_after_seconds(getattr(response, "headers", None), backoff))
+            return 0.0
+        
+        backoff = random.uniform(0, backoff)
+        logger.warning(f"LLM request failed ({error}), retry {attempt + 1} in {backoff:.2f}s")
+        return backoff
+    
+    def _settle(self, completion, tokens: int):
+        usage = getattr(completion, "usage", None)
+        self.rate_limiter.settle(tokens, getattr(usage, "total_tokens", None))
+        if usage is not None:
+            self._record_usage(usage.prompt_tokens, usage.completion_tokens)
+    
+    def _record_usage(self, prompt_tokens: int, completion_tokens: int):
+        self.usage["requests"] += 1
+        self.usage["prompt_tokens"] += prompt_tokens
+        self.usage["completion_tokens"] += completion_tokens
+    
+    def _settle_stream(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        chunks: List[str],
+        prompt_tokens: int = None
+    ):
+        """
+        Streams carry no usage: count both sides with the tokenizer and
+        settle the stream's TPM reservation against them. Also called for
+        a stream that failed or was closed early (chunks received so far).
+        Blocking; async streams run it in the default thread pool.
+        """
+        if prompt_tokens is None:
+            prompt_tokens = self._count_prompt(messages)
+        completion_tokens = self.token_counter.count("".join(chunks))
+        self.rate_limiter.settle(prompt_tokens + max_tokens, prompt_tokens + completion_tokens)
+        self._record_usage(prompt_tokens, completion_tokens)
+    
+    def _create(self, **request):
+        """chat.completions.create through the rate limiter, with retries."""
+        self.calls += 1
+        tokens = self._estimate_tokens(request)
+        attempt = 0
+        while True:
+            try:
+                self.rate_limiter.wait(tokens)
+                completion = self.client.chat.completions.create(model=self.model, **request)
+            except BaseException as e:
+                # Not served, or the caller was cancelled: give the attempt's
+                # reservation back (a retry reserves again)
+                self.rate_limiter.settle(tokens, 0)
+                if not isinstance(e, Exception):
+                    raise
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            
+            if not request.get("stream"):
+                self._settle(completion, tokens)
+            return completion
+    
+    async def _acreate(self, prompt_tokens: int = None, **request):
+        """
+        Async _create(): waits in the limiter queue without holding a thread.
+        
+        `prompt_tokens` skips re-counting a prompt the caller already
+        counted; otherwise the prompt is tokenized off the event loop.
+        """
+        self.calls += 1
+        if prompt_tokens is None:
+            loop = asyncio.get_running_loop()
+            tokens = await loop.run_in_executor(None, self._estimate_tokens, request)
+        else:
+            tokens = prompt_tokens + request["max_tokens"]
+        attempt = 0
+        while True:
+            try:
+                await self.rate_limiter.await_slot(tokens)
+                completion = await self.async_client.chat.completions.create(model=self.model, **request)
+            except BaseException as e:
+                # Not served, or the caller was cancelled: give the attempt's
+                # reservation back (a retry reserves again)
+                self.rate_limiter.settle(tokens, 0)
+                if not isinstance(e, Exception):
+                    raise
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            
+            if not request.get("stream"):
+                self._settle(completion, tokens)
+            return completion
+    
     def generate(
         self,
         prompt: str,
@@ -57,30 +219,80 @@ class LLMService:
         Returns:
             Generated text response
         """
+        messages = self._build_messages(prompt, system_prompt)
+        
+        # Use instance defaults or override
+        temp = temperature if temperature is not None else self.temperature
+        max_tok = max_tokens or self.max_tokens
+        
+        try:
+            logger.info(f"Generating response with model: {self.model}")
+            
+            completion = self._create(
+                messages=messages,
+                temperature=temp,
+                max_tokens=max_tok,
+                stop=stop_sequences
+            )
+            
+            response = completion.choices[0].message.content
+            
+            logger.info(f"Generated {len(response)} characters")
+            return response
+        
+        except Exception as e:
+            logger.error(f"Error generating response: {str(e)}")
+            raise
+    
+    def _build_messages(self, prompt: str, system_prompt: str = None) -> List[Dict[str, str]]:
+        """Build the chat message list for a single-turn request."""
         messages = []
         
-        # Add system prompt if provided
         if system_prompt:
             messages.append({
                 "role": "system",
                 "content": system_prompt
             })
         
-        # Add user prompt
         messages.append({
             "role": "user",
             "content": prompt
         })
         
-        # Use instance defaults or override
+        return messages
+    
+    async def agenerate(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        temperature: float = None,
+        max_tokens: int = None,
+        stop_sequences: List[str] = None,
+        prompt_tokens: int = None
+    ) -> str:
+        """
+        Async version of generate() using the non-blocking Groq client.
+        
+        Args:
+            prompt: User prompt/query
+            system_prompt: System instructions for the model
+            temperature: Sampling temperature (0-2)
+            max_tokens: Maximum tokens to generate
+            stop_sequences: Sequences where generation should stop
+            prompt_tokens: Token count of system + user prompt, if known
+        
+        Returns:
+            Generated text response
+        """
+        messages = self._build_messages(prompt, system_prompt)
         temp = temperature if temperature is not None else self.temperature
         max_tok = max_tokens or self.max_tokens
         
         try:
-            logger.info(f"Generating response with model: {self.model}")
+            logger.info(f"Generating response (async) with model: {self.model}")
             
-            completion = self.client.chat.completions.create(
-                model=self.model,
+            completion = await self._acreate(
+                prompt_tokens,
                 messages=messages,
                 temperature=temp,
                 max_tokens=max_tok,
@@ -161,36 +373,75 @@ Answer:"""
         Yields:
             Text chunks as they are generated
         """
-        messages = []
+        messages = self._build_messages(prompt, system_prompt)
         
-        if system_prompt:
-            messages.append({
-                "role": "system",
-                "content": system_prompt
-            })
+        temp = temperature if temperature is not None else self.temperature
+        max_tok = max_tokens or self.max_tokens
         
-        messages.append({
-            "role": "user",
-            "content": prompt
-        })
+        try:
+            logger.info(f"Starting streaming generation with model: {self.model}")
+            
+            stream = self._create(
+                messages=messages,
+                temperature=temp,
+                max_tokens=max_tok,
+                stream=True
+            )
+            
+            chunks = []
+            try:
+                for chunk in stream:
+                    if chunk.choices[0].delta.content:
+                        chunks.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            finally:
+                self._settle_stream(messages, max_tok, chunks)
+        
+        except Exception as e:
+            logger.error(f"Error in streaming generation: {str(e)}")
+            raise
+    
+    async def agenerate_stream(
+        self,
+        prompt: str,
+        system_prompt: str = None,
+        temperature: float = None,
+        max_tokens: int = None,
+        prompt_tokens: int = None
+    ):
+        """
+        Async version of generate_stream(). `prompt_tokens` is the token
+        count of system + user prompt, if the caller already has it.
         
+        Yields:
+            Text chunks as they are generated
+        """
+        messages = self._build_messages(prompt, system_prompt)
         temp = temperature if temperature is not None else self.temperature
         max_tok = max_tokens or self.max_tokens
         
         try:
-            logger.info(f"Starting streaming generation with model: {self.model}")
+            logger.info(f"Starting streaming generation (async) with model: {self.model}")
             
-            stream = self.client.chat.completions.create(
-                model=self.model,
+            stream = await self._acreate(
+                prompt_tokens,
                 messages=messages,
                 temperature=temp,
                 max_tokens=max_tok,
                 stream=True
             )
             
-            for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+            chunks = []
+            try:
+                async for chunk in stream:
+                    if chunk.choices[0].delta.content:
+                        chunks.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            finally:
+                # Not awaited: settles even if this generator is being cancelled
+                asyncio.get_running_loop().run_in_executor(
+                    None, self._settle_stream, messages, max_tok, chunks, prompt_tokens
+                )
         
         except Exception as e:
             logger.error(f"Error in streaming generation: {str(e)}")
@@ -219,8 +470,7 @@ Answer:"""
         try:
             logger.info(f"Processing chat with {len(messages)} messages")
             
-            completion = self.client.chat.completions.create(
-                model=self.model,
+            completion = self._create(
                 messages=messages,
                 temperature=temp,
                 max_tokens=max_tok
@@ -230,4 +480,42 @@ Answer:"""
         
         except Exception as e:
             logger.error(f"Error in chat: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+    
+    async def achat(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = None,
+        max_tokens: int = None
+    ) -> str:
+        """Async version of chat()."""
+        temp = temperature if temperature is not None else self.temperature
+        max_tok = max_tokens or self.max_tokens
+        
+        try:
+            logger.info(f"Processing chat (async) with {len(messages)} messages")
+            
+            completion = await self._acreate(
+                messages=messages,
+                temperature=temp,
+                max_tokens=max_tok
+            )
+            
+            return completion.choices[0].message.content
+        
+        except Exception as e:
+            logger.error(f"Error in chat: {str(e)}")
+            raise
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return token usage, rate limiter queue/wait metrics and retry counts."""
+        return {
+            "model": self.model,
+            "calls": self.calls,
+            "usage": dict(self.usage),
+            "base_url": config.GROQ_BASE_URL or None,
+            "max_connections": config.LLM_MAX_CONNECTIONS,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rate_limiter": self.rate_limiter.stats()
+        }
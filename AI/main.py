@@ -10,6 +10,9 @@ Usage:
     
     # With GPU and multiple workers
     uvicorn api:app --host 0.0.0.0 --port 8000 --workers 4
+    
+    # Multiple workers sharing one embedding cache
+    CACHE_BACKEND=shared uvicorn api:app --host 0.0.0.0 --port 8000 --workers 4
 """
 
 import uvicorn
@@ -0,0 +1,122 @@
+import logging
+import threading
+from typing import Dict, Optional
+
+from config import config
+from llm_service import LLMService
+from schema_service import SchemaService
+
+logger = logging.getLogger(__name__)
+
+
+# USD per 1M tokens (input, output), for cost reporting only
+MODEL_PRICES = {
+    "llama-3.1-8b-instant": (0.05, 0.08),
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+    "meta-llama/llama-4-scout-17b-16e-instruct": (0.11, 0.34),
+    "gemma2-9b-it": (0.20, 0.20)
+}
+
+
+def parse_routes(spec: str) -> Dict[int, str]:
+    """Parse "marks=tier-or-model,..." overrides, e.g. "5=large,10=llama-3.1-8b-instant"."""
+    routes = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        marks, _, target = item.partition("=")
+        if not target.strip():
+            raise ValueError(f"Invalid model route '{item}', expected marks=model")
+        routes[SchemaService.get_schema_marks(int(marks))] = target.strip()
+    return routes
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    """USD cost of the given usage, or None for a model without a price."""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    return round((prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1e6, 6)
+
+
+class ModelRouter:
+    """
+    Picks the LLM for an answer from its marks level.
+
+    Each schema names a model tier ("small" for 1-5 marks, "large" for
+    7-15); tiers map to GROQ_SMALL_MODEL and GROQ_MODEL. A per-marks
+    override may name a tier or a model id. One LLMService (client pool,
+    rate limiter) is kept per model; warm_up() builds them at startup so
+    no request pays for client and tokenizer loading. With routing off
+    every marks level uses the default service.
+    """
+
+    def __init__(
+        self,
+        default_service: LLMService,
+        tiers: Dict[str, str] = None,
+        overrides: Dict[int, str] = None,
+        enabled: bool = True
+    ):
+        self.default_service = default_service
+        self.enabled = enabled
+        self.tiers = tiers or {"small": config.GROQ_SMALL_MODEL, "large": default_service.model}
+        self.overrides = dict(overrides or {})
+        self._services = {default_service.model: default_service}
+        self._lock = threading.Lock()
+
+        logger.info(f"Model routing {'on' if enabled else 'off'}: {self.routes()}")
+
+    def model_for(self, marks: int) -> str:
+        """Model id for the given marks."""
+        if not self.enabled:
+            return self.default_service.model
+        target = self.overrides.get(SchemaService.get_schema_marks(marks))
+        if target is None:
+            target = SchemaService.get_model_tier(marks)
+        return self.tiers.get(target, target)
+
+    def _service(self, model: str) -> LLMService:
+        with self._lock:
+            service = self._services.get(model)
+        if service is None:
+            # Built outside the lock: client setup and tokenizer loading are slow
+            service = LLMService(api_key=self.default_service.api_key, model=model)
+            with self._lock:
+                service = self._services.setdefault(model, service)
+        return service
+
+    def warm_up(self):
+        """Build the LLMService of every routed model (blocking; run off the event loop)."""
+        for model in set(self.routes().values()):
+            self._service(model)
+
+    def service_for(self, marks: int) -> LLMService:
+        """LLMService of the model routed for the given marks."""
+        model = self.model_for(marks)
+        with self._lock:
+            service = self._services.get(model)
+        if service is None:
+            logger.warning(f"LLM service for {model} built on first use; call warm_up() at startup")
+            service = self._service(model)
+        return service
+
+    def routes(self) -> Dict[int, str]:
+        """Marks level -> model table."""
+        return {marks: self.model_for(marks) for marks in sorted(SchemaService.SCHEMAS)}
+
+    def stats(self) -> dict:
+        """Return the routing table and per-model usage, cost and limiter metrics."""
+        with self._lock:
+            services = dict(self._services)
+
+        models = {}
+        for model, service in services.items():
+            stats = service.stats()
+            usage = stats["usage"]
+            models[model] = {
+                **stats,
+                "cost_usd": estimate_cost(model, usage["prompt_tokens"], usage["completion_tokens"])
+            }
+
+        return {"enabled": self.enabled, "routes": self.routes(), "models": models}
@@ -0,0 +1,288 @@
+import hashlib
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+_MAGIC = b"EMBLOG01"
+_HEADER = struct.Struct("<8sI16s")  # magic, dimension, md5(model name)
+_HEADER_SIZE = 32
+
+
+class PersistentEmbeddingStore:
+    """
+    Append-only on-disk log of (cache key, float32 vector) records.
+
+    Used to warm the embedding cache after a restart. Appends are queued
+    and written by a background thread; once the log holds more than
+    `compact_ratio` x `max_records` records it is rewritten with only the
+    newest record per key (at most `max_records` of them).
+
+    Each record is a fixed-size [key(16) | crc32(4) | vector] block, so a
+    torn write at the tail is detected and skipped on load, and cut off
+    before the next append so later records stay aligned. Several worker
+    processes may share one log: writes and compaction hold an exclusive
+    flock on a sidecar lock file, compaction swaps the new file in with
+    os.replace, and writers reopen the log when its inode changes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dimension: int,
+        model_name: str,
+        max_records: int = 10000,
+        compact_ratio: float = 2.0,
+        flush_interval: float = 1.0
+    ):
+        self.path = path
+        self.dimension = dimension
+        self.max_records = max_records
+        self.compact_ratio = compact_ratio
+        self.flush_interval = flush_interval
+
+        self._header = _HEADER.pack(
+            _MAGIC, dimension, hashlib.md5(model_name.encode()).digest()
+        ).ljust(_HEADER_SIZE, b"\0")
+        self._dtype = np.dtype([
+            ("key", "V16"),
+            ("crc", "<u4"),
+            ("vec", "<f4", (dimension,))
+        ])
+
+        self._queue = queue.Queue()
+        self._fd = None
+        self._records_in_file = 0
+        self._stale = False
+        self._stopped = threading.Event()
+
+        self.appended = 0
+        self.compactions = 0
+        self.loaded = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock_fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+
+        self._writer = threading.Thread(
+            target=self._write_loop, name="embedding-store-writer", daemon=True
+        )
+        self._writer.start()
+
+    def _flock(self, op: str):
+        """flock the sidecar lock file ("SH", "EX" or "UN"); no-op without fcntl."""
+        if fcntl is not None:
+            fcntl.flock(self._lock_fd, getattr(fcntl, f"LOCK_{op}"))
+
+    def _read_records(self) -> np.ndarray:
+        """Read all valid records from the log (caller holds a lock)."""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return np.empty(0, dtype=self._dtype)
+
+        if data[:_HEADER_SIZE] != self._header:
+            if data and not self._stale:
+                logger.warning(f"Embedding store {self.path} is for another model, discarding it")
+                self._stale = True
+            return np.empty(0, dtype=self._dtype)
+
+        count = (len(data) - _HEADER_SIZE) // self._dtype.itemsize
+        records = np.frombuffer(data, dtype=self._dtype, count=count, offset=_HEADER_SIZE)
+
+        valid = np.fromiter(
+            (
+                zlib.crc32(r["vec"].tobytes(), zlib.crc32(r["key"].tobytes())) == r["crc"]
+                for r in records
+            ),
+            dtype=bool,
+            count=count
+        )
+        if not valid.all():
+            logger.warning(f"Skipping {count - int(valid.sum())} corrupt records in {self.path}")
+        return records[valid]
+
+    @staticmethod
+    def _latest(records: np.ndarray, limit: int) -> np.ndarray:
+        """Keep the newest record per key, at most `limit`, oldest first."""
+        seen = set()
+        keep = []
+        for i in range(len(records) - 1, -1, -1):
+            key = records["key"][i].tobytes()
+            if key in seen:
+                continue
+            seen.add(key)
+            keep.append(i)
+            if len(keep) >= limit:
+                break
+        return records[keep[::-1]]
+
+    def load(self) -> Iterator[Tuple[bytes, np.ndarray]]:
+        """
+        Read the log for warm start.
+
+        Yields (key, vector) for the newest `max_records` distinct keys,
+        oldest first, so inserting them in order leaves the hottest entries
+        most recently used.
+        """
+        start = time.time()
+        self._flock("SH")
+        try:
+            records = self._read_records()
+        finally:
+            self._flock("UN")
+
+        if self._stale:
+            self.compact()
+
+        self._records_in_file = len(records)
+        latest = self._latest(records, self.max_records)
+        self.loaded = len(latest)
+
+        logger.info(
+            f"Loaded {self.loaded} embeddings from {self.path} "
+            f"in {time.time() - start:.2f}s"
+        )
+        for record in latest:
+            yield record["key"].tobytes(), record["vec"]
+
+    def append(self, key: bytes, embedding):
+        """Queue a record for the background writer (never blocks on disk)."""
+        if self._stopped.is_set():
+            return
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        self._queue.put((key, vector))
+
+    def _encode(self, batch) -> bytes:
+        records = np.empty(len(batch), dtype=self._dtype)
+        for i, (key, vector) in enumerate(batch):
+            records["key"][i] = np.void(key)
+            records["vec"][i] = vector
+            records["crc"][i] = zlib.crc32(
+                records["vec"][i].tobytes(), zlib.crc32(key)
+            )
+        return records.tobytes()
+
+    def _ensure_open(self):
+        """(Re)open the log, following a compaction done by another process."""
+        if self._fd is not None:
+            try:
+                if os.stat(self.path).st_ino == os.fstat(self._fd).st_ino:
+                    return
+            except FileNotFoundError:
+                pass
+            os.close(self._fd)
+
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+
+    def _realign(self):
+        """
+        Cut a torn tail (a crash mid-write) back to the last whole record,
+        so the next append starts on a record boundary (caller holds EX).
+        """
+        size = os.fstat(self._fd).st_size
+        if size < _HEADER_SIZE:
+            if size:
+                logger.warning(f"Truncating torn header of {self.path}")
+                os.ftruncate(self._fd, 0)
+            os.write(self._fd, self._header)
+            return
+
+        torn = (size - _HEADER_SIZE) % self._dtype.itemsize
+        if torn:
+            logger.warning(f"Truncating {torn} bytes of a torn record at the end of {self.path}")
+            os.ftruncate(self._fd, size - torn)
+
+    def _write_batch(self, batch):
+        payload = self._encode(batch)
+        self._flock("EX")
+        try:
+            self._ensure_open()
+            self._realign()
+            os.write(self._fd, payload)
+        finally:
+            self._flock("UN")
+
+        self.appended += len(batch)
+        self._records_in_file += len(batch)
+
+    def compact(self):
+        """Rewrite the log keeping only the newest record per key."""
+        start = time.time()
+        self._flock("EX")
+        try:
+            records = self._read_records()
+            latest = self._latest(records, self.max_records)
+
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(self._header)
+                f.write(latest.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._stale = False
+        finally:
+            self._flock("UN")
+
+        self._records_in_file = len(latest)
+        self.compactions += 1
+        logger.info(
+            f"Compacted {self.path}: {len(records)} -> {len(latest)} records "
+            f"in {time.time() - start:.2f}s"
+        )
+
+    def _write_loop(self):
+        while not self._stopped.is_set() or not self._queue.empty():
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._write_batch(batch)
+                if self._records_in_file > self.compact_ratio * self.max_records:
+                    self.compact()
+            except OSError as e:
+                logger.error(f"Embedding store write failed: {str(e)}")
+
+    def close(self, timeout: Optional[float] = 5.0):
+        """Flush queued records and stop the writer thread."""
+        self._stopped.set()
+        self._writer.join(timeout)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        os.close(self._lock_fd)
+
+    def stats(self) -> dict:
+        """Return store statistics."""
+        return {
+            "path": self.path,
+            "records_in_file": self._records_in_file,
+            "max_records": self.max_records,
+            "loaded": self.loaded,
+            "appended": self.appended,
+            "pending": self._queue.qsize(),
+            "compactions": self.compactions
+        }
@@ -1,11 +1,25 @@
+import asyncio
+import copy
+import hashlib
+import json
 import logging
-from typing import List, Dict, Any, Optional
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, AsyncIterator
 
+from cache_manager import TTLCache
+from chunk_dedup import dedup_chunks, strip_values
 from config import config
 from embedding_service import EmbeddingService
-from retrieval_service import RetrievalService
+from retrieval_service import RetrievalService, cut_by_score
 from llm_service import LLMService
+from model_router import ModelRouter, parse_routes
 from schema_service import SchemaService
+from semantic_cache import SemanticCache, make_scope
+from sentence_compressor import SentenceCompressor
+from single_flight import SingleFlight, StreamFlight
+from stage_executor import StageExecutor
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -14,6 +28,35 @@ logging.basicConfig(
 )
 
 
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+# Cache status of a generated answer (X-Cache header)
+CACHE_MISS = "MISS"
+CACHE_HIT = "HIT"
+CACHE_HIT_SEMANTIC = "HIT-SEMANTIC"
+
+
+class PromptBudgetError(ValueError):
+    """The requested max_tokens leaves no room for context in LLM_CONTEXT_WINDOW."""
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", query).strip().lower().rstrip("?.! ")
+
+
+class AnswerStream:
+    """Async iterator of answer chunks, tagged with cache status and whether it joined another request."""
+    
+    def __init__(self, chunks: AsyncIterator[str], cache_status: str, coalesced: bool = False):
+        self.chunks = chunks
+        self.cache_status = cache_status
+        self.coalesced = coalesced
+    
+    def __aiter__(self):
+        return self.chunks.__aiter__()
+
+
 class RAGPipeline:
     """
     Main RAG pipeline orchestrating embedding and retrieval services.
@@ -42,8 +85,72 @@ class RAGPipeline:
         self.retrieval_service = retrieval_service or RetrievalService(self.index_name)
         self.llm_service = llm_service or LLMService()
         
+        # Marks level -> LLM (small fast model for short answers)
+        self.router = ModelRouter(
+            self.llm_service,
+            overrides=parse_routes(config.MODEL_ROUTES),
+            enabled=config.ENABLE_MODEL_ROUTING
+        )
+        
+        # Bounded thread pool + per-stage limits for the async request path
+        self.executor = StageExecutor(
+            max_workers=config.EXECUTOR_MAX_WORKERS,
+            limits={
+                "embed": config.EMBED_CONCURRENCY,
+                "retrieve": config.RETRIEVE_CONCURRENCY,
+                "llm": config.LLM_CONCURRENCY
+            }
+        )
+        
+        # Near-duplicate query cache (retrievals and answers)
+        if config.ENABLE_SEMANTIC_CACHE:
+            self.semantic_cache = SemanticCache(
+                dimension=self.embedding_service.dimension,
+                max_size=config.SEMANTIC_CACHE_MAX_SIZE,
+                threshold=config.SEMANTIC_CACHE_THRESHOLD,
+                ttl=config.SEMANTIC_CACHE_TTL
+            )
+        else:
+            self.semantic_cache = None
+        
+        # Exact answer cache: same question + same context + same LLM settings
+        if config.ENABLE_ANSWER_CACHE:
+            self.answer_cache = TTLCache(
+                max_size=config.ANSWER_CACHE_MAX_SIZE,
+                ttl=config.ANSWER_CACHE_TTL,
+                name="answer"
+            )
+        else:
+            self.answer_cache = None
+        
+        # Query-focused sentence extraction for short-answer schemas
+        if config.ENABLE_SENTENCE_EXTRACTION:
+            self.sentence_compressor = SentenceCompressor(
+                self.embedding_service,
+                cache_size=config.SENTENCE_CACHE_MAX_SIZE,
+                ttl=config.CACHE_TTL
+            )
+        else:
+            self.sentence_compressor = None
+        
+        # Identical concurrent requests share one embed/retrieve/LLM run
+        self.answer_flight = SingleFlight("generate")
+        self.stream_flight = StreamFlight("stream")
+        
+        # Running totals of the near-duplicate chunk filter and /generate/batch,
+        # updated from executor threads as well as the loop (see _count)
+        self.dedup_stats = {"requests": 0, "chunks_removed": 0, "tokens_saved": 0}
+        self.batch_stats = {"batches": 0, "items": 0, "retrievals": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+        
         logger.info("RAG Pipeline initialized")
     
+    def _count(self, stats: Dict[str, int], **increments: int):
+        """Add to running totals under the stats lock."""
+        with self._stats_lock:
+            for name, value in increments.items():
+                stats[name] += value
+    
     def retrieve(
         self,
         query: str,
@@ -57,7 +164,8 @@ class RAGPipeline:
         Args:
             query: Search query
             top_k: Number of results
-            namespace: Pinecone namespace
+            namespace: Pinecone namespace, or a list of namespaces to search
+                in parallel (sharded; see RetrievalService.query_shards)
             filter_metadata: Metadata filters
         
         Returns:
@@ -67,60 +175,244 @@ class RAGPipeline:
         logger.info(f"Processing query: {query[:100]}...")
         query_vector = self.embedding_service.embed_single(query)
         
-        # Retrieve from Pinecone
-        documents = self.retrieval_service.query(
-            query_vector=query_vector,
+        return self._retrieve_by_vector(
+            query_vector,
+            query=query,
             top_k=top_k,
             namespace=namespace,
             filter_metadata=filter_metadata
         )
+    
+    def _retrieve_by_vector(
+        self,
+        query_vector,
+        query: str = None,
+        top_k: int = None,
+        namespace: str = None,
+        filter_metadata: Dict[str, Any] = None,
+        include_values: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Retrieve for an already embedded query, reusing near-duplicate results."""
+        namespace = self._shard_namespace(namespace)
+        # The generation keeps a retrieval in flight during an invalidation
+        # from storing its (stale) documents where later lookups find them
+        scope = make_scope(
+            "retrieve", top_k=top_k, namespace=namespace, filter=filter_metadata,
+            include_values=include_values, generation=self.retrieval_service.generation(namespace)
+        )
+        
+        if self.semantic_cache:
+            hit = self.semantic_cache.lookup(query_vector, scope)
+            if hit:
+                logger.info(
+                    f"Semantic cache HIT (similarity={hit['similarity']}) "
+                    f"for query: {str(query)[:100]}"
+                )
+                if include_values:
+                    return self.retrieval_service.attach_vectors(hit["value"], namespace)
+                return list(hit["value"])
+        
+        complete = True
+        if isinstance(namespace, tuple):
+            # Several namespaces: parallel fan-out, merged global top_k
+            documents, shard_status = self.retrieval_service.query_shards(
+                query_vector,
+                shards=list(namespace),
+                top_k=top_k,
+                filter_metadata=filter_metadata,
+                include_values=include_values
+            )
+            complete = all(status == "ok" for status in shard_status.values())
+        else:
+            # Retrieve from Pinecone
+            documents = self.retrieval_service.query(
+                query_vector=query_vector,
+                top_k=top_k,
+                namespace=namespace,
+                filter_metadata=filter_metadata,
+                include_values=include_values
+            )
+        
+        # Partial (sharded) results are served but not cached
+        if self.semantic_cache and complete:
+            # Vectors are kept once per chunk by the retrieval service, not per entry
+            cached = self.retrieval_service.strip_vectors(documents, namespace)
+            self.semantic_cache.store(query_vector, scope, cached, query=query)
         
         return documents
     
+    @staticmethod
+    def _shard_namespace(namespace):
+        """A namespace list becomes a sorted tuple of shards (one entry: plain namespace)."""
+        if not isinstance(namespace, (list, tuple)):
+            return namespace
+        shards = tuple(sorted(set(namespace)))
+        if len(shards) > 1:
+            return shards
+        return shards[0] if shards else None
+    
     def retrieve_batch(
         self,
         queries: List[str],
         top_k: int = None,
         namespace: str = None,
-        filter_metadata: Dict[str, Any] = None
+        filter_metadata: Dict[str, Any] = None,
+        return_exceptions: bool = False
     ) -> List[List[Dict[str, Any]]]:
         """
         Retrieve documents for multiple queries in batch.
         More efficient than individual queries.
         
+        Embeds all queries in one batch, then queries the vector store for
+        each distinct query concurrently (at most BATCH_RETRIEVE_CONCURRENCY
+        at a time), or in one call if the backend has a multi-query API.
+        
         Args:
             queries: List of search queries
             top_k: Number of results per query
             namespace: Pinecone namespace
             filter_metadata: Metadata filters
+            return_exceptions: Put a failed query's exception in its slot
+                instead of an empty list
         
         Returns:
-            List of document lists (one per query)
+            List of document lists (one per query, in input order)
         """
         logger.info(f"Processing batch of {len(queries)} queries")
         
         # Generate embeddings in batch
         query_vectors = self.embedding_service.embed_batch(queries)
+        first_index = self._first_index(queries)
         
-        # Retrieve for each query
-        all_results = []
-        for i, query_vector in enumerate(query_vectors):
-            logger.info(f"Retrieving for query {i+1}/{len(queries)}")
-            documents = self.retrieval_service.query(
-                query_vector=query_vector,
+        if self.retrieval_service.supports_batch_query and not isinstance(namespace, (list, tuple)):
+            results = self._query_batch_safely(query_vectors, first_index, top_k, namespace, filter_metadata)
+        else:
+            workers = max(1, min(config.BATCH_RETRIEVE_CONCURRENCY, len(first_index)))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-batch") as pool:
+                futures = [
+                    pool.submit(
+                        self._retrieve_by_vector,
+                        query_vectors[i],
+                        query=query,
+                        top_k=top_k,
+                        namespace=namespace,
+                        filter_metadata=filter_metadata
+                    )
+                    for query, i in first_index.items()
+                ]
+                results = []
+                for future in futures:
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        results.append(e)
+        
+        return self._batch_results(queries, first_index, results, return_exceptions)
+    
+    @staticmethod
+    def _first_index(queries: List[str]) -> Dict[str, int]:
+        """Map each distinct query to its first position (duplicates retrieve once)."""
+        first_index = {}
+        for i, query in enumerate(queries):
+            first_index.setdefault(query, i)
+        return first_index
+    
+    def _query_batch_safely(self, query_vectors, first_index, top_k, namespace, filter_metadata) -> list:
+        """One multi-query backend call; a failure is reported for every query."""
+        try:
+            return self.retrieval_service.query_batch(
+                [query_vectors[i] for i in first_index.values()],
                 top_k=top_k,
                 namespace=namespace,
                 filter_metadata=filter_metadata
             )
+        except Exception as e:
+            return [e] * len(first_index)
+    
+    @staticmethod
+    def _batch_results(queries, first_index, results, return_exceptions: bool) -> list:
+        """Expand per-distinct-query results back to input order, isolating failures."""
+        by_query = dict(zip(first_index, results))
+        
+        all_results = []
+        for i, query in enumerate(queries):
+            documents = by_query[query]
+            if isinstance(documents, Exception):
+                logger.error(f"Retrieval failed for batch query {i+1}/{len(queries)}: {str(documents)}")
+                if not return_exceptions:
+                    documents = []
             all_results.append(documents)
         
         return all_results
     
+    def dedup_documents(self, documents: List[Dict[str, Any]], query_vector=None, token_counter=None):
+        """
+        Remove near-duplicate chunks (needs documents retrieved with values).
+        
+        tokens_saved is counted with `token_counter` (the answering model's,
+        default the pipeline LLM's). Blocking (pairwise similarities and
+        token counts); the async paths run it on the executor.
+        
+        Returns:
+            (documents without their vectors, dedup info with tokens_saved)
+        """
+        if not config.ENABLE_CHUNK_DEDUP:
+            return strip_values(documents), {"enabled": False}
+        
+        kept, removed = dedup_chunks(
+            documents,
+            query_vector=query_vector,
+            method=config.CHUNK_DEDUP_METHOD,
+            threshold=config.CHUNK_DEDUP_THRESHOLD,
+            mmr_lambda=config.CHUNK_DEDUP_MMR_LAMBDA
+        )
+        
+        counter = token_counter or self.llm_service.token_counter
+        tokens_saved = sum(counter.count(doc["metadata"].get("text", "")) for doc in removed)
+        
+        self._count(self.dedup_stats, requests=1, chunks_removed=len(removed), tokens_saved=tokens_saved)
+        
+        if removed:
+            logger.info(f"Removed {len(removed)} near-duplicate chunks ({tokens_saved} tokens)")
+        
+        return strip_values(kept), {
+            "method": config.CHUNK_DEDUP_METHOD,
+            "removed": len(removed),
+            "removed_ids": [doc["id"] for doc in removed],
+            "tokens_saved": tokens_saved
+        }
+    
+    def compress_documents(self, documents: List[Dict[str, Any]], query_vector, plan: Dict[str, Any]):
+        """
+        Cut chunks down to the sentences most relevant to the query.
+        
+        Only runs when sentence extraction is enabled and the plan's schema
+        has an extract_tokens budget. Blocking (encodes uncached sentences).
+        
+        Returns:
+            (documents for the prompt, extraction info or None)
+        """
+        if not self.sentence_compressor or not plan["extract_tokens"]:
+            return documents, None
+        
+        compressed, info = self.sentence_compressor.compress(
+            documents,
+            query_vector,
+            max_tokens=plan["extract_tokens"],
+            token_counter=plan["llm"].token_counter
+        )
+        logger.info(
+            f"Sentence extraction kept {info['sentences_kept']}/{info['sentences_total']} sentences "
+            f"({info.get('tokens_before')} -> {info.get('tokens_after')} tokens)"
+        )
+        return compressed, info
+    
     def build_context(
         self,
         documents: List[Dict[str, Any]],
         include_scores: bool = False,
-        max_length: int = None
+        max_length: int = None,
+        max_tokens: int = None
     ) -> str:
         """
         Build context string from retrieved documents.
@@ -129,12 +421,39 @@ class RAGPipeline:
             documents: Retrieved documents
             include_scores: Whether to include similarity scores
             max_length: Maximum context length in characters
+            max_tokens: Maximum context length in LLM tokens
         
         Returns:
             Formatted context string
         """
+        return self.pack_context(documents, include_scores, max_length, max_tokens)["context"]
+    
+    def pack_context(
+        self,
+        documents: List[Dict[str, Any]],
+        include_scores: bool = False,
+        max_length: int = None,
+        max_tokens: int = None,
+        token_counter=None
+    ) -> Dict[str, Any]:
+        """
+        Pack documents (best first) into a context string within the limits.
+        
+        With `max_tokens`, a chunk that does not fit is skipped and smaller
+        lower-ranked chunks may still fill the remaining budget; if even the
+        top chunk is too large, its head is kept.
+        
+        Returns:
+            Dict with context, tokens (None without max_tokens), budget,
+            chunks_used and chunks_dropped
+        """
+        counter = token_counter or self.llm_service.token_counter
+        separator_tokens = counter.count(CONTEXT_SEPARATOR) if max_tokens is not None else 0
+        
         context_chunks = []
         current_length = 0
+        current_tokens = 0
+        dropped = 0
         
         for doc in documents:
             text = doc["metadata"].get("text", "")
@@ -153,9 +472,26 @@ class RAGPipeline:
                     break
                 current_length += len(chunk)
             
+            # Check token budget
+            if max_tokens is not None:
+                chunk_tokens = counter.count(chunk) + (separator_tokens if context_chunks else 0)
+                if current_tokens + chunk_tokens > max_tokens:
+                    if context_chunks or max_tokens <= 0:
+                        dropped += 1
+                        continue
+                    chunk = counter.truncate(chunk, max_tokens)
+                    chunk_tokens = counter.count(chunk)
+                current_tokens += chunk_tokens
+            
             context_chunks.append(chunk)
         
-        return "\n\n---\n\n".join(context_chunks)
+        return {
+            "context": CONTEXT_SEPARATOR.join(context_chunks),
+            "tokens": current_tokens if max_tokens is not None else None,
+            "budget": max_tokens,
+            "chunks_used": len(context_chunks),
+            "chunks_dropped": dropped
+        }
     
     def run(
         self,
@@ -205,10 +541,57 @@ class RAGPipeline:
         
         return result
     
+    def clear_caches(self):
+        """Clear the embedding, retrieval, semantic and answer caches."""
+        self.embedding_service.clear_cache()
+        self.retrieval_service.clear_cache()
+        if self.semantic_cache:
+            self.semantic_cache.clear()
+        if self.answer_cache is not None:
+            self.answer_cache.clear()
+    
+    def invalidate_namespace(self, namespace: str = None) -> Dict[str, Any]:
+        """
+        Drop cached retrievals and answers for one namespace.
+        
+        Call after re-indexing a course so queries see the new documents.
+        Query embeddings do not depend on the index and are kept.
+        """
+        self.retrieval_service.invalidate_namespace(namespace)
+        semantic_dropped = self.semantic_cache.invalidate_namespace(namespace) if self.semantic_cache else 0
+        
+        return {
+            "namespace": namespace,
+            "semantic_entries_dropped": semantic_dropped
+        }
+    
     def get_stats(self) -> Dict[str, Any]:
-        """Get pipeline statistics."""
+        """Get pipeline statistics (in-memory only, never calls the vector store)."""
+        with self._stats_lock:
+            dedup_stats, batch_stats = dict(self.dedup_stats), dict(self.batch_stats)
+        
         return {
             "embedding": self.embedding_service.get_cache_stats(),
+            "embedding_backend": self.embedding_service.get_backend_info(),
+            "embedding_batcher": self.embedding_service.get_batcher_stats(),
+            "semantic_cache": self.semantic_cache.stats() if self.semantic_cache else {"cache_enabled": False},
+            "retrieval_cache": self.retrieval_service.get_cache_stats(),
+            "answer_cache": self.answer_cache.stats() if self.answer_cache is not None else {"cache_enabled": False},
+            "single_flight": {
+                "enabled": config.ENABLE_SINGLE_FLIGHT,
+                "generate": self.answer_flight.stats(),
+                "stream": self.stream_flight.stats()
+            },
+            "vector_store": self.retrieval_service.get_store_stats(),
+            "shards": self.retrieval_service.get_shard_stats(),
+            "llm": self.router.stats(),
+            "tokenizer": self.llm_service.token_counter.stats(),
+            "chunk_dedup": {"enabled": config.ENABLE_CHUNK_DEDUP, **dedup_stats},
+            "generate_batch": batch_stats,
+            "sentence_extraction": (
+                self.sentence_compressor.stats() if self.sentence_compressor else {"enabled": False}
+            ),
+            "executor": self.executor.stats(),
             "index": self.retrieval_service.get_index_stats()
         }
     
@@ -243,11 +626,74 @@ class RAGPipeline:
         """
         logger.info(f"Generating {marks}-mark answer for query: {query[:100]}...")
         
+        plan = self._plan_answer(
+            marks, top_k, namespace, filter_metadata,
+            custom_system_prompt, temperature, max_tokens, include_sources
+        )
+        
+        # Embed once; reused for the answer cache and retrieval
+        query_vector = self.embedding_service.embed_single(query)
+        
+        cached = self._cached_answer(query, query_vector, plan)
+        if cached:
+            return cached
+        
+        # Retrieve relevant documents (with vectors for near-duplicate removal)
+        documents = self._retrieve_by_vector(
+            query_vector,
+            query=query,
+            top_k=plan["fetch_k"],
+            namespace=namespace,
+            filter_metadata=filter_metadata,
+            include_values=config.ENABLE_CHUNK_DEDUP
+        )
+        documents, retrieval_info = self._cut_documents(documents, plan)
+        documents, dedup_info = self.dedup_documents(documents, query_vector, plan["llm"].token_counter)
+        prompt_documents, extraction_info = self.compress_documents(documents, query_vector, plan)
+        
+        # Pack context into the token budget and build schema-based prompts
+        context, system_prompt, user_prompt, context_info = self._pack_for_prompt(query, prompt_documents, plan)
+        context_info["retrieval"] = retrieval_info
+        context_info["dedup"] = dedup_info
+        context_info["extraction"] = extraction_info
+        
+        answer_key = self._answer_key(query, context, system_prompt, plan)
+        answer = self._lookup_answer(answer_key)
+        if answer is not None:
+            return self._finish_answer(
+                query, query_vector, answer, context, documents, plan, context_info, CACHE_HIT
+            )
+        
+        # Generate answer using LLM
+        answer = plan["llm"].generate(
+            prompt=user_prompt,
+            system_prompt=system_prompt,
+            temperature=plan["temperature"],
+            max_tokens=plan["max_tokens"]
+        )
+        self._store_answer(answer_key, answer)
+        
+        return self._finish_answer(query, query_vector, answer, context, documents, plan, context_info)
+    
+    def _plan_answer(
+        self,
+        marks: int,
+        top_k: int,
+        namespace: str,
+        filter_metadata: Dict[str, Any],
+        custom_system_prompt: str,
+        temperature: float,
+        max_tokens: int,
+        include_sources: bool
+    ) -> Dict[str, Any]:
+        """Resolve schema defaults for a generation request."""
         # Validate marks
         marks = SchemaService.validate_marks(marks)
+        namespace = self._shard_namespace(namespace)
         
-        # Get schema configuration
-        schema = SchemaService.get_schema(marks)
+        # Adaptive top_k unless the caller fixed it: over-fetch, cut later
+        min_k, max_k = SchemaService.get_top_k_bounds(marks)
+        adaptive = top_k is None and config.ENABLE_ADAPTIVE_TOP_K
         
         # Use schema defaults if not provided
         if temperature is None:
@@ -255,52 +701,648 @@ class RAGPipeline:
         
         if max_tokens is None:
             max_tokens = SchemaService.get_max_tokens(marks)
+        elif max_tokens > config.LLM_MAX_COMPLETION_TOKENS:
+            logger.warning(f"max_tokens {max_tokens} too high, capping at {config.LLM_MAX_COMPLETION_TOKENS}")
+            max_tokens = config.LLM_MAX_COMPLETION_TOKENS
         
-        # Retrieve relevant documents
-        documents = self.retrieve(
-            query=query,
-            top_k=top_k,
-            namespace=namespace,
-            filter_metadata=filter_metadata
+        return {
+            "marks": marks,
+            "schema": SchemaService.get_schema(marks),
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "fetch_k": max_k if adaptive else top_k,
+            "min_k": min_k if adaptive else None,
+            "context_tokens": SchemaService.get_context_tokens(marks),
+            "extract_tokens": SchemaService.get_extract_tokens(marks),
+            "custom_system_prompt": custom_system_prompt,
+            "include_sources": include_sources,
+            "llm": self.router.service_for(marks),
+            "scope": make_scope(
+                "answer",
+                marks=marks,
+                top_k=top_k,
+                namespace=namespace,
+                generation=self.retrieval_service.generation(namespace),
+                filter=filter_metadata,
+                system_prompt=custom_system_prompt,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                include_sources=include_sources
+            )
+        }
+    
+    def _cut_documents(self, documents: List[Dict[str, Any]], plan: Dict[str, Any]):
+        """Cut an over-fetched result list at the first big score drop (adaptive top_k)."""
+        if plan["min_k"] is None:
+            return documents, {"adaptive": False, "fetched": len(documents), "kept": len(documents)}
+        
+        kept, reason = cut_by_score(
+            documents,
+            min_k=plan["min_k"],
+            max_k=plan["fetch_k"],
+            relative=config.ADAPTIVE_RELATIVE_SCORE,
+            gap=config.ADAPTIVE_SCORE_GAP
         )
+        return kept, {"adaptive": True, "fetched": len(documents), "kept": len(kept), "cut": reason}
+    
+    @staticmethod
+    def _flight_key(query: str, plan: Dict[str, Any]) -> tuple:
+        """Requests with this key in flight at the same time share one run."""
+        return (normalize_query(query), plan["scope"])
+    
+    def _answer_key(self, query: str, context: str, system_prompt: str, plan: Dict[str, Any]) -> bytes:
+        """Answer cache key: normalized query, marks, context hash and LLM settings."""
+        content = json.dumps([
+            normalize_query(query),
+            plan["marks"],
+            hashlib.md5(context.encode()).hexdigest(),
+            plan["llm"].model,
+            plan["temperature"],
+            plan["max_tokens"],
+            system_prompt
+        ])
+        return hashlib.md5(content.encode()).digest()
+    
+    def _lookup_answer(self, key: bytes) -> Optional[str]:
+        if self.answer_cache is None:
+            return None
+        answer = self.answer_cache.get(key)
+        if answer is not None:
+            logger.info("Answer cache HIT")
+        return answer
+    
+    def _store_answer(self, key: bytes, answer: str):
+        if self.answer_cache is not None and answer:
+            self.answer_cache.set(key, answer)
+    
+    @staticmethod
+    async def _replay(answer: str):
+        """Stream a cached answer in small chunks, like the LLM would."""
+        size = config.ANSWER_REPLAY_CHUNK_CHARS
+        for start in range(0, len(answer), size):
+            yield answer[start:start + size]
+            await asyncio.sleep(0)
+    
+    def _cached_answer(self, query: str, query_vector, plan: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return a previous answer to a near-duplicate question, if any."""
+        if not self.semantic_cache:
+            return None
         
-        # Build context
-        context = self.build_context(documents=documents)
+        hit = self.semantic_cache.lookup(query_vector, plan["scope"])
+        if not hit:
+            return None
         
-        # Build schema-based prompts
-        if custom_system_prompt:
-            system_prompt = custom_system_prompt
+        logger.info(
+            f"Semantic cache HIT (similarity={hit['similarity']}) "
+            f"reusing answer for: {hit['query'][:100]}"
+        )
+        return {
+            **copy.deepcopy(hit["value"]),
+            "query": query,
+            "cache_status": CACHE_HIT_SEMANTIC,
+            "semantic_cache": {
+                "hit": True,
+                "similarity": hit["similarity"],
+                "matched_query": hit["query"]
+            }
+        }
+    
+    @staticmethod
+    def _build_prompts(query: str, context: str, plan: Dict[str, Any]):
+        """Return (system_prompt, user_prompt) for the plan's schema."""
+        if plan["custom_system_prompt"]:
+            system_prompt = plan["custom_system_prompt"]
             user_prompt = f"Context: {context}\n\nQuestion: {query}"
         else:
-            system_prompt = SchemaService.build_system_prompt(marks)
-            user_prompt = SchemaService.build_user_prompt(query, context, marks)
+            system_prompt = SchemaService.build_system_prompt(plan["marks"])
+            user_prompt = SchemaService.build_user_prompt(query, context, plan["marks"])
         
-        # Generate answer using LLM
-        answer = self.llm_service.generate(
-            prompt=user_prompt,
-            system_prompt=system_prompt,
-            temperature=temperature,
-            max_tokens=max_tokens
+        return system_prompt, user_prompt
+    
+    def _pack_for_prompt(
+        self,
+        query: str,
+        documents: List[Dict[str, Any]],
+        plan: Dict[str, Any]
+    ):
+        """
+        Pack context into the plan's token budget and build the prompts.
+        
+        The budget is the schema's context_tokens, capped so prompt +
+        context + max_tokens output fits LLM_CONTEXT_WINDOW. Blocking
+        (counts tokens); the async paths run it on the executor.
+        
+        Returns:
+            (context, system_prompt, user_prompt, context_info)
+        
+        Raises:
+            PromptBudgetError: if prompt + max_tokens leave no context budget
+        """
+        counter = plan["llm"].token_counter
+        system_prompt, user_prompt = self._build_prompts(query, "", plan)
+        prompt_tokens = counter.count(system_prompt) + counter.count(user_prompt)
+        
+        budget = min(
+            plan["context_tokens"],
+            config.LLM_CONTEXT_WINDOW - plan["max_tokens"] - prompt_tokens
         )
+        if budget <= 0:
+            raise PromptBudgetError(
+                f"max_tokens={plan['max_tokens']} leaves no room for context "
+                f"(prompt {prompt_tokens} tokens, LLM_CONTEXT_WINDOW={config.LLM_CONTEXT_WINDOW})"
+            )
+        packed = self.pack_context(documents, max_tokens=budget, token_counter=counter)
+        context = packed.pop("context")
         
+        logger.info(
+            f"Packed {packed['chunks_used']} chunks ({packed['tokens']}/{packed['budget']} tokens), "
+            f"dropped {packed['chunks_dropped']}"
+        )
+        
+        system_prompt, user_prompt = self._build_prompts(query, context, plan)
+        context_info = {
+            **packed,
+            "prompt_tokens": prompt_tokens + packed["tokens"],
+            "exact": counter.exact
+        }
+        
+        return context, system_prompt, user_prompt, context_info
+    
+    def _finish_answer(
+        self,
+        query: str,
+        query_vector,
+        answer: str,
+        context: str,
+        documents: List[Dict[str, Any]],
+        plan: Dict[str, Any],
+        context_info: Dict[str, Any] = None,
+        cache_status: str = CACHE_MISS
+    ) -> Dict[str, Any]:
+        """Assemble the response dict and remember it for near-duplicates."""
+        schema = plan["schema"]
         result = {
             "query": query,
             "answer": answer,
-            "marks": marks,
+            "marks": plan["marks"],
             "schema": {
                 "name": schema['name'],
                 "structure": schema['structure'],
-                "max_tokens": max_tokens,
-                "temperature": temperature
+                "max_tokens": plan["max_tokens"],
+                "temperature": plan["temperature"]
             },
             "context": context,
+            "context_tokens": context_info,
+            "cache_status": cache_status,
             "model": {
                 "embedding": self.embedding_service.model_name,
-                "llm": self.llm_service.model
+                "llm": plan["llm"].model
             }
         }
         
-        if include_sources:
+        if plan["include_sources"]:
             result["sources"] = documents
         
-        return result
\ No newline at end of file
+        if self.semantic_cache:
+            # A private copy: callers may modify the dict they get back
+            self.semantic_cache.store(query_vector, plan["scope"], copy.deepcopy(result), query=query)
+        
+        return result
+    
+    # ------------------------------------------------------------------
+    # Async request path (used by the API). Blocking stages run on the
+    # stage executor so the event loop keeps serving other requests.
+    # ------------------------------------------------------------------
+    
+    async def aembed(self, query: str):
+        """Embed a query without blocking the event loop."""
+        if self.embedding_service.batcher:
+            return await self.embedding_service.aembed_single(query)
+        return await self.executor.run("embed", self.embedding_service.embed_single, query)
+    
+    async def aretrieve(
+        self,
+        query: str,
+        top_k: int = None,
+        namespace: str = None,
+        filter_metadata: Dict[str, Any] = None
+    ) -> List[Dict[str, Any]]:
+        """Async version of retrieve()."""
+        logger.info(f"Processing query: {query[:100]}...")
+        query_vector = await self.aembed(query)
+        
+        return await self.executor.run(
+            "retrieve",
+            self._retrieve_by_vector,
+            query_vector,
+            query=query,
+            top_k=top_k,
+            namespace=namespace,
+            filter_metadata=filter_metadata
+        )
+    
+    async def aretrieve_batch(
+        self,
+        queries: List[str],
+        top_k: int = None,
+        namespace: str = None,
+        filter_metadata: Dict[str, Any] = None,
+        return_exceptions: bool = False
+    ) -> List[List[Dict[str, Any]]]:
+        """Async version of retrieve_batch(); queries fan out concurrently."""
+        logger.info(f"Processing batch of {len(queries)} queries")
+        
+        query_vectors = await self.executor.run("embed", self.embedding_service.embed_batch, queries)
+        first_index = self._first_index(queries)
+        
+        if self.retrieval_service.supports_batch_query and not isinstance(namespace, (list, tuple)):
+            results = await self.executor.run(
+                "retrieve", self._query_batch_safely,
+                query_vectors, first_index, top_k, namespace, filter_metadata
+            )
+        else:
+            # Per-batch cap on top of the global "retrieve" stage limit
+            batch_limit = asyncio.Semaphore(config.BATCH_RETRIEVE_CONCURRENCY)
+            
+            async def retrieve_one(query: str, i: int):
+                async with batch_limit:
+                    return await self.executor.run(
+                        "retrieve",
+                        self._retrieve_by_vector,
+                        query_vectors[i],
+                        query=query,
+                        top_k=top_k,
+                        namespace=namespace,
+                        filter_metadata=filter_metadata
+                    )
+            
+            results = await asyncio.gather(
+                *(retrieve_one(query, i) for query, i in first_index.items()),
+                return_exceptions=True
+            )
+        
+        return self._batch_results(queries, first_index, results, return_exceptions)
+    
+    async def arun(
+        self,
+        query: str,
+        top_k: int = None,
+        namespace: str = None,
+        filter_metadata: Dict[str, Any] = None,
+        include_context: bool = True,
+        include_scores: bool = False
+    ) -> Dict[str, Any]:
+        """Async version of run()."""
+        documents = await self.aretrieve(
+            query=query,
+            top_k=top_k,
+            namespace=namespace,
+            filter_metadata=filter_metadata
+        )
+        
+        result = {
+            "query": query,
+            "documents": documents,
+            "num_results": len(documents),
+            "model": self.embedding_service.model_name
+        }
+        
+        if include_context:
+            result["context"] = self.build_context(
+                documents=documents,
+                include_scores=include_scores
+            )
+        
+        return result
+    
+    async def agenerate_answer(
+        self,
+        query: str,
+        marks: int = 5,
+        top_k: int = None,
+        namespace: str = None,
+        filter_metadata: Dict[str, Any] = None,
+        custom_system_prompt: str = None,
+        temperature: float = None,
+        max_tokens: int = None,
+        include_sources: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Async version of generate_answer(); same arguments and result.
+        
+        Concurrent identical requests (same normalized query and settings)
+        are coalesced onto one run; joiners get a copy of its result with
+        "coalesced": True.
+        """
+        plan = self._plan_answer(
+            marks, top_k, namespace, filter_metadata,
+            custom_system_prompt, temperature, max_tokens, include_sources
+        )
+        
+        if not config.ENABLE_SINGLE_FLIGHT:
+            result = await self._agenerate(query, plan, namespace, filter_metadata)
+            return {**result, "coalesced": False}
+        
+        result, shared = await self.answer_flight.do(
+            self._flight_key(query, plan),
+            lambda: self._agenerate(query, plan, namespace, filter_metadata)
+        )
+        if shared:
+            logger.info(f"Joined in-flight answer for query: {query[:100]}...")
+        return {**result, "query": query, "coalesced": shared}
+    
+    async def _agenerate(
+        self,
+        query: str,
+        plan: Dict[str, Any],
+        namespace,
+        filter_metadata: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        logger.info(f"Generating {plan['marks']}-mark answer for query: {query[:100]}...")
+        
+        query_vector = await self.aembed(query)
+        
+        cached = self._cached_answer(query, query_vector, plan)
+        if cached:
+            return cached
+        
+        documents = await self._aretrieve_for_answer(query, query_vector, plan, namespace, filter_metadata)
+        return await self._aanswer(query, query_vector, documents, plan)
+    
+    async def _aretrieve_for_answer(
+        self,
+        query: str,
+        query_vector,
+        plan: Dict[str, Any],
+        namespace,
+        filter_metadata: Optional[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        return await self.executor.run(
+            "retrieve",
+            self._retrieve_by_vector,
+            query_vector,
+            query=query,
+            top_k=plan["fetch_k"],
+            namespace=namespace,
+            filter_metadata=filter_metadata,
+            include_values=config.ENABLE_CHUNK_DEDUP
+        )
+    
+    async def _aanswer(
+        self,
+        query: str,
+        query_vector,
+        documents: List[Dict[str, Any]],
+        plan: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Cut, dedup, compress and pack retrieved documents, then answer with the LLM."""
+        documents, retrieval_info = self._cut_documents(documents, plan)
+        documents, dedup_info = await self.executor.run(
+            "prompt", self.dedup_documents, documents, query_vector, plan["llm"].token_counter
+        )
+        prompt_documents, extraction_info = await self.executor.run(
+            "embed", self.compress_documents, documents, query_vector, plan
+        )
+        
+        context, system_prompt, user_prompt, context_info = await self.executor.run(
+            "prompt", self._pack_for_prompt, query, prompt_documents, plan
+        )
+        context_info["retrieval"] = retrieval_info
+        context_info["dedup"] = dedup_info
+        context_info["extraction"] = extraction_info
+        
+        answer_key = self._answer_key(query, context, system_prompt, plan)
+        answer = self._lookup_answer(answer_key)
+        if answer is not None:
+            return self._finish_answer(
+                query, query_vector, answer, context, documents, plan, context_info, CACHE_HIT
+            )
+        
+        async with self.executor.limit("llm"):
+            answer = await plan["llm"].agenerate(
+                prompt=user_prompt,
+                system_prompt=system_prompt,
+                temperature=plan["temperature"],
+                max_tokens=plan["max_tokens"],
+                prompt_tokens=context_info["prompt_tokens"]
+            )
+        self._store_answer(answer_key, answer)
+        
+        return self._finish_answer(query, query_vector, answer, context, documents, plan, context_info)
+    
+    async def agenerate_batch(
+        self,
+        items: List[Dict[str, Any]],
+        namespace: str = None,
+        filter_metadata: Dict[str, Any] = None,
+        include_sources: bool = False,
+        concurrency: int = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Answer many questions (e.g. a mock question paper) in one pass.
+        
+        All questions are embedded in one batch, identical retrievals run
+        once, and answers are generated concurrently (at most `concurrency`
+        at a time, default GENERATE_BATCH_CONCURRENCY). One event is
+        yielded per question as soon as it finishes, so events arrive in
+        completion order; a failing question yields an error event without
+        stopping the rest.
+        
+        Args:
+            items: Dicts with "query" and optional marks, top_k,
+                   custom_system_prompt, temperature and max_tokens
+            namespace: Namespace (or list of namespaces) for every question
+            filter_metadata: Metadata filter for every question
+            include_sources: Include source documents in each result
+            concurrency: Max questions answered at the same time
+        
+        Yields:
+            {"index", "status": "ok", "result"} or
+            {"index", "status": "error", "error"}
+        """
+        logger.info(f"Generating batch of {len(items)} answers")
+        limit = asyncio.Semaphore(concurrency or config.GENERATE_BATCH_CONCURRENCY)
+        self._count(self.batch_stats, batches=1, items=len(items))
+        
+        plans = {}
+        for i, item in enumerate(items):
+            try:
+                plans[i] = self._plan_answer(
+                    item.get("marks", 5), item.get("top_k"), namespace, filter_metadata,
+                    item.get("custom_system_prompt"), item.get("temperature"),
+                    item.get("max_tokens"), include_sources
+                )
+            except Exception as e:
+                self._count(self.batch_stats, errors=1)
+                yield {"index": i, "status": "error", "error": str(e)}
+        
+        if not plans:
+            return
+        
+        queries = [items[i]["query"] for i in plans]
+        try:
+            vectors = await self.executor.run("embed", self.embedding_service.embed_batch, queries)
+        except Exception as e:
+            logger.error(f"Error embedding batch: {str(e)}")
+            self._count(self.batch_stats, errors=len(plans))
+            for i in plans:
+                yield {"index": i, "status": "error", "error": str(e)}
+            return
+        query_vectors = dict(zip(plans, vectors))
+        
+        # Same query + same depth -> one shared retrieval task (namespace
+        # and filter are the same for the whole batch). Retrievals are never
+        # cancelled: answers still running (possibly for other clients
+        # that joined them) may be waiting on them.
+        retrievals = {}
+        
+        def retrieval(i: int) -> asyncio.Task:
+            key = (items[i]["query"], plans[i]["fetch_k"])
+            if key not in retrievals:
+                self._count(self.batch_stats, retrievals=1)
+                task = asyncio.ensure_future(self._aretrieve_for_answer(
+                    items[i]["query"], query_vectors[i], plans[i], namespace, filter_metadata
+                ))
+                # Nobody may be left to read the result after a cancel
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                retrievals[key] = task
+            return retrievals[key]
+        
+        async def answer(i: int) -> Dict[str, Any]:
+            query, plan = items[i]["query"], plans[i]
+            async with limit:
+                cached = self._cached_answer(query, query_vectors[i], plan)
+                if cached:
+                    return cached
+                documents = await asyncio.shield(retrieval(i))
+                return await self._aanswer(query, query_vectors[i], documents, plan)
+        
+        led = set()  # flight keys whose answer this batch started
+        
+        async def run(i: int) -> Dict[str, Any]:
+            try:
+                if config.ENABLE_SINGLE_FLIGHT:
+                    key = self._flight_key(items[i]["query"], plans[i])
+                    if self.answer_flight.task(key) is None:
+                        led.add(key)
+                    result, shared = await self.answer_flight.do(key, lambda: answer(i))
+                    result = {**result, "query": items[i]["query"], "coalesced": shared}
+                else:
+                    result = await answer(i)
+                return {"index": i, "status": "ok", "result": result}
+            except Exception as e:
+                logger.error(f"Error generating batch item {i}: {str(e)}")
+                self._count(self.batch_stats, errors=1)
+                return {"index": i, "status": "error", "error": str(e)}
+        
+        tasks = [asyncio.ensure_future(run(i)) for i in plans]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            # Client went away: stop waiting, then cancel the answers this
+            # batch started that no /generate caller has joined meanwhile
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for key in led:
+                self.answer_flight.abandon(key)
+    
+    async def astream_answer(
+        self,
+        query: str,
+        marks: int = 5,
+        top_k: int = None,
+        namespace: str = None,
+        filter_metadata: Dict[str, Any] = None,
+        custom_system_prompt: str = None,
+        temperature: float = None,
+        max_tokens: int = None
+    ) -> AnswerStream:
+        """
+        Retrieve and build prompts, then return an async iterator of answer chunks.
+        
+        Retrieval errors are raised here (before any bytes are streamed);
+        LLM errors surface while iterating. An answer-cache hit is replayed
+        as a chunked stream; a completed LLM stream is added to the cache.
+        
+        Identical concurrent requests share one stream: a client arriving
+        while it runs receives the chunks generated so far, then the live
+        tail. The returned AnswerStream carries cache_status and coalesced.
+        """
+        plan = self._plan_answer(
+            marks, top_k, namespace, filter_metadata,
+            custom_system_prompt, temperature, max_tokens, False
+        )
+        
+        if not config.ENABLE_SINGLE_FLIGHT:
+            chunks, cache_status = await self._open_stream(query, plan, namespace, filter_metadata)
+            return AnswerStream(chunks, cache_status)
+        
+        broadcast, cache_status, shared = await self.stream_flight.open(
+            self._flight_key(query, plan),
+            lambda: self._open_stream(query, plan, namespace, filter_metadata)
+        )
+        if shared:
+            logger.info(f"Joined in-flight stream for query: {query[:100]}...")
+        return AnswerStream(broadcast.subscribe(), cache_status, coalesced=shared)
+    
+    async def _open_stream(
+        self,
+        query: str,
+        plan: Dict[str, Any],
+        namespace,
+        filter_metadata: Optional[Dict[str, Any]]
+    ):
+        """Retrieve and build prompts; return (answer chunk iterator, cache status)."""
+        logger.info(f"Processing query: {query[:100]}...")
+        query_vector = await self.aembed(query)
+        
+        documents = await self.executor.run(
+            "retrieve",
+            self._retrieve_by_vector,
+            query_vector,
+            query=query,
+            top_k=plan["fetch_k"],
+            namespace=namespace,
+            filter_metadata=filter_metadata,
+            include_values=config.ENABLE_CHUNK_DEDUP
+        )
+        documents, _ = self._cut_documents(documents, plan)
+        documents, _ = await self.executor.run(
+            "prompt", self.dedup_documents, documents, query_vector, plan["llm"].token_counter
+        )
+        documents, _ = await self.executor.run(
+            "embed", self.compress_documents, documents, query_vector, plan
+        )
+        
+        context, system_prompt, user_prompt, context_info = await self.executor.run(
+            "prompt", self._pack_for_prompt, query, documents, plan
+        )
+        
+        answer_key = self._answer_key(query, context, system_prompt, plan)
+        answer = self._lookup_answer(answer_key)
+        if answer is not None:
+            return self._replay(answer), CACHE_HIT
+        
+        async def stream():
+            chunks = []
+            async with self.executor.limit("llm"):
+                async for chunk in plan["llm"].agenerate_stream(
+                    prompt=user_prompt,
+                    system_prompt=system_prompt,
+                    temperature=plan["temperature"],
+                    max_tokens=plan["max_tokens"],
+                    prompt_tokens=context_info["prompt_tokens"]
+                ):
+                    chunks.append(chunk)
+                    yield chunk
+            self._store_answer(answer_key, "".join(chunks))
+        
+        return stream(), CACHE_MISS
+    
+    def close(self):
+        """Release worker threads and flush persistent state."""
+        self.executor.shutdown()
+        self.embedding_service.close()
+        self.retrieval_service.close()
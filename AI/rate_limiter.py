@@ -0,0 +1,185 @@
+import asyncio
+import email.utils
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Reservation-based token bucket refilled at `per_minute` units/minute.
+
+    reserve(n) always succeeds and returns how long the caller must wait
+    before using its n units; the balance may go negative, so callers are
+    served in arrival order (FIFO) without a separate queue.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take `amount` units; return the wait in seconds until they exist."""
+        self._refill(now)
+        self._tokens -= min(amount, self.capacity)
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def refund(self, amount: float, now: float):
+        """Give back units reserved but not used (negative to charge extra)."""
+        self._refill(now)
+        self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class LLMRateLimiter:
+    """
+    Client-side requests/minute and tokens/minute limiter for the LLM API.
+
+    A request reserves one request unit and its estimated tokens (prompt +
+    max_tokens) and then waits until both buckets cover it. On a 429 the
+    limiter pauses every caller until the server's Retry-After has passed,
+    so queued requests wait their turn instead of failing. Works from
+    threads (wait) and coroutines (await await_slot); a limit of 0
+    disables that bucket.
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, window: int = 1000):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = TokenBucket(rpm) if rpm else None
+        self._tokens = TokenBucket(tpm) if tpm else None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+        self._waits = deque(maxlen=window)  # seconds, per admitted request
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.admitted = 0
+        self.throttled = 0
+
+        logger.info(f"LLM rate limiter: rpm={rpm or 'off'}, tpm={tpm or 'off'}")
+
+    def _reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            delay = self._paused_until - now
+            if self._requests:
+                delay = max(delay, self._requests.reserve(1, now))
+            if self._tokens:
+                delay = max(delay, self._tokens.reserve(tokens, now))
+            return max(0.0, delay)
+
+    def _enter(self):
+        with self._lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+    def _leave(self, waited: float):
+        with self._lock:
+            self.queue_depth -= 1
+            self.admitted += 1
+            self._waits.append(waited)
+
+    async def await_slot(self, tokens: int) -> float:
+        """Wait (async) until a request of `tokens` tokens may be sent; return the wait."""
+        delay = self._reserve(tokens)
+        self._enter()
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+        finally:
+            self._leave(delay)
+        return delay
+
+    def wait(self, tokens: int) -> float:
+        """Blocking version of await_slot() for the sync client."""
+        delay = self._reserve(tokens)
+        self._enter()
+        try:
+            if delay:
+                time.sleep(delay)
+        finally:
+            self._leave(delay)
+        return delay
+
+    def settle(self, reserved: int, used: Optional[int]):
+        """Correct the token bucket with the usage the API reported."""
+        if self._tokens and used is not None:
+            with self._lock:
+                self._tokens.refund(reserved - used, time.monotonic())
+
+    def pause(self, seconds: float):
+        """Hold every caller for `seconds` (server returned 429 / Retry-After)."""
+        with self._lock:
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        logger.warning(f"LLM rate limited, pausing requests for {seconds:.2f}s")
+
+    def stats(self) -> dict:
+        """Return queue depth, wait-time percentiles and 429 counts."""
+        with self._lock:
+            waits = np.fromiter(self._waits, dtype=np.float64)
+            paused_for = max(0.0, self._paused_until - time.monotonic())
+            stats = {
+                "rpm": self.rpm or None,
+                "tpm": self.tpm or None,
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "admitted": self.admitted,
+                "throttled": self.throttled,
+                "paused_for_s": round(paused_for, 3)
+            }
+
+        if len(waits):
+            stats["wait"] = {
+                "waited": int((waits > 0).sum()),
+                "mean_ms": round(float(waits.mean()) * 1000, 2),
+                "p95_ms": round(float(np.percentile(waits, 95)) * 1000, 2),
+                "max_ms": round(float(waits.max()) * 1000, 2)
+            }
+        return stats
+
+
+def retry_after_seconds(headers, default: float) -> float:
+    """Parse retry-after-ms / Retry-After (seconds or HTTP date) response headers."""
+    if headers is None:
+        return default
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+@functools.lru_cache(maxsize=None)
+def get_rate_limiter(model: str) -> LLMRateLimiter:
+    """One limiter per model per process (Groq limits are per model)."""
+    return LLMRateLimiter(rpm=config.LLM_RPM, tpm=config.LLM_TPM)
@@ -0,0 +1,194 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+from vector_store import VectorStore
+
+logger = logging.getLogger(__name__)
+
+
+# Caller mistakes: retrying or hedging cannot fix these
+_NON_RETRYABLE = (ValueError, TypeError, KeyError)
+
+
+class VectorStoreTimeout(TimeoutError):
+    """A vector store call did not finish within its deadline."""
+
+
+class ResilientVectorStore(VectorStore):
+    """
+    Deadline, retry and hedging wrapper around a remote VectorStore.
+
+    Every query runs in a small thread pool so the caller can stop waiting
+    at the deadline. Failed attempts are retried with jittered exponential
+    backoff ("full jitter") while the deadline allows. With hedging on, a
+    duplicate query is fired once an attempt has been outstanding longer
+    than the recent p`hedge_percentile` latency, and the first successful
+    response wins. Queries are read-only, so duplicates are safe.
+
+    A thread that is abandoned at the deadline keeps running until the
+    client's own request timeout returns it to the pool.
+    """
+
+    def __init__(
+        self,
+        store: VectorStore,
+        timeout: float = 2.0,
+        retries: int = 2,
+        backoff_base: float = 0.05,
+        backoff_max: float = 1.0,
+        hedge: bool = False,
+        hedge_percentile: float = 95,
+        hedge_min_delay: float = 0.02,
+        max_workers: int = 16,
+        window: int = 500
+    ):
+        self.store = store
+        self.name = f"{store.name}+resilient"
+        self.supports_batch_query = store.supports_batch_query
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vector-store")
+        self._latencies = deque(maxlen=window)  # seconds, successful attempts only
+        self._lock = threading.Lock()
+        self._counters = {
+            "calls": 0,
+            "failures": 0,
+            "timeouts": 0,
+            "retries": 0,
+            "hedges": 0,
+            "hedge_wins": 0
+        }
+
+        logger.info(
+            f"Vector store resilience: timeout={timeout}s, retries={retries}, "
+            f"hedge={hedge} (p{hedge_percentile})"
+        )
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def hedge_delay(self) -> Optional[float]:
+        """Current hedge trigger in seconds, or None until enough samples exist."""
+        with self._lock:
+            if len(self._latencies) < 20:
+                return None
+            samples = np.fromiter(self._latencies, dtype=np.float64)
+        return max(self.hedge_min_delay, float(np.percentile(samples, self.hedge_percentile)))
+
+    def _timed(self, fn: Callable, *args) -> Any:
+        """Run fn and record its latency if it succeeds."""
+        start = time.perf_counter()
+        result = fn(*args)
+        with self._lock:
+            self._latencies.append(time.perf_counter() - start)
+        return result
+
+    def _attempt(self, fn: Callable, args: tuple, deadline: float, hedge: bool) -> Any:
+        """One logical attempt, hedged with a duplicate call if it runs slow."""
+        primary = self._pool.submit(self._timed, fn, *args)
+        pending = {primary}
+
+        delay = self.hedge_delay() if hedge else None
+        if delay is not None:
+            done, pending = wait(pending, timeout=min(delay, max(0.0, deadline - time.monotonic())))
+            if not done and time.monotonic() < deadline:
+                self._count("hedges")
+                pending.add(self._pool.submit(self._timed, fn, *args))
+
+        error: Optional[BaseException] = primary.exception() if primary.done() else None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+
+        if primary.done() and primary.exception() is None:
+            return primary.result()
+        if pending or error is None:
+            for future in pending:
+                future.cancel()
+            raise VectorStoreTimeout(f"{self.store.name} call exceeded {self.timeout}s deadline")
+        raise error
+
+    def _call(self, fn: Callable, *args, hedge: bool = True) -> Any:
+        """Call fn under the deadline, retrying retryable failures."""
+        self._count("calls")
+        deadline = time.monotonic() + self.timeout
+
+        for attempt in range(self.retries + 1):
+            try:
+                return self._attempt(fn, args, deadline, hedge and self.hedge)
+            except _NON_RETRYABLE:
+                self._count("failures")
+                raise
+            except Exception as e:
+                backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                last_try = attempt == self.retries or time.monotonic() + backoff >= deadline
+                if isinstance(e, VectorStoreTimeout):
+                    self._count("timeouts")
+                if last_try:
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                logger.warning(
+                    f"{self.store.name} attempt {attempt + 1} failed ({type(e).__name__}: {e}), "
+                    f"retrying in {backoff * 1000:.0f}ms"
+                )
+                time.sleep(backoff)
+
+    def query(self, vector, top_k, namespace=None, filter_metadata=None, include_values=False):
+        return self._call(self.store.query, vector, top_k, namespace, filter_metadata, include_values)
+
+    def query_batch(self, vectors, top_k, namespace=None, filter_metadata=None, include_values=False):
+        if not self.supports_batch_query:
+            return super().query_batch(vectors, top_k, namespace, filter_metadata, include_values)
+        return self._call(self.store.query_batch, vectors, top_k, namespace, filter_metadata, include_values)
+
+    def describe_index_stats(self) -> dict:
+        return self._call(self.store.describe_index_stats, hedge=False)
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self.store.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return call/retry/hedge counters and recent latency percentiles."""
+        with self._lock:
+            counters = dict(self._counters)
+            samples = np.fromiter(self._latencies, dtype=np.float64)
+
+        latency = {}
+        if len(samples):
+            latency = {
+                f"p{pct}_ms": round(float(np.percentile(samples, pct)) * 1000, 2)
+                for pct in (50, 95, 99)
+            }
+
+        delay = self.hedge_delay()
+        return {
+            **counters,
+            "timeout_s": self.timeout,
+            "hedge": self.hedge,
+            "hedge_delay_ms": round(delay * 1000, 2) if delay is not None and self.hedge else None,
+            "latency": latency
+        }
@@ -1,43 +1,172 @@
+import hashlib
+import heapq
+import json
 import logging
-from typing import List, Dict, Any, Optional
-import os
-from pinecone import Pinecone
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Optional, Tuple, Union
 
+import numpy as np
+
+from cache_manager import EmbeddingCache, TTLCache, make_cache_key
 from config import config
+from vector_store import VectorStore, create_vector_store
 
 logger = logging.getLogger(__name__)
 
 
+def cut_by_score(
+    matches: List[Dict[str, Any]],
+    min_k: int,
+    max_k: int,
+    relative: float = 0.85,
+    gap: float = 0.08
+) -> Tuple[List[Dict[str, Any]], str]:
+    """
+    Adaptive cut of a best-first match list.
+
+    Keeps the first `min_k` matches, then stops at the first match whose
+    score is below `relative` * best score, or more than `gap` below the
+    previous match, or at `max_k`.
+
+    Returns:
+        (kept matches, reason: "relative" | "gap" | "max_k" | "exhausted")
+    """
+    if not matches:
+        return [], "exhausted"
+
+    best = matches[0]["score"]
+    for i in range(max(min_k, 1), min(max_k, len(matches))):
+        score = matches[i]["score"]
+        if score < best * relative:
+            return matches[:i], "relative"
+        if matches[i - 1]["score"] - score > gap:
+            return matches[:i], "gap"
+
+    if len(matches) >= max_k:
+        return matches[:max_k], "max_k"
+    return list(matches), "exhausted"
+
+
 class RetrievalService:
     """
-    Service for retrieving similar documents from Pinecone.
+    Service for retrieving similar documents from the vector store
+    (Pinecone by default, or the local in-process index).
+
+    Results are cached per exact query vector + top_k/namespace/filter.
+    Each namespace has a generation number that is part of the key;
+    invalidate_namespace() bumps it, so stale entries stop matching at
+    once (and age out via LRU/TTL) without scanning the cache. A query
+    already in flight during an invalidation stores under the old
+    generation, so it cannot repopulate stale results. Cached results
+    never hold chunk vectors: with include_values they are kept once per
+    chunk in a float32 matrix (chunk_vectors) and re-attached on a hit.
+
+    query_shards() searches several namespaces (optionally on other
+    indexes, as "index:namespace") in parallel and merges a global top-k.
     """
 
-    def __init__(self, index_name: str = None):
+    def __init__(self, index_name: str = None, store: VectorStore = None, enable_cache: bool = None):
         self.index_name = index_name or config.PINECONE_INDEX_NAME
-        self._initialize_pinecone()
+        self.store = store or create_vector_store(index_name=self.index_name)
+        logger.info(f"Retrieval backend: {self.store.name}")
+
+        if enable_cache is None:
+            enable_cache = config.ENABLE_RETRIEVAL_CACHE
+        self.cache = TTLCache(
+            max_size=config.RETRIEVAL_CACHE_MAX_SIZE,
+            ttl=config.RETRIEVAL_CACHE_TTL,
+            name="retrieval"
+        ) if enable_cache else None
+        # Cached results never hold vectors; include_values gets them from here
+        self.chunk_vectors = EmbeddingCache(max_size=config.CHUNK_VECTOR_CACHE_SIZE)
+        self._generations: Dict[str, int] = {}
+        self._generation_lock = threading.Lock()
+        self.invalidations = 0
+
+        # Sharded queries: one pool for the fan-out, extra indexes opened lazily
+        self._shard_pool = ThreadPoolExecutor(
+            max_workers=config.SHARD_MAX_WORKERS, thread_name_prefix="retrieval-shard"
+        )
+        self._shard_stores: Dict[str, VectorStore] = {}
+        self._shard_lock = threading.Lock()
+        self._shard_counters: Dict[str, Dict[str, int]] = {}
+
+        # describe_index_stats() is refreshed in the background, never per request
+        self.stats_interval = config.INDEX_STATS_REFRESH_S
+        self._index_stats: Optional[dict] = None
+        self._index_stats_at: Optional[float] = None
+        self._index_stats_error: Optional[str] = None
+        self._stats_wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._stats_thread = threading.Thread(
+            target=self._refresh_index_stats_loop, name="index-stats", daemon=True
+        )
+        self._stats_thread.start()
 
-    def _initialize_pinecone(self):
-        """Initialize Pinecone client and index."""
-        logger.info("Initializing Pinecone client")
+    def _cache_key(
+        self,
+        query_vector,
+        top_k: int,
+        namespace: Optional[str],
+        filter_metadata: Optional[Dict[str, Any]],
+        include_values: bool = False
+    ) -> Tuple:
+        """(namespace, generation, md5 of vector bytes + params)."""
+        namespace = namespace or ""
+        digest = hashlib.md5(np.asarray(query_vector, dtype=np.float32).tobytes())
+        params = json.dumps(filter_metadata, sort_keys=True, default=str)
+        digest.update(f"{top_k}:{include_values}:{params}".encode())
+        return (namespace, self._generations.get(namespace, 0), digest.digest())
 
-        api_key = os.getenv("PINECONE_API_KEY")
+    def _cached(self, key: Tuple, namespace: Optional[str], include_values: bool) -> Optional[List[Dict[str, Any]]]:
+        """Cached matches (copied, so callers may mutate them) or None."""
+        matches = self.cache.get(key)
+        if matches is None:
+            return None
+        if include_values:
+            return self.attach_vectors(matches, namespace)
+        return [dict(match) for match in matches]
 
-        if not api_key:
-            raise ValueError("PINECONE_API_KEY must be set as an environment variable")
+    def _chunk_key(self, match: Dict[str, Any], namespace) -> bytes:
+        """Chunk id + shard/namespace + its generation (re-indexed vectors stop matching)."""
+        shard = str(match.get("shard") or namespace or "")
+        generation = self._generations.get(shard.rpartition(":")[2], 0)
+        return make_cache_key(str(match["id"]), f"{shard}:{generation}")
 
-        # NEW Pinecone SDK initialization
-        self.pc = Pinecone(api_key=api_key)
-        self.index = self.pc.Index(self.index_name)
+    def strip_vectors(self, matches: List[Dict[str, Any]], namespace=None) -> List[Dict[str, Any]]:
+        """
+        Copies of `matches` without "values", for caching. The vectors go
+        to the chunk vector cache, where attach_vectors() finds them.
+        """
+        stripped = []
+        for match in matches:
+            match = dict(match)
+            values = match.pop("values", None)
+            if values is not None:
+                self.chunk_vectors.set_key(self._chunk_key(match, namespace), values)
+            stripped.append(match)
+        return stripped
 
-        logger.info(f"Connected to Pinecone index: {self.index_name}")
+    def attach_vectors(self, matches: List[Dict[str, Any]], namespace=None) -> List[Dict[str, Any]]:
+        """Copies of `matches` with their cached "values" (left out once evicted)."""
+        attached = []
+        for match in matches:
+            match = dict(match)
+            values = self.chunk_vectors.get_key(self._chunk_key(match, namespace))
+            if values is not None:
+                match["values"] = values
+            attached.append(match)
+        return attached
 
     def query(
         self,
-        query_vector: List[float],
+        query_vector: Union[List[float], np.ndarray],
         top_k: int = None,
         namespace: Optional[str] = None,
-        filter_metadata: Optional[Dict[str, Any]] = None
+        filter_metadata: Optional[Dict[str, Any]] = None,
+        include_values: bool = False
     ) -> List[Dict[str, Any]]:
 
         top_k = top_k or config.DEFAULT_TOP_K
@@ -48,39 +177,251 @@ class RetrievalService:
             )
             top_k = config.MAX_TOP_K
 
-        query_params = {
-            "vector": query_vector,
-            "top_k": top_k,
-            "include_metadata": True
+        if self.cache is not None:
+            key = self._cache_key(query_vector, top_k, namespace, filter_metadata, include_values)
+            cached = self._cached(key, namespace, include_values)
+            if cached is not None:
+                logger.info(f"Retrieval cache HIT: top_k={top_k}, namespace={namespace}")
+                return cached
+
+        logger.info(f"Querying {self.store.name}: top_k={top_k}, namespace={namespace}")
+
+        matches = self.store.query(
+            query_vector,
+            top_k=top_k,
+            namespace=namespace,
+            filter_metadata=filter_metadata,
+            include_values=include_values
+        )
+
+        if self.cache is not None:
+            self.cache.set(key, self.strip_vectors(matches, namespace))
+
+        logger.info(f"Retrieved {len(matches)} documents")
+        return matches
+
+    def _shard_store(self, index_name: Optional[str]) -> VectorStore:
+        """Vector store for a shard's index (the default store if unnamed)."""
+        if not index_name or index_name == self.index_name:
+            return self.store
+        with self._shard_lock:
+            store = self._shard_stores.get(index_name)
+            if store is None:
+                store = self._shard_stores[index_name] = create_vector_store(index_name=index_name)
+            return store
+
+    def _query_shard(self, shard: str, query_vector, top_k, filter_metadata, include_values):
+        """Query one shard ("namespace" or "index:namespace"); matches are tagged with it."""
+        index_name, _, namespace = shard.rpartition(":")
+        store = self._shard_store(index_name)
+
+        if store is self.store:
+            matches = self.query(query_vector, top_k, namespace or None, filter_metadata, include_values)
+        else:
+            matches = store.query(query_vector, top_k, namespace or None, filter_metadata, include_values)
+
+        return [{**match, "shard": shard} for match in matches]
+
+    def query_shards(
+        self,
+        query_vector: Union[List[float], np.ndarray],
+        shards: List[str],
+        top_k: int = None,
+        filter_metadata: Optional[Dict[str, Any]] = None,
+        include_values: bool = False,
+        deadline: float = None
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+        """
+        Query several shards in parallel and merge their global top_k.
+
+        Each shard is a namespace of this index, or "index:namespace" for
+        another index. Shards that miss the deadline (seconds, default
+        SHARD_DEADLINE_S) or fail are left out, so the result may be partial.
+
+        Returns:
+            (matches best first, each tagged with "shard"; shard -> "ok" | "timeout" | "error")
+        """
+        top_k = min(top_k or config.DEFAULT_TOP_K, config.MAX_TOP_K)
+        deadline = config.SHARD_DEADLINE_S if deadline is None else deadline
+
+        futures = {
+            self._shard_pool.submit(
+                self._query_shard, shard, query_vector, top_k, filter_metadata, include_values
+            ): shard
+            for shard in dict.fromkeys(shards)
         }
+        done, pending = wait(futures, timeout=deadline)
 
-        if namespace:
-            query_params["namespace"] = namespace
+        status = {}
+        results = []
+        for future, shard in futures.items():
+            if future in pending:
+                future.cancel()
+                status[shard] = "timeout"
+            elif future.exception() is not None:
+                status[shard] = "error"
+                logger.warning(f"Shard {shard} failed: {future.exception()}")
+            else:
+                status[shard] = "ok"
+                results.append(future.result())
+            self._count_shard(shard, status[shard])
 
-        if filter_metadata:
-            query_params["filter"] = filter_metadata
+        if len(results) < len(futures):
+            logger.warning(f"Partial sharded retrieval: {status}")
 
-        logger.info(f"Querying Pinecone: top_k={top_k}, namespace={namespace}")
+        # Global top-k over all shards with a size-k heap
+        matches = heapq.nlargest(
+            top_k,
+            (match for shard_matches in results for match in shard_matches),
+            key=lambda match: match["score"]
+        )
+        return matches, status
 
-        response = self.index.query(**query_params)
+    def _count_shard(self, shard: str, status: str):
+        with self._shard_lock:
+            counters = self._shard_counters.setdefault(shard, {"ok": 0, "timeout": 0, "error": 0})
+            counters[status] += 1
 
-        matches = [
-            {
-                "id": match["id"],
-                "score": match["score"],
-                "metadata": match.get("metadata", {})
-            }
-            for match in response.get("matches", [])
-        ]
+    def get_shard_stats(self) -> dict:
+        """Per-shard ok/timeout/error counts of sharded queries."""
+        with self._shard_lock:
+            return {shard: dict(counters) for shard, counters in self._shard_counters.items()}
 
-        logger.info(f"Retrieved {len(matches)} documents")
-        return matches
+    @property
+    def supports_batch_query(self) -> bool:
+        """Whether the backend answers many vectors in one call."""
+        return self.store.supports_batch_query
+
+    def query_batch(
+        self,
+        query_vectors,
+        top_k: int = None,
+        namespace: Optional[str] = None,
+        filter_metadata: Optional[Dict[str, Any]] = None,
+        include_values: bool = False
+    ) -> List[List[Dict[str, Any]]]:
+        """Query several vectors at once via the backend's multi-query API."""
+        top_k = min(top_k or config.DEFAULT_TOP_K, config.MAX_TOP_K)
+
+        results: List[Optional[List[Dict[str, Any]]]] = [None] * len(query_vectors)
+        keys = [None] * len(query_vectors)
+        if self.cache is not None:
+            for i, query_vector in enumerate(query_vectors):
+                keys[i] = self._cache_key(query_vector, top_k, namespace, filter_metadata, include_values)
+                results[i] = self._cached(keys[i], namespace, include_values)
+
+        misses = [i for i, matches in enumerate(results) if matches is None]
+        if not misses:
+            return results
+
+        logger.info(
+            f"Batch querying {self.store.name}: {len(misses)}/{len(query_vectors)} vectors, "
+            f"top_k={top_k}, namespace={namespace}"
+        )
+
+        fetched = self.store.query_batch(
+            [query_vectors[i] for i in misses],
+            top_k=top_k,
+            namespace=namespace,
+            filter_metadata=filter_metadata,
+            include_values=include_values
+        )
+
+        for i, matches in zip(misses, fetched):
+            results[i] = matches
+            if self.cache is not None:
+                self.cache.set(keys[i], self.strip_vectors(matches, namespace))
+
+        return results
+
+    def invalidate_namespace(self, namespace: Optional[str] = None):
+        """Drop cached results for one namespace (call after re-indexing it)."""
+        namespace = namespace or ""
+        with self._generation_lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            self.invalidations += 1
+        # Vector counts likely changed with the re-index
+        self._stats_wakeup.set()
+        logger.info(f"Retrieval cache invalidated for namespace={namespace or '(default)'}")
+
+    def generation(self, namespace) -> Union[int, Tuple[int, ...]]:
+        """
+        Current invalidation generation of a namespace (a tuple for a tuple
+        of shards). Caches in front of this service put it in their keys so
+        a result computed before an invalidation is never served after it.
+        """
+        if isinstance(namespace, tuple):
+            return tuple(self._generations.get(shard or "", 0) for shard in namespace)
+        return self._generations.get(namespace or "", 0)
+
+    def clear_cache(self):
+        """Drop all cached retrieval results."""
+        if self.cache is not None:
+            self.cache.clear()
+        self.chunk_vectors.clear()
+
+    def get_cache_stats(self) -> dict:
+        """Get retrieval cache statistics."""
+        if self.cache is None:
+            return {"cache_enabled": False}
+        return {
+            **self.cache.stats(),
+            "invalidations": self.invalidations,
+            "namespace_generations": {
+                namespace or "(default)": generation
+                for namespace, generation in self._generations.items()
+            },
+            "chunk_vectors": self.chunk_vectors.stats()
+        }
+
+    def refresh_index_stats(self):
+        """Fetch index statistics from the store now (blocking)."""
+        try:
+            self._index_stats = self.store.describe_index_stats()
+            self._index_stats_at = time.time()
+            self._index_stats_error = None
+        except Exception as e:
+            self._index_stats_error = f"{type(e).__name__}: {e}"
+            logger.warning(f"Index stats refresh failed: {self._index_stats_error}")
+
+    def _refresh_index_stats_loop(self):
+        while not self._closed.is_set():
+            # Clear before refreshing: a wakeup set during the refresh (or
+            # just after the wait times out) then triggers another refresh
+            self._stats_wakeup.clear()
+            self.refresh_index_stats()
+            self._stats_wakeup.wait(self.stats_interval)
 
     def get_index_stats(self) -> dict:
-        """Get Pinecone index statistics."""
-        stats = self.index.describe_index_stats()
+        """
+        Get vector index statistics from the last background refresh.
+
+        Never calls the store. `refreshed_at` is a unix timestamp and
+        `age_s` its age; `stale` is set once a refresh is overdue (e.g.
+        the store is failing, see `error`).
+        """
+        if self._index_stats_at is None:
+            return {"status": "pending", "error": self._index_stats_error}
+
+        age = time.time() - self._index_stats_at
         return {
-            "dimension": stats.get("dimension"),
-            "total_vector_count": stats.get("total_vector_count"),
-            "namespaces": stats.get("namespaces", {})
+            **self._index_stats,
+            "refreshed_at": round(self._index_stats_at, 3),
+            "age_s": round(age, 1),
+            "stale": age > 2 * self.stats_interval,
+            "error": self._index_stats_error
         }
+
+    def get_store_stats(self) -> dict:
+        """Get call/retry/hedge statistics of the vector store client."""
+        stats = getattr(self.store, "stats", None)
+        return stats() if stats else {"backend": self.store.name}
+
+    def close(self):
+        """Stop the stats refresher and release the vector store client."""
+        self._closed.set()
+        self._stats_wakeup.set()
+        self._shard_pool.shutdown(wait=False, cancel_futures=True)
+        self.store.close()
+        for store in self._shard_stores.values():
+            store.close()
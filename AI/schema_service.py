@@ -1,5 +1,5 @@
 import logging
-from typing import Dict
+from typing import Dict, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +16,11 @@ class SchemaService:
             "name": "1 Mark Answer",
             "structure": "Definition only",
             "max_tokens": 100,
+            "top_k": {"min": 1, "max": 3},
+            "context_tokens": 600,
+            "extract_tokens": 250,
             "temperature": 0.2,
+            "model_tier": "small",
             "guidelines": [
                 "Provide only a concise definition",
                 "1-2 sentences maximum",
@@ -28,7 +32,11 @@ class SchemaService:
             "name": "2 Mark Answer",
             "structure": "Definition + Example",
             "max_tokens": 200,
+            "top_k": {"min": 2, "max": 4},
+            "context_tokens": 900,
+            "extract_tokens": 400,
             "temperature": 0.3,
+            "model_tier": "small",
             "guidelines": [
                 "Start with a clear definition (1-2 sentences)",
                 "Provide one relevant example",
@@ -40,7 +48,11 @@ class SchemaService:
             "name": "3 Mark Answer",
             "structure": "Definition + Explanation + Example",
             "max_tokens": 300,
+            "top_k": {"min": 2, "max": 5},
+            "context_tokens": 1200,
+            "extract_tokens": 600,
             "temperature": 0.3,
+            "model_tier": "small",
             "guidelines": [
                 "Begin with a clear definition",
                 "Explain the concept in 2-3 sentences",
@@ -52,7 +64,10 @@ class SchemaService:
             "name": "4 Mark Answer",
             "structure": "Definition + Detailed Explanation + Examples",
             "max_tokens": 400,
+            "top_k": {"min": 3, "max": 6},
+            "context_tokens": 1500,
             "temperature": 0.3,
+            "model_tier": "small",
             "guidelines": [
                 "Start with a comprehensive definition",
                 "Provide detailed explanation with key points",
@@ -64,7 +79,10 @@ class SchemaService:
             "name": "5 Mark Answer",
             "structure": "Definition + Explanation + Multiple Examples + Key Points",
             "max_tokens": 500,
+            "top_k": {"min": 3, "max": 8},
+            "context_tokens": 1800,
             "temperature": 0.3,
+            "model_tier": "small",
             "guidelines": [
                 "Begin with a complete definition",
                 "Explain the concept thoroughly",
@@ -77,7 +95,10 @@ class SchemaService:
             "name": "7 Mark Answer",
             "structure": "Comprehensive Coverage",
             "max_tokens": 700,
+            "top_k": {"min": 4, "max": 10},
+            "context_tokens": 2500,
             "temperature": 0.3,
+            "model_tier": "large",
             "guidelines": [
                 "Detailed definition and context",
                 "Thorough explanation with multiple aspects",
@@ -90,7 +111,10 @@ class SchemaService:
             "name": "10 Mark Answer",
             "structure": "Complete Analysis",
             "max_tokens": 1000,
+            "top_k": {"min": 5, "max": 12},
+            "context_tokens": 3200,
             "temperature": 0.3,
+            "model_tier": "large",
             "guidelines": [
                 "Comprehensive definition with context",
                 "Detailed explanation covering all aspects",
@@ -104,7 +128,10 @@ class SchemaService:
             "name": "15 Mark Answer",
             "structure": "In-Depth Essay Style",
             "max_tokens": 1500,
+            "top_k": {"min": 6, "max": 15},
+            "context_tokens": 4000,
             "temperature": 0.3,
+            "model_tier": "large",
             "guidelines": [
                 "Structured with introduction, body, conclusion",
                 "Comprehensive coverage of all aspects",
@@ -118,21 +145,29 @@ class SchemaService:
     }
     
     @staticmethod
-    def get_schema(marks: int) -> Dict:
+    def get_schema_marks(marks: int) -> int:
         """
-        Get the answer schema for given marks.
-        Returns closest available schema if exact match not found.
+        Get the marks level of the schema used for given marks.
+        Returns closest available level if exact match not found.
         """
         # If exact match exists
         if marks in SchemaService.SCHEMAS:
-            return SchemaService.SCHEMAS[marks]
+            return marks
         
         # Find closest schema
         available_marks = sorted(SchemaService.SCHEMAS.keys())
         closest = min(available_marks, key=lambda x: abs(x - marks))
         
         logger.info(f"No exact schema for {marks} marks, using {closest} mark schema")
-        return SchemaService.SCHEMAS[closest]
+        return closest
+    
+    @staticmethod
+    def get_schema(marks: int) -> Dict:
+        """
+        Get the answer schema for given marks.
+        Returns closest available schema if exact match not found.
+        """
+        return SchemaService.SCHEMAS[SchemaService.get_schema_marks(marks)]
     
     @staticmethod
     def build_system_prompt(marks: int) -> str:
@@ -234,6 +269,42 @@ Provide a {schema['name']} following the structure: {schema['structure']}"""
         schema = SchemaService.get_schema(marks)
         return schema['max_tokens']
     
+    @staticmethod
+    def get_top_k_bounds(marks: int) -> Tuple[int, int]:
+        """
+        Get (min, max) number of chunks to retrieve for given marks.
+        Retrieval over-fetches max, then cuts at a score drop (never below min).
+        """
+        schema = SchemaService.get_schema(marks)
+        return schema['top_k']['min'], schema['top_k']['max']
+    
+    @staticmethod
+    def get_context_tokens(marks: int) -> int:
+        """
+        Get the retrieved-context token budget for given marks.
+        Short answers need (and should pay for) less context.
+        """
+        schema = SchemaService.get_schema(marks)
+        return schema['context_tokens']
+    
+    @staticmethod
+    def get_extract_tokens(marks: int) -> Optional[int]:
+        """
+        Get the token budget for query-focused sentence extraction.
+        Only short-answer schemas compress context; others return None.
+        """
+        schema = SchemaService.get_schema(marks)
+        return schema.get('extract_tokens')
+    
+    @staticmethod
+    def get_model_tier(marks: int) -> str:
+        """
+        Get the LLM tier ("small" or "large") for given marks.
+        Short answers go to a small fast model; long answers need the large one.
+        """
+        schema = SchemaService.get_schema(marks)
+        return schema['model_tier']
+    
     @staticmethod
     def validate_marks(marks: int) -> int:
         """
@@ -0,0 +1,221 @@
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+# Upper edges of the best-similarity histogram buckets (for threshold tuning)
+_SIMILARITY_BUCKETS = (0.8, 0.85, 0.9, 0.95, 0.98, 1.0)
+
+
+def make_scope(kind: str, **params) -> Tuple:
+    """
+    Build a hashable cache scope from request parameters.
+
+    Entries only match within the same scope, so e.g. a 2-mark answer is
+    never served for a 10-mark question. Dict params (filters) are
+    serialized with sorted keys.
+    """
+    return (kind,) + tuple(
+        (name, json.dumps(value, sort_keys=True, default=str) if isinstance(value, dict) else value)
+        for name, value in sorted(params.items())
+    )
+
+
+class SemanticCache:
+    """
+    Similarity-keyed cache for near-duplicate queries.
+
+    Query vectors are kept as rows of one float32 matrix; a lookup is a
+    single matrix-vector product masked to the caller's scope, and the
+    best row is a hit if its cosine similarity clears `threshold`. Storing
+    a near-duplicate of a live row in the same scope overwrites that row;
+    otherwise, when full, an expired row is reused first, else the least
+    recently used. A scope's id is dropped once it has no rows left, so
+    the scope table never outgrows the matrix.
+    """
+
+    def __init__(
+        self,
+        dimension: int,
+        max_size: int = 2000,
+        threshold: float = 0.95,
+        ttl: Optional[float] = None
+    ):
+        self.dimension = dimension
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl = ttl
+
+        self._vectors = np.zeros((max_size, dimension), dtype=np.float32)
+        self._scopes = np.full(max_size, -1, dtype=np.int64)  # -1 = empty row
+        self._expires = np.full(max_size, np.inf)
+        self._last_used = np.zeros(max_size)
+        self._values = [None] * max_size
+        self._queries = [None] * max_size
+        self._scope_ids: Dict[Hashable, int] = {}
+        self._scope_keys: Dict[int, Hashable] = {}
+        self._next_scope_id = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self._hit_similarity_total = 0.0
+        self._histogram = [0] * len(_SIMILARITY_BUCKETS)
+
+        logger.info(
+            f"Initialized semantic cache with max_size={max_size}, "
+            f"threshold={threshold}, ttl={ttl}"
+        )
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _record_similarity(self, similarity: float):
+        for i, edge in enumerate(_SIMILARITY_BUCKETS):
+            if similarity < edge or i == len(_SIMILARITY_BUCKETS) - 1:
+                self._histogram[i] += 1
+                break
+
+    def lookup(self, vector, scope: Hashable) -> Optional[Dict[str, Any]]:
+        """
+        Find the most similar cached query within `scope`.
+
+        Returns {"value", "similarity", "query"} on a hit, else None.
+        """
+        query_vector = self._normalize(vector)
+        now = time.monotonic()
+
+        with self._lock:
+            scope_id = self._scope_ids.get(scope)
+            if scope_id is None:
+                self.misses += 1
+                return None
+
+            mask = (self._scopes == scope_id) & (self._expires > now)
+            if not mask.any():
+                self.misses += 1
+                return None
+
+            similarities = np.where(mask, self._vectors @ query_vector, -np.inf)
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            self._record_similarity(similarity)
+
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._hit_similarity_total += similarity
+            self._last_used[best] = now
+            return {
+                "value": self._values[best],
+                "similarity": round(similarity, 4),
+                "query": self._queries[best]
+            }
+
+    def store(self, vector, scope: Hashable, value: Any, query: str = None):
+        """Cache `value` for a query vector within `scope`."""
+        query_vector = self._normalize(vector)
+        now = time.monotonic()
+
+        with self._lock:
+            scope_id = self._scope_ids.get(scope)
+            if scope_id is None:
+                scope_id = self._next_scope_id
+                self._next_scope_id += 1
+                self._scope_ids[scope] = scope_id
+                self._scope_keys[scope_id] = scope
+
+            live = (self._scopes == scope_id) & (self._expires > now)
+            row = None
+            if live.any():
+                similarities = np.where(live, self._vectors @ query_vector, -np.inf)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    row = best
+
+            if row is None:
+                empty = np.flatnonzero((self._scopes == -1) | (self._expires <= now))
+                row = int(empty[0]) if len(empty) else int(np.argmin(self._last_used))
+
+            evicted = int(self._scopes[row])
+            self._vectors[row] = query_vector
+            self._scopes[row] = scope_id
+            self._expires[row] = now + self.ttl if self.ttl else np.inf
+            self._last_used[row] = now
+            self._values[row] = value
+            self._queries[row] = query
+
+            if evicted not in (-1, scope_id) and not (self._scopes == evicted).any():
+                self._forget_scope(evicted)
+
+    def _forget_scope(self, scope_id: int):
+        """Drop a scope id that no longer owns any row (caller holds the lock)."""
+        scope = self._scope_keys.pop(scope_id, None)
+        if scope is not None:
+            self._scope_ids.pop(scope, None)
+
+    def invalidate_namespace(self, namespace: Optional[str]) -> int:
+        """
+        Drop entries whose scope targets `namespace` (alone or as one of
+        several sharded namespaces). Returns the number dropped.
+        """
+        names = {None, ""} if not namespace else {namespace}
+
+        with self._lock:
+            scope_ids = [
+                scope_id for scope, scope_id in self._scope_ids.items()
+                if any(
+                    param[0] == "namespace"
+                    and (param[1] in names or isinstance(param[1], tuple) and names & set(param[1]))
+                    for param in scope[1:]
+                )
+            ]
+            rows = np.flatnonzero(np.isin(self._scopes, scope_ids))
+            self._scopes[rows] = -1
+            for row in rows:
+                self._values[row] = None
+                self._queries[row] = None
+            for scope_id in scope_ids:
+                self._forget_scope(scope_id)
+
+        return len(rows)
+
+    def clear(self):
+        """Drop all entries."""
+        with self._lock:
+            self._scopes[:] = -1
+            self._values = [None] * self.max_size
+            self._queries = [None] * self.max_size
+            self._scope_ids.clear()
+            self._scope_keys.clear()
+        logger.info("Semantic cache cleared")
+
+    def stats(self) -> dict:
+        """Return hit rate, threshold and the best-similarity histogram."""
+        lookups = self.hits + self.misses
+        edges = ("0",) + tuple(str(edge) for edge in _SIMILARITY_BUCKETS)
+        return {
+            "size": int(np.count_nonzero(self._scopes != -1)),
+            "scopes": len(self._scope_ids),
+            "max_size": self.max_size,
+            "threshold": self.threshold,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "mean_hit_similarity": round(self._hit_similarity_total / self.hits, 4) if self.hits else None,
+            "best_similarity_histogram": {
+                f"{edges[i]}-{edges[i + 1]}": count for i, count in enumerate(self._histogram)
+            }
+        }
@@ -0,0 +1,166 @@
+import hashlib
+import logging
+import re
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from cache_manager import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+# Sentence ends (., ! or ? followed by whitespace) and line breaks
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+# Shorter fragments (headings, list bullets) are kept with their neighbour
+MIN_SENTENCE_CHARS = 20
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split chunk text into sentences, merging very short fragments forward."""
+    sentences = []
+    carry = ""
+    for part in _SENTENCE_BOUNDARY.split(text):
+        part = part.strip()
+        if not part:
+            continue
+        part = f"{carry} {part}" if carry else part
+        if len(part) < MIN_SENTENCE_CHARS:
+            carry = part
+            continue
+        sentences.append(part)
+        carry = ""
+
+    if carry:
+        if sentences:
+            sentences[-1] = f"{sentences[-1]} {carry}"
+        else:
+            sentences.append(carry)
+    return sentences
+
+
+class SentenceCompressor:
+    """
+    Query-focused extractive compression of retrieved chunks.
+
+    Each chunk is split into sentences; every sentence is scored against
+    the query vector, and the best sentences across all chunks are kept
+    (in their original order) until the token budget is spent. Sentence
+    embeddings are cached per chunk id + text digest, and all uncached
+    chunks of a request are encoded in one batch.
+    """
+
+    def __init__(self, embedding_service, cache_size: int = 5000, ttl: float = None):
+        self.embedding_service = embedding_service
+        self.cache = TTLCache(max_size=cache_size, ttl=ttl, name="sentence-embeddings")
+
+        self.requests = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    @staticmethod
+    def _cache_key(doc: Dict[str, Any], text: str) -> Tuple[str, bytes]:
+        return (doc.get("id", ""), hashlib.md5(text.encode()).digest())
+
+    def _sentences(self, documents: List[Dict[str, Any]]) -> List[Tuple[List[str], np.ndarray]]:
+        """(sentences, embeddings) per document; uncached chunks encoded in one call."""
+        entries = [None] * len(documents)
+        keys = [None] * len(documents)
+        missing = []
+
+        for i, doc in enumerate(documents):
+            text = doc["metadata"].get("text", "")
+            keys[i] = self._cache_key(doc, text)
+            entries[i] = self.cache.get(keys[i])
+            if entries[i] is None:
+                missing.append((i, split_sentences(text)))
+
+        if missing:
+            texts = [sentence for _, sentences in missing for sentence in sentences]
+            embeddings = self.embedding_service.embed_batch_uncached(texts)
+
+            offset = 0
+            for i, sentences in missing:
+                entries[i] = (sentences, embeddings[offset:offset + len(sentences)].copy())
+                offset += len(sentences)
+                self.cache.set(keys[i], entries[i])
+
+        return entries
+
+    def compress(
+        self,
+        documents: List[Dict[str, Any]],
+        query_vector,
+        max_tokens: int,
+        token_counter
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Keep the sentences most similar to the query within `max_tokens`.
+        If no sentence fits, the best one is cut to the budget.
+
+        Returns:
+            (documents whose metadata text holds only the kept sentences,
+             in rank order and without emptied chunks; compression info)
+        """
+        entries = self._sentences(documents)
+
+        sentence_counts = [len(sentences) for sentences, _ in entries]
+        if not sum(sentence_counts):
+            return documents, {"sentences_total": 0, "sentences_kept": 0}
+
+        matrix = np.concatenate([embeddings for _, embeddings in entries if len(embeddings)])
+        query = np.asarray(query_vector, dtype=np.float32)
+        scores = matrix @ (query / (np.linalg.norm(query) or 1.0))
+
+        # (document index, sentence index) of each matrix row
+        owners = [(d, s) for d, count in enumerate(sentence_counts) for s in range(count)]
+
+        kept = [set() for _ in documents]
+        used = 0
+        for row in np.argsort(-scores):
+            d, s = owners[row]
+            tokens = token_counter.count(entries[d][0][s])
+            if used + tokens > max_tokens:
+                continue
+            kept[d].add(s)
+            used += tokens
+
+        # Every sentence is over budget (no punctuation, tiny extract_tokens):
+        # keep the head of the best one rather than an empty context
+        truncated = {}
+        if not used and max_tokens > 0:
+            d, s = owners[int(np.argmax(scores))]
+            truncated[(d, s)] = token_counter.truncate(entries[d][0][s], max_tokens)
+            kept[d].add(s)
+            used = token_counter.count(truncated[(d, s)])
+
+        compressed = []
+        for d, doc in enumerate(documents):
+            if not kept[d]:
+                continue
+            sentences = entries[d][0]
+            text = " ".join(truncated.get((d, s), sentences[s]) for s in sorted(kept[d]))
+            compressed.append({**doc, "metadata": {**doc["metadata"], "text": text}})
+
+        tokens_before = sum(token_counter.count(doc["metadata"].get("text", "")) for doc in documents)
+        self.requests += 1
+        self.tokens_before += tokens_before
+        self.tokens_after += used
+
+        return compressed, {
+            "sentences_total": len(owners),
+            "sentences_kept": sum(len(k) for k in kept),
+            "tokens_before": tokens_before,
+            "tokens_after": used
+        }
+
+    def stats(self) -> dict:
+        """Return totals and sentence-embedding cache statistics."""
+        return {
+            "requests": self.requests,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "reduction": round(1 - self.tokens_after / self.tokens_before, 4) if self.tokens_before else 0.0,
+            "cache": self.cache.stats()
+        }
@@ -0,0 +1,272 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from cache_manager import make_cache_key
+
+try:
+    import fcntl
+except ImportError:  # Windows: no POSIX record locks
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+_MAGIC = b"EMBSHM01"
+_HEADER = struct.Struct("<8sIIQ")  # magic, dimension, ways, num_sets
+_HEADER_SIZE = 64
+_READ_RETRIES = 8
+
+
+class SharedEmbeddingCache:
+    """
+    Host-wide embedding cache shared by every worker process.
+
+    Vectors live in a memory-mapped file (on /dev/shm by default) laid out
+    as a set-associative hash table: the md5 key picks a set of `ways`
+    slots, so lookups and inserts touch a fixed number of slots.
+
+    Readers are lock-free: each slot carries a sequence counter that
+    writers bump to odd before and even after writing (a seqlock), and a
+    read is retried if the counter moved. Writers take one of `stripes`
+    locks (a thread lock plus an fcntl byte-range lock for other
+    processes), so writes to different sets proceed in parallel.
+
+    Same interface as EmbeddingCache. get() returns a private copy, since
+    another process may overwrite the slot at any time.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dimension: int,
+        max_size: int = 10000,
+        ttl: Optional[float] = None,
+        ways: int = 8,
+        stripes: int = 64
+    ):
+        if fcntl is None:
+            raise RuntimeError("SharedEmbeddingCache requires a POSIX platform (fcntl)")
+
+        self.path = path
+        self.dimension = dimension
+        self.ttl = ttl
+        self.ways = ways
+        self.num_sets = max(1, -(-max_size // ways))
+        self.max_size = self.num_sets * ways
+        self.stripes = stripes
+
+        self._dtype = np.dtype([
+            ("seq", "<u4"),
+            ("pad", "<u4"),
+            ("stamp", "<f8"),  # expiry time with a TTL, else write time; 0 = empty
+            ("key", "V16"),
+            ("vec", "<f4", (dimension,))
+        ])
+        self._thread_locks = [threading.Lock() for _ in range(stripes)]
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._open()
+
+        logger.info(
+            f"Initialized shared embedding cache at {path} with "
+            f"max_size={self.max_size}, dimension={dimension}, ttl={ttl}"
+        )
+
+    def _open(self):
+        """Create or attach to the backing file and map it."""
+        size = _HEADER_SIZE + self._dtype.itemsize * self.max_size
+        expected = _HEADER.pack(_MAGIC, self.dimension, self.ways, self.num_sets)
+
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            # Whole-file flock only guards creation; slot writes use lockf ranges
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                # Another worker may have replaced the file while we waited
+                current = os.fstat(fd).st_ino == os.stat(self.path).st_ino
+                header = os.pread(fd, _HEADER.size, 0)
+                ready = current and header == expected and os.fstat(fd).st_size == size
+                if current and not ready:
+                    if header[:8] == _MAGIC:
+                        logger.warning(f"Shared cache layout changed, recreating {self.path}")
+                    self._replace(expected, size)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+            if ready:
+                break
+            os.close(fd)
+
+        self._fd = fd
+        self._mmap = mmap.mmap(self._fd, size)
+        self._slots = np.frombuffer(
+            self._mmap, dtype=self._dtype, count=self.max_size, offset=_HEADER_SIZE
+        )
+
+    def _replace(self, header: bytes, size: int):
+        """
+        Build a fresh table next to `path` and rename it into place.
+
+        The old file is never truncated: workers still mapping it (with the
+        old layout) keep a valid mapping instead of hitting SIGBUS, and
+        detach from it on restart.
+        """
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        tmp_fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(tmp_fd, size)
+            os.pwrite(tmp_fd, header, 0)
+        finally:
+            os.close(tmp_fd)
+        os.replace(tmp_path, self.path)
+
+    def _locate(self, key: bytes):
+        """Return (first slot, stripe) for a key's set."""
+        set_index = int.from_bytes(key[:8], "little") % self.num_sets
+        return set_index * self.ways, set_index % self.stripes
+
+    def _lock(self, stripe: int):
+        self._thread_locks[stripe].acquire()
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe, os.SEEK_SET)
+
+    def _unlock(self, stripe: int):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe, os.SEEK_SET)
+        self._thread_locks[stripe].release()
+
+    def _read_slot(self, slot: int, key: bytes):
+        """Seqlock read. Returns (matched, vector, stamp)."""
+        seqs = self._slots["seq"]
+        for _ in range(_READ_RETRIES):
+            seq = int(seqs[slot])
+            if seq & 1:
+                continue
+            if self._slots["key"][slot].tobytes() != key:
+                return False, None, 0.0
+            vector = self._slots["vec"][slot].copy()
+            stamp = float(self._slots["stamp"][slot])
+            if int(seqs[slot]) == seq:
+                return True, vector, stamp
+        return False, None, 0.0
+
+    def get(self, query: str, model_name: str) -> Optional[np.ndarray]:
+        """Retrieve cached embedding (a copy of the shared row)."""
+        embedding = self.get_key(make_cache_key(query, model_name))
+
+        if embedding is not None:
+            logger.debug(f"Shared cache HIT for query: {query[:50]}...")
+        else:
+            logger.debug(f"Shared cache MISS for query: {query[:50]}...")
+        return embedding
+
+    def get_key(self, key: bytes) -> Optional[np.ndarray]:
+        """Retrieve cached embedding by precomputed cache key."""
+        start, _ = self._locate(key)
+
+        for slot in range(start, start + self.ways):
+            matched, vector, stamp = self._read_slot(slot, key)
+            if not matched:
+                continue
+            if self.ttl and stamp <= time.time():
+                self.expirations += 1
+                break
+            self.hits += 1
+            return vector
+
+        self.misses += 1
+        return None
+
+    def set(self, query: str, model_name: str, embedding):
+        """Store embedding in the shared table."""
+        self.set_key(make_cache_key(query, model_name), embedding)
+        logger.debug(f"Shared cache SET for query: {query[:50]}...")
+
+    def set_key(self, key: bytes, embedding):
+        """Store embedding by precomputed cache key."""
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dimension:
+            raise ValueError(
+                f"Embedding dimension {vector.shape[0]} does not match "
+                f"cache dimension {self.dimension}"
+            )
+
+        start, stripe = self._locate(key)
+        now = time.time()
+
+        self._lock(stripe)
+        try:
+            keys = [k.tobytes() for k in self._slots["key"][start:start + self.ways]]
+
+            if key in keys:
+                slot = start + keys.index(key)
+            else:
+                # Empty ways have stamp 0, so argmin picks an empty way first,
+                # then the oldest write (which is also the soonest to expire)
+                stamps = self._slots["stamp"][start:start + self.ways]
+                victim = int(np.argmin(stamps))
+                if stamps[victim]:
+                    if self.ttl and stamps[victim] <= now:
+                        self.expirations += 1
+                    else:
+                        self.evictions += 1
+                slot = start + victim
+
+            self._slots["seq"][slot] += 1
+            self._slots["key"][slot] = np.void(key)
+            self._slots["vec"][slot] = vector
+            self._slots["stamp"][slot] = now + self.ttl if self.ttl else now
+            self._slots["seq"][slot] += 1
+        finally:
+            self._unlock(stripe)
+
+    def clear(self):
+        """Clear all cached embeddings (for every worker)."""
+        for stripe in range(self.stripes):
+            self._lock(stripe)
+        try:
+            self._slots["seq"] += 1
+            self._slots["key"] = np.void(bytes(16))
+            self._slots["stamp"] = 0.0
+            self._slots["seq"] += 1
+        finally:
+            for stripe in range(self.stripes):
+                self._unlock(stripe)
+        logger.info("Shared cache cleared")
+
+    def close(self):
+        """Unmap the shared file. Other workers keep their mappings."""
+        self._slots = None
+        self._mmap.close()
+        os.close(self._fd)
+
+    def stats(self) -> dict:
+        """Return cache statistics (counters are per worker, size is host-wide)."""
+        lookups = self.hits + self.misses
+        stamps = self._slots["stamp"]
+        live = (stamps > time.time()) if self.ttl else (stamps != 0)
+        size = int(np.count_nonzero(live))
+        return {
+            "backend": "shared",
+            "path": self.path,
+            "size": size,
+            "max_size": self.max_size,
+            "dimension": self.dimension,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "total_accesses": lookups,
+            "memory_bytes": self._mmap.size()
+        }
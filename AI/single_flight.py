@@ -0,0 +1,187 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical async calls onto one in-flight task.
+
+    The first caller for a key (the leader) starts the work; callers that
+    arrive with the same key before it finishes await the same task and
+    get its result or exception. The key is forgotten as soon as the task
+    is done, so later calls start fresh (caching is a separate concern).
+    Waiters are shielded: a disconnecting client never cancels the work
+    other callers are waiting on. A leader that no longer needs the result
+    may abandon() the key, which cancels the task only if nobody waits.
+    """
+
+    def __init__(self, name: str = "single-flight"):
+        self.name = name
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self.leaders = 0
+        self.joined = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run `fn()` once per key among concurrent callers.
+
+        Returns:
+            (result, shared) where shared is True for callers that joined
+            another caller's in-flight task
+        """
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.joined += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task), shared
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def task(self, key: Hashable) -> Optional[asyncio.Task]:
+        """The in-flight task for `key`, if any."""
+        return self._tasks.get(key)
+
+    def abandon(self, key: Hashable) -> bool:
+        """Cancel the in-flight task for `key` if nobody awaits it any more."""
+        task = self._tasks.get(key)
+        if task is None or self._waiters.get(key):
+            return False
+        task.cancel()
+        return True
+
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def stats(self) -> dict:
+        """Return leader/joined counts and the number of in-flight keys."""
+        calls = self.leaders + self.joined
+        return {
+            "name": self.name,
+            "in_flight": len(self._tasks),
+            "leaders": self.leaders,
+            "joined": self.joined,
+            "coalesced_ratio": round(self.joined / calls, 4) if calls else 0.0
+        }
+
+
+class StreamBroadcast:
+    """
+    Fans one async chunk stream out to any number of subscribers.
+
+    The source is drained by a background task into a buffer; every
+    subscriber first receives the chunks buffered so far and then the live
+    tail, so a late joiner sees the same full answer as the first client.
+    The source runs to completion even if all subscribers go away.
+    """
+
+    def __init__(self, source, on_done: Optional[Callable[[], None]] = None):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._on_done = on_done
+        self._changed = asyncio.Condition()
+        self._task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source):
+        try:
+            async for chunk in source:
+                async with self._changed:
+                    self.chunks.append(chunk)
+                    self._changed.notify_all()
+        except Exception as e:
+            logger.error(f"Broadcast source failed: {str(e)}")
+            self.error = e
+        finally:
+            async with self._changed:
+                self.done = True
+                self._changed.notify_all()
+            if self._on_done:
+                self._on_done()
+
+    async def subscribe(self):
+        """Yield every chunk of the stream from the start; re-raise a source error."""
+        self.subscribers += 1
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: position < len(self.chunks) or self.done)
+                new_chunks = self.chunks[position:]
+                finished = self.done
+
+            for chunk in new_chunks:
+                yield chunk
+            position += len(new_chunks)
+
+            if finished and position == len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class StreamFlight:
+    """
+    Single-flight for streamed answers.
+
+    Identical requests share one setup (embed, retrieve, prompt) while it
+    runs, and afterwards one StreamBroadcast until its last chunk, so a
+    client arriving mid-answer joins the live stream instead of starting
+    another LLM completion.
+    """
+
+    def __init__(self, name: str = "stream"):
+        self._setup = SingleFlight(name)
+        self._live: Dict[Hashable, Tuple[StreamBroadcast, Any]] = {}
+        self.live_joins = 0
+
+    async def open(self, key: Hashable, fn: Callable[[], Awaitable[Tuple[Any, Any]]]) -> Tuple[StreamBroadcast, Any, bool]:
+        """
+        Join or start the stream for `key`.
+
+        `fn()` returns (async chunk source, info); info (e.g. cache status)
+        is handed to every subscriber.
+
+        Returns:
+            (broadcast, info, shared)
+        """
+        live = self._live.get(key)
+        if live is not None:
+            self.live_joins += 1
+            broadcast, info = live
+            return broadcast, info, True
+
+        async def start():
+            source, info = await fn()
+
+            def forget():
+                if self._live.get(key, (None,))[0] is broadcast:
+                    del self._live[key]
+
+            broadcast = StreamBroadcast(source, on_done=forget)
+            self._live[key] = (broadcast, info)
+            return broadcast, info
+
+        (broadcast, info), shared = await self._setup.do(key, start)
+        return broadcast, info, shared
+
+    def stats(self) -> dict:
+        """Return setup coalescing counts plus live-stream joins."""
+        return {
+            **self._setup.stats(),
+            "live_streams": len(self._live),
+            "live_joins": self.live_joins
+        }
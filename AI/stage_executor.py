@@ -0,0 +1,116 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StageExecutor:
+    """
+    Runs blocking pipeline stages off the event loop.
+
+    Blocking calls (model.encode, vector store queries) go to one bounded
+    thread pool; each named stage also has its own concurrency limit so a
+    burst of slow retrievals cannot starve encoding, and vice versa.
+    Async-native stages (e.g. the LLM client) use limit() without a thread.
+    """
+
+    def __init__(self, max_workers: int = 16, limits: Optional[Dict[str, int]] = None):
+        self.max_workers = max_workers
+        self.limits = dict(limits or {})
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-stage")
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._waiting: Dict[str, int] = {}
+
+        logger.info(f"Initialized stage executor with max_workers={max_workers}, limits={self.limits}")
+
+    def _semaphore(self, stage: str) -> Optional[asyncio.Semaphore]:
+        if stage not in self.limits:
+            return None
+        if stage not in self._semaphores:
+            self._semaphores[stage] = asyncio.Semaphore(self.limits[stage])
+        return self._semaphores[stage]
+
+    def limit(self, stage: str) -> "_StageSlot":
+        """Async context manager holding one concurrency slot of `stage`."""
+        return _StageSlot(self, stage)
+
+    async def run(self, stage: str, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a blocking callable in the pool under the stage's limit.
+
+        The slot is held until the thread finishes, not until this
+        coroutine returns: a cancelled caller stops waiting, but its call
+        keeps running and keeps counting against the limit.
+        """
+        slot = self.limit(stage)
+        await slot.acquire()
+        loop = asyncio.get_running_loop()
+
+        def release(_):
+            try:
+                loop.call_soon_threadsafe(slot.release)
+            except RuntimeError:  # loop already closed
+                pass
+
+        try:
+            future = self._pool.submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            slot.release()
+            raise
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        """Stop accepting work and wait for running calls."""
+        self._pool.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        """Return per-stage limits, in-flight and waiting counts."""
+        stages = set(self.limits) | set(self._in_flight)
+        return {
+            "max_workers": self.max_workers,
+            "stages": {
+                stage: {
+                    "limit": self.limits.get(stage),
+                    "in_flight": self._in_flight.get(stage, 0),
+                    "waiting": self._waiting.get(stage, 0)
+                }
+                for stage in sorted(stages)
+            }
+        }
+
+
+class _StageSlot:
+    """Acquires a stage semaphore and keeps the in-flight/waiting counters."""
+
+    def __init__(self, executor: StageExecutor, stage: str):
+        self.executor = executor
+        self.stage = stage
+        self.semaphore = executor._semaphore(stage)
+
+    async def acquire(self):
+        counters = self.executor
+        counters._waiting[self.stage] = counters._waiting.get(self.stage, 0) + 1
+        try:
+            if self.semaphore is not None:
+                await self.semaphore.acquire()
+        finally:
+            counters._waiting[self.stage] -= 1
+        counters._in_flight[self.stage] = counters._in_flight.get(self.stage, 0) + 1
+
+    def release(self):
+        self.executor._in_flight[self.stage] -= 1
+        if self.semaphore is not None:
+            self.semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+        return False
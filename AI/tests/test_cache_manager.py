@@ -0,0 +1,62 @@
+import time
+
+import numpy as np
+
+from cache_manager import EmbeddingCache, TTLCache, make_cache_key
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now least recently used
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(max_size=10, ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=10)
+    time.sleep(0.08)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.expirations == 1
+
+
+def test_embedding_cache_evicts_least_recently_used():
+    cache = EmbeddingCache(max_size=2, dimension=3)
+    cache.set("a", "m", np.full(3, 1.0))
+    cache.set("b", "m", np.full(3, 2.0))
+    cache.get("a", "m")
+    cache.set("c", "m", np.full(3, 3.0))
+
+    assert cache.get("b", "m") is None
+    np.testing.assert_array_equal(cache.get("a", "m"), np.full(3, 1.0, dtype=np.float32))
+    np.testing.assert_array_equal(cache.get("c", "m"), np.full(3, 3.0, dtype=np.float32))
+    assert cache.stats()["evictions"] == 1
+
+
+def test_embedding_cache_expires_entries():
+    cache = EmbeddingCache(max_size=4, dimension=3, ttl=0.05)
+    cache.set("a", "m", np.ones(3))
+    time.sleep(0.08)
+
+    assert cache.get("a", "m") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_embedding_cache_returns_a_copy_of_its_row():
+    cache = EmbeddingCache(max_size=1, dimension=3)
+    key = make_cache_key("a", "m")
+    cache.set_key(key, np.ones(3))
+    vector = cache.get_key(key)
+
+    # Reusing the slot for another key must not change what the caller holds
+    cache.set("b", "m", np.zeros(3))
+    np.testing.assert_array_equal(vector, np.ones(3, dtype=np.float32))
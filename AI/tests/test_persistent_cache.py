@@ -0,0 +1,61 @@
+import numpy as np
+
+from persistent_cache import PersistentEmbeddingStore
+
+
+def _key(i: int) -> bytes:
+    return i.to_bytes(16, "little")
+
+
+def _load(path, dimension=4):
+    store = PersistentEmbeddingStore(path, dimension, "model", flush_interval=0.01)
+    try:
+        return {key: vector.copy() for key, vector in store.load()}
+    finally:
+        store.close()
+
+
+def test_round_trip_keeps_newest_record_per_key(tmp_path):
+    path = str(tmp_path / "embeddings.log")
+    store = PersistentEmbeddingStore(path, 4, "model", flush_interval=0.01)
+    store.append(_key(1), np.ones(4))
+    store.append(_key(1), np.full(4, 2.0))
+    store.append(_key(2), np.zeros(4))
+    store.close()
+
+    loaded = _load(path)
+    assert set(loaded) == {_key(1), _key(2)}
+    np.testing.assert_array_equal(loaded[_key(1)], np.full(4, 2.0, dtype=np.float32))
+
+
+def test_append_after_torn_write_stays_aligned(tmp_path):
+    path = str(tmp_path / "embeddings.log")
+    store = PersistentEmbeddingStore(path, 4, "model", flush_interval=0.01)
+    store.append(_key(0), np.zeros(4))
+    store.close()
+
+    # A crash mid-write leaves part of a record at the tail
+    with open(path, "ab") as f:
+        f.write(b"\x07" * 10)
+
+    store = PersistentEmbeddingStore(path, 4, "model", flush_interval=0.01)
+    for i in range(1, 4):
+        store.append(_key(i), np.full(4, float(i)))
+    store.close()
+
+    loaded = _load(path)
+    assert set(loaded) == {_key(i) for i in range(4)}
+    np.testing.assert_array_equal(loaded[_key(3)], np.full(4, 3.0, dtype=np.float32))
+
+
+def test_other_model_log_is_discarded(tmp_path):
+    path = str(tmp_path / "embeddings.log")
+    store = PersistentEmbeddingStore(path, 4, "model-a", flush_interval=0.01)
+    store.append(_key(1), np.ones(4))
+    store.close()
+
+    store = PersistentEmbeddingStore(path, 4, "model-b", flush_interval=0.01)
+    try:
+        assert list(store.load()) == []
+    finally:
+        store.close()
@@ -0,0 +1,104 @@
+import asyncio
+import email.utils
+import time
+
+import httpx
+import pytest
+from groq import AsyncGroq, InternalServerError
+
+import fake_llm_server
+from config import config
+from llm_service import LLMService
+from rate_limiter import LLMRateLimiter, get_rate_limiter, retry_after_seconds
+
+
+def test_retry_after_prefers_milliseconds():
+    assert retry_after_seconds({"retry-after-ms": "250", "retry-after": "9"}, 1.0) == 0.25
+
+
+def test_retry_after_seconds_and_http_date():
+    assert retry_after_seconds({"retry-after": "2.5"}, 1.0) == 2.5
+
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 < retry_after_seconds({"retry-after": date}, 1.0) <= 30
+
+
+def test_retry_after_falls_back_to_default():
+    assert retry_after_seconds(None, 1.5) == 1.5
+    assert retry_after_seconds({}, 1.5) == 1.5
+    assert retry_after_seconds({"retry-after": "soon"}, 1.5) == 1.5
+
+
+def test_requests_beyond_rpm_are_delayed():
+    limiter = LLMRateLimiter(rpm=60)  # one request per second once the burst is used
+    delays = [limiter._reserve(0) for _ in range(61)]
+
+    assert delays[:60] == [0.0] * 60
+    assert delays[60] == pytest.approx(1.0, abs=0.05)
+
+
+def test_pause_holds_every_caller():
+    limiter = LLMRateLimiter()
+    limiter.pause(0.5)
+
+    assert limiter._reserve(0) == pytest.approx(0.5, abs=0.05)
+    assert limiter.throttled == 1
+
+
+def test_settle_refunds_unused_tokens():
+    limiter = LLMRateLimiter(tpm=1000)
+    assert limiter._reserve(1000) == 0.0
+    assert limiter._reserve(500) > 0
+
+    limiter.settle(1000, 100)  # 900 reserved tokens were not used
+    assert limiter._reserve(300) == 0.0
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """LLMService talking to the fake LLM server in-process."""
+    monkeypatch.setattr(config, "FAKE_LLM_LATENCY_MS", 0)
+    monkeypatch.setattr(config, "FAKE_LLM_TOKEN_MS", 0)
+    monkeypatch.setattr(config, "LLM_RETRY_BASE_MS", 1)
+    monkeypatch.setattr(config, "LLM_RETRY_MAX_MS", 5)
+    fake_llm_server._recent.clear()
+    for name in fake_llm_server._counters:
+        fake_llm_server._counters[name] = 0
+    get_rate_limiter.cache_clear()
+
+    service = LLMService(api_key="fake", model="fake-model")
+    service.async_client = AsyncGroq(
+        api_key="fake",
+        base_url="http://fake-llm",
+        max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_llm_server.app))
+    )
+    yield service
+    get_rate_limiter.cache_clear()
+
+
+def test_429_pauses_for_retry_after_and_retries(service, monkeypatch):
+    monkeypatch.setattr(config, "FAKE_LLM_RPM", 1)
+    # The server's window is full and reopens in ~0.2s
+    fake_llm_server._recent.append(time.monotonic() - 59.8)
+
+    started = time.monotonic()
+    answer = asyncio.run(service.agenerate("hello", max_tokens=16))
+
+    assert answer.startswith("Fake answer to:")
+    assert 0.1 < time.monotonic() - started < 2
+    assert fake_llm_server._counters["rate_limited"] == 1
+    assert service.rate_limiter.throttled == 1
+    assert service.retries == 1
+
+
+def test_server_errors_give_up_after_max_retries(service, monkeypatch):
+    monkeypatch.setattr(config, "FAKE_LLM_ERROR_RATE", 1)
+    monkeypatch.setattr(config, "LLM_MAX_RETRIES", 2)
+
+    with pytest.raises(InternalServerError):
+        asyncio.run(service.agenerate("hello", max_tokens=16))
+
+    assert fake_llm_server._counters["errors"] == 3
+    assert service.retries == 2
+    assert service.failures == 1
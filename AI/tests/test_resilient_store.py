@@ -0,0 +1,112 @@
+import time
+
+import numpy as np
+import pytest
+
+from resilient_store import ResilientVectorStore, VectorStoreTimeout
+from vector_store import FakeVectorStore
+
+
+class FlakyStore(FakeVectorStore):
+    """FakeVectorStore whose first `failures` calls raise ConnectionError."""
+
+    def __init__(self, failures: int, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+
+    def _simulate(self):
+        super()._simulate()
+        if self.calls <= self.failures:
+            raise ConnectionError("injected vector store error")
+
+
+class SlowCallStore(FakeVectorStore):
+    """FakeVectorStore whose call number `slow_call` takes `slow_ms` longer."""
+
+    def __init__(self, slow_call: int, slow_ms: float, **kwargs):
+        super().__init__(**kwargs)
+        self.slow_call = slow_call
+        self.slow_ms = slow_ms
+
+    def _simulate(self):
+        super()._simulate()
+        if self.calls == self.slow_call:
+            time.sleep(self.slow_ms / 1000)
+
+
+def _store(inner, **kwargs):
+    defaults = dict(timeout=1.0, retries=2, backoff_base=0.001, backoff_max=0.005)
+    return ResilientVectorStore(inner, **{**defaults, **kwargs})
+
+
+def _vector():
+    return np.ones(8, dtype=np.float32)
+
+
+def test_retries_until_success():
+    inner = FlakyStore(failures=2, dimension=8, num_vectors=20, latency_ms=1)
+    store = _store(inner)
+    try:
+        matches = store.query(_vector(), top_k=3)
+        assert len(matches) == 3
+        stats = store.stats()
+        assert stats["retries"] == 2
+        assert stats["failures"] == 0
+    finally:
+        store.close()
+
+
+def test_gives_up_after_retries():
+    inner = FakeVectorStore(dimension=8, num_vectors=20, latency_ms=1, error_rate=1.0)
+    store = _store(inner, retries=2)
+    try:
+        with pytest.raises(ConnectionError):
+            store.query(_vector(), top_k=3)
+        assert inner.calls == 3
+        assert store.stats()["failures"] == 1
+    finally:
+        store.close()
+
+
+def test_caller_errors_are_not_retried():
+    inner = FakeVectorStore(dimension=8, num_vectors=20, latency_ms=1)
+    store = _store(inner)
+    try:
+        with pytest.raises(ValueError):
+            store.query(np.ones(3), top_k=3)  # wrong dimension
+        assert inner.calls == 1
+        assert store.stats()["retries"] == 0
+    finally:
+        store.close()
+
+
+def test_deadline_bounds_a_slow_call():
+    inner = FakeVectorStore(dimension=8, num_vectors=20, latency_ms=500)
+    store = _store(inner, timeout=0.1, retries=0)
+    try:
+        start = time.monotonic()
+        with pytest.raises(VectorStoreTimeout):
+            store.query(_vector(), top_k=3)
+        assert time.monotonic() - start < 0.4
+        assert store.stats()["timeouts"] == 1
+    finally:
+        store.close()
+
+
+def test_hedge_answers_a_slow_attempt():
+    # 20 fast calls give the hedge delay its latency samples; call 21 stalls
+    inner = SlowCallStore(slow_call=21, slow_ms=1000, dimension=8, num_vectors=20, latency_ms=1)
+    store = _store(inner, timeout=2.0, retries=0, hedge=True, hedge_min_delay=0.01)
+    try:
+        for _ in range(20):
+            store.query(_vector(), top_k=3)
+        assert store.hedge_delay() is not None
+
+        start = time.monotonic()
+        assert len(store.query(_vector(), top_k=3)) == 3
+        assert time.monotonic() - start < 0.5
+        stats = store.stats()
+        assert stats["hedges"] == 1
+        assert stats["hedge_wins"] == 1
+    finally:
+        store.close()
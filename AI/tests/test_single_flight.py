@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    runs = 0
+
+    async def work():
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert runs == 1
+    assert [shared for _, shared in results] == [False, True, True, True, True]
+    assert all(result == "result" for result, _ in results)
+    assert flight.in_flight() == 0
+
+
+def test_error_reaches_every_caller():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_cancelled_caller_does_not_cancel_shared_work():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do("key", work))
+        joiner = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await joiner
+
+    assert asyncio.run(main()) == ("result", True)
+
+
+def test_abandon_cancels_only_without_waiters():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(1)
+
+    async def main():
+        caller = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        assert not flight.abandon("key")  # someone is still waiting
+
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        task = flight.task("key")
+        assert flight.abandon("key")
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert task.cancelled()
+        assert flight.task("key") is None
+
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+import functools
+import hashlib
+import logging
+from typing import Optional
+
+from cache_manager import TTLCache
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+# Groq model family -> public Hugging Face tokenizer with the same vocabulary
+TOKENIZERS = {
+    "llama-3": "NousResearch/Meta-Llama-3-8B",
+    "llama3": "NousResearch/Meta-Llama-3-8B",
+    "llama-4": "NousResearch/Meta-Llama-3-8B",
+    "mixtral": "mistralai/Mixtral-8x7B-v0.1",
+    "gemma": "google/gemma-2-9b-it"
+}
+
+# Rough English average for BPE vocabularies, used when no tokenizer loads
+CHARS_PER_TOKEN = 4
+
+
+class TokenCounter:
+    """
+    Counts LLM tokens with one Hugging Face tokenizer.
+
+    Uses the tokenizer when it can be loaded, else a characters/4 estimate
+    (`exact` tells which; no tokenizer name means the estimate). Counts are
+    memoized by text digest, since the same chunks are retrieved over and
+    over.
+    """
+
+    def __init__(self, tokenizer_name: Optional[str] = None):
+        self.tokenizer_name = tokenizer_name
+        self.tokenizer = self._load(self.tokenizer_name)
+        self.exact = self.tokenizer is not None
+        self._counts = TTLCache(max_size=config.TOKEN_COUNT_CACHE_SIZE, name="token-counts")
+
+    @staticmethod
+    def tokenizer_for(model: str) -> Optional[str]:
+        """Hugging Face tokenizer name of a model's family, or None if unknown."""
+        name = model.lower()
+        for family, tokenizer_name in TOKENIZERS.items():
+            if family in name:
+                return tokenizer_name
+        return None
+
+    @staticmethod
+    def _load(tokenizer_name: Optional[str]):
+        if not tokenizer_name:
+            return None
+        try:
+            # Imported lazily: transformers is slow to import
+            from transformers import AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+            logger.info(f"Loaded tokenizer {tokenizer_name} for token budgeting")
+            return tokenizer
+        except Exception as e:
+            logger.warning(
+                f"Could not load tokenizer {tokenizer_name} ({e}), "
+                f"estimating {CHARS_PER_TOKEN} chars/token"
+            )
+            return None
+
+    def count(self, text: str) -> int:
+        """Number of tokens in `text`."""
+        if not text:
+            return 0
+
+        key = hashlib.md5(text.encode()).digest()
+        count = self._counts.get(key)
+        if count is None:
+            if self.tokenizer is None:
+                count = -(-len(text) // CHARS_PER_TOKEN)
+            else:
+                count = len(self.tokenizer.encode(text, add_special_tokens=False))
+            self._counts.set(key, count)
+        return count
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut `text` to at most `max_tokens` tokens."""
+        if max_tokens <= 0:
+            return ""
+        if self.tokenizer is None:
+            return text[:max_tokens * CHARS_PER_TOKEN]
+        ids = self.tokenizer.encode(text, add_special_tokens=False)
+        return text if len(ids) <= max_tokens else self.tokenizer.decode(ids[:max_tokens])
+
+    def stats(self) -> dict:
+        """Return tokenizer info and count-cache statistics."""
+        return {
+            "tokenizer": self.tokenizer_name if self.exact else None,
+            "exact": self.exact,
+            "count_cache": self._counts.stats()
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def _counter_for(tokenizer_name: Optional[str]) -> TokenCounter:
+    return TokenCounter(tokenizer_name)
+
+
+def get_token_counter(model: str) -> TokenCounter:
+    """
+    Token counter of a model. Models sharing a tokenizer (e.g. the Llama-3
+    family) share one counter, so each tokenizer is loaded once per process.
+    """
+    return _counter_for(config.TOKENIZER_NAME or TokenCounter.tokenizer_for(model))
@@ -0,0 +1,556 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_NAMESPACE = "__default__"
+
+
+class VectorStore:
+    """
+    Backend interface behind RetrievalService.
+
+    query() returns matches as {"id", "score", "metadata"} dicts, best
+    first (plus "values", a float32 vector, with include_values);
+    describe_index_stats() returns dimension, total_vector_count and
+    per-namespace counts.
+    """
+
+    name = "base"
+
+    def query(
+        self,
+        vector: np.ndarray,
+        top_k: int,
+        namespace: Optional[str] = None,
+        filter_metadata: Optional[Dict[str, Any]] = None,
+        include_values: bool = False
+    ) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def describe_index_stats(self) -> dict:
+        raise NotImplementedError
+
+    # Backends with a native multi-query call override query_batch()
+    supports_batch_query = False
+
+    def query_batch(
+        self,
+        vectors,
+        top_k: int,
+        namespace: Optional[str] = None,
+        filter_metadata: Optional[Dict[str, Any]] = None,
+        include_values: bool = False
+    ) -> List[List[Dict[str, Any]]]:
+        return [self.query(v, top_k, namespace, filter_metadata, include_values) for v in vectors]
+
+    def close(self):
+        """Release connections/threads held by the backend."""
+
+
+class PineconeVectorStore(VectorStore):
+    """Pinecone serverless/pod index."""
+
+    name = "pinecone"
+
+    def __init__(
+        self,
+        index_name: str,
+        api_key: str = None,
+        pool_threads: int = None,
+        request_timeout: float = None
+    ):
+        self.index_name = index_name
+        self.request_timeout = request_timeout or config.VECTOR_TIMEOUT_S
+        api_key = api_key or os.getenv("PINECONE_API_KEY")
+        pool_threads = pool_threads or config.PINECONE_POOL_THREADS
+
+        if not api_key:
+            raise ValueError("PINECONE_API_KEY must be set as an environment variable")
+
+        # Imported lazily so importing this module stays cheap
+        from pinecone import Pinecone
+
+        # NEW Pinecone SDK initialization. One client per process; its
+        # keep-alive connection pool is sized for pool_threads concurrent calls.
+        self.pc = Pinecone(api_key=api_key, pool_threads=pool_threads)
+        self.index = self.pc.Index(index_name, pool_threads=pool_threads)
+
+        logger.info(f"Connected to Pinecone index: {index_name} (pool_threads={pool_threads})")
+
+    def query(self, vector, top_k, namespace=None, filter_metadata=None, include_values=False):
+        # Pinecone's client wants plain floats; numpy vectors stop here
+        if isinstance(vector, np.ndarray):
+            vector = vector.tolist()
+
+        query_params = {
+            "vector": vector,
+            "top_k": top_k,
+            "include_metadata": True,
+            "include_values": include_values
+        }
+
+        if namespace:
+            query_params["namespace"] = namespace
+
+        if filter_metadata:
+            query_params["filter"] = filter_metadata
+
+        # Socket-level timeout, so abandoned (hedged/timed out) calls free their thread
+        response = self.index.query(**query_params, _request_timeout=self.request_timeout)
+
+        matches = []
+        for match in response.get("matches", []):
+            result = {
+                "id": match["id"],
+                "score": match["score"],
+                "metadata": match.get("metadata", {})
+            }
+            if include_values:
+                result["values"] = np.asarray(match["values"], dtype=np.float32)
+            matches.append(result)
+
+        return matches
+
+    def describe_index_stats(self) -> dict:
+        stats = self.index.describe_index_stats()
+        return {
+            "dimension": stats.get("dimension"),
+            "total_vector_count": stats.get("total_vector_count"),
+            "namespaces": stats.get("namespaces", {})
+        }
+
+
+def _compare(value: Any, op: str, operand: Any) -> bool:
+    """Evaluate one Pinecone filter operator against a metadata value."""
+    values = value if isinstance(value, list) else [value]
+
+    if op == "$eq":
+        return operand in values
+    if op == "$ne":
+        return operand not in values
+    if op == "$in":
+        return any(v in operand for v in values)
+    if op == "$nin":
+        return not any(v in operand for v in values)
+    if op == "$exists":
+        return (value is not None) == bool(operand)
+
+    if value is None or isinstance(value, (list, bool)):
+        return False
+    try:
+        if op == "$gt":
+            return value > operand
+        if op == "$gte":
+            return value >= operand
+        if op == "$lt":
+            return value < operand
+        if op == "$lte":
+            return value <= operand
+    except TypeError:
+        return False
+
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+def matches_filter(metadata: Dict[str, Any], filter_metadata: Dict[str, Any]) -> bool:
+    """
+    Evaluate a Pinecone-style metadata filter locally.
+
+    Supports $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin, $exists, $and, $or
+    and the {"field": value} shorthand for $eq.
+    """
+    for key, condition in filter_metadata.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            if not all(_compare(value, op, operand) for op, operand in condition.items()):
+                return False
+        elif not _compare(metadata.get(key), "$eq", condition):
+            return False
+    return True
+
+
+class _Shard:
+    """One namespace of a LocalVectorStore, memory-mapped from disk."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+
+        with open(os.path.join(path, "ids.json")) as f:
+            self.ids = json.load(f)
+        with open(os.path.join(path, "metadata.json")) as f:
+            self.metadata = json.load(f)
+
+        centroids = os.path.join(path, "ivf_centroids.npy")
+        if os.path.exists(centroids):
+            self.centroids = np.load(centroids)
+            self.ivf_order = np.load(os.path.join(path, "ivf_order.npy"), mmap_mode="r")
+            self.ivf_offsets = np.load(os.path.join(path, "ivf_offsets.npy"))
+        else:
+            self.centroids = None
+
+        self._filter_masks: Dict[str, np.ndarray] = {}
+
+    def filter_mask(self, filter_metadata: Dict[str, Any]) -> np.ndarray:
+        """Boolean row mask for a filter (memoized; the shard is read-only)."""
+        key = json.dumps(filter_metadata, sort_keys=True, default=str)
+        mask = self._filter_masks.get(key)
+        if mask is None:
+            mask = np.fromiter(
+                (matches_filter(m or {}, filter_metadata) for m in self.metadata),
+                dtype=bool,
+                count=len(self.metadata)
+            )
+            if len(self._filter_masks) >= 256:
+                self._filter_masks.clear()
+            self._filter_masks[key] = mask
+        return mask
+
+    def candidates(self, vector: np.ndarray, nprobe: int) -> Optional[np.ndarray]:
+        """Row ids from the `nprobe` closest IVF lists, or None for exact search."""
+        if self.centroids is None:
+            return None
+
+        nprobe = min(nprobe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ vector), nprobe - 1)[:nprobe]
+        return np.concatenate([
+            self.ivf_order[self.ivf_offsets[i]:self.ivf_offsets[i + 1]] for i in lists
+        ])
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector index for small and mid-sized course corpora.
+
+    Each namespace is a directory under `path` holding a float32
+    vectors.npy (L2-normalized, so dot product = cosine score), ids.json
+    and metadata.json. Vectors are memory-mapped, so the OS page cache is
+    shared across workers. Small namespaces are searched exactly with one
+    matrix-vector product; namespaces built with an IVF index only scan
+    the `nprobe` nearest clusters.
+
+    Build a namespace with LocalVectorStore.build() or build_local_index.py.
+    """
+
+    name = "local"
+    supports_batch_query = True
+
+    def __init__(self, path: str, nprobe: int = 16):
+        self.path = path
+        self.nprobe = nprobe
+        self._shards: Dict[str, _Shard] = {}
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(path):
+            raise ValueError(f"Local index directory not found: {path}")
+
+        logger.info(f"Opened local vector index at {path} (namespaces: {self.namespaces()})")
+
+    def namespaces(self) -> List[str]:
+        return sorted(
+            name for name in os.listdir(self.path)
+            if os.path.exists(os.path.join(self.path, name, "vectors.npy"))
+        )
+
+    def _shard(self, namespace: Optional[str]) -> Optional[_Shard]:
+        name = namespace or DEFAULT_NAMESPACE
+        with self._lock:
+            shard = self._shards.get(name)
+            if shard is None:
+                shard_path = os.path.join(self.path, name)
+                if not os.path.exists(os.path.join(shard_path, "vectors.npy")):
+                    return None
+                shard = self._shards[name] = _Shard(shard_path)
+            return shard
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    @staticmethod
+    def _top_matches(
+        shard: _Shard,
+        rows: np.ndarray,
+        scores: np.ndarray,
+        top_k: int,
+        include_values: bool = False
+    ):
+        """Turn candidate rows and their scores into the best `top_k` matches."""
+        k = min(top_k, len(rows))
+        if k == 0:
+            return []
+
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+
+        matches = []
+        for i in best:
+            if not np.isfinite(scores[i]):
+                continue
+            match = {
+                "id": shard.ids[rows[i]],
+                "score": float(scores[i]),
+                "metadata": shard.metadata[rows[i]] or {}
+            }
+            if include_values:
+                match["values"] = np.array(shard.vectors[rows[i]])
+            matches.append(match)
+
+        return matches
+
+    def query(self, vector, top_k, namespace=None, filter_metadata=None, include_values=False):
+        shard = self._shard(namespace)
+        if shard is None or not len(shard.ids):
+            return []
+
+        vector = self._normalize(vector)[0]
+        rows = shard.candidates(vector, self.nprobe)
+        mask = shard.filter_mask(filter_metadata) if filter_metadata else None
+
+        if rows is None:
+            scores = shard.vectors @ vector
+            if mask is not None:
+                scores = np.where(mask, scores, -np.inf)
+            rows = np.arange(len(scores))
+        else:
+            if mask is not None:
+                rows = rows[mask[rows]]
+            rows = np.sort(rows)  # sequential reads from the memory map
+            scores = shard.vectors[rows] @ vector
+
+        return self._top_matches(shard, rows, scores, top_k, include_values)
+
+    def query_batch(self, vectors, top_k, namespace=None, filter_metadata=None, include_values=False):
+        """
+        Multi-query search. Exact namespaces score every query in one
+        matrix-matrix product (a single pass over the memory map).
+        """
+        shard = self._shard(namespace)
+        if shard is None or not len(shard.ids):
+            return [[] for _ in range(len(vectors))]
+
+        if shard.centroids is not None:
+            return [self.query(v, top_k, namespace, filter_metadata, include_values) for v in vectors]
+
+        queries = self._normalize(vectors)
+        scores = shard.vectors @ queries.T  # (n, m)
+        if filter_metadata:
+            scores[~shard.filter_mask(filter_metadata)] = -np.inf
+
+        rows = np.arange(len(shard.ids))
+        return [
+            self._top_matches(shard, rows, scores[:, j], top_k, include_values)
+            for j in range(len(queries))
+        ]
+
+    def describe_index_stats(self) -> dict:
+        namespaces = {}
+        dimension = None
+        for name in self.namespaces():
+            shard = self._shard(None if name == DEFAULT_NAMESPACE else name)
+            dimension = shard.vectors.shape[1]
+            namespaces["" if name == DEFAULT_NAMESPACE else name] = {
+                "vector_count": len(shard.ids)
+            }
+        return {
+            "dimension": dimension,
+            "total_vector_count": sum(ns["vector_count"] for ns in namespaces.values()),
+            "namespaces": namespaces
+        }
+
+    @staticmethod
+    def build(
+        path: str,
+        ids: Sequence[str],
+        vectors,
+        metadata: Sequence[Dict[str, Any]],
+        namespace: Optional[str] = None,
+        ivf_min_vectors: int = 50000,
+        nlist: int = None,
+        iterations: int = 10
+    ):
+        """
+        Write (replace) one namespace of a local index.
+
+        Namespaces with at least `ivf_min_vectors` vectors also get an IVF
+        index: spherical k-means centroids (nlist defaults to sqrt(n))
+        plus rows grouped by nearest centroid.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        shard_path = os.path.join(path, namespace or DEFAULT_NAMESPACE)
+        os.makedirs(shard_path, exist_ok=True)
+
+        np.save(os.path.join(shard_path, "vectors.npy"), vectors)
+        with open(os.path.join(shard_path, "ids.json"), "w") as f:
+            json.dump(list(ids), f)
+        with open(os.path.join(shard_path, "metadata.json"), "w") as f:
+            json.dump(list(metadata), f)
+
+        ivf_files = ("ivf_centroids.npy", "ivf_order.npy", "ivf_offsets.npy")
+        for name in ivf_files:
+            if os.path.exists(os.path.join(shard_path, name)):
+                os.remove(os.path.join(shard_path, name))
+
+        n = len(vectors)
+        if n < ivf_min_vectors:
+            logger.info(f"Built flat local index for namespace={namespace}: {n} vectors")
+            return
+
+        nlist = nlist or int(np.sqrt(n))
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(n, size=min(n, nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1)
+
+        assign = np.concatenate([
+            np.argmax(vectors[i:i + 8192] @ centroids.T, axis=1)
+            for i in range(0, n, 8192)
+        ])
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(assign[order], np.arange(nlist + 1)).astype(np.int64)
+
+        np.save(os.path.join(shard_path, "ivf_centroids.npy"), centroids)
+        np.save(os.path.join(shard_path, "ivf_order.npy"), order)
+        np.save(os.path.join(shard_path, "ivf_offsets.npy"), offsets)
+        logger.info(
+            f"Built IVF local index for namespace={namespace}: {n} vectors, nlist={nlist}"
+        )
+
+
+class FakeVectorStore(VectorStore):
+    """
+    In-memory random index with injected latency and errors.
+
+    For exercising timeouts, retries and hedging without Pinecone:
+    every call sleeps `latency_ms` (plus `tail_latency_ms` with
+    probability `tail_probability`) and raises ConnectionError with
+    probability `error_rate`.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        dimension: int = 768,
+        num_vectors: int = 1000,
+        latency_ms: float = 20,
+        tail_latency_ms: float = 0,
+        tail_probability: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0
+    ):
+        self.latency_ms = latency_ms
+        self.tail_latency_ms = tail_latency_ms
+        self.tail_probability = tail_probability
+        self.error_rate = error_rate
+        self.calls = 0
+
+        rng = np.random.default_rng(seed)
+        self._vectors = LocalVectorStore._normalize(rng.standard_normal((num_vectors, dimension)))
+        self._ids = [f"fake-{i}" for i in range(num_vectors)]
+
+    def _simulate(self):
+        """Sleep for the configured latency and maybe fail."""
+        self.calls += 1
+        delay = self.latency_ms
+        if random.random() < self.tail_probability:
+            delay += self.tail_latency_ms
+        time.sleep(delay / 1000)
+        if random.random() < self.error_rate:
+            raise ConnectionError("injected vector store error")
+
+    def query(self, vector, top_k, namespace=None, filter_metadata=None, include_values=False):
+        self._simulate()
+        scores = self._vectors @ LocalVectorStore._normalize(vector)[0]
+        rows = np.argsort(-scores)[:top_k]
+
+        matches = []
+        for row in rows:
+            match = {
+                "id": self._ids[row],
+                "score": float(scores[row]),
+                "metadata": {"text": f"Fake document {row}", "namespace": namespace}
+            }
+            if include_values:
+                match["values"] = self._vectors[row].copy()
+            matches.append(match)
+
+        return matches
+
+    def describe_index_stats(self) -> dict:
+        self._simulate()
+        return {
+            "dimension": self._vectors.shape[1],
+            "total_vector_count": len(self._ids),
+            "namespaces": {}
+        }
+
+
+def create_vector_store(backend: str = None, index_name: str = None) -> VectorStore:
+    """
+    Build the configured vector store backend.
+
+    Network backends (pinecone, fake) are wrapped in ResilientVectorStore
+    for deadlines, retries and optional hedging.
+    """
+    backend = backend or config.VECTOR_BACKEND
+
+    if backend == "local":
+        return LocalVectorStore(config.LOCAL_INDEX_PATH, nprobe=config.LOCAL_INDEX_NPROBE)
+
+    if backend == "pinecone":
+        store = PineconeVectorStore(index_name or config.PINECONE_INDEX_NAME)
+    elif backend == "fake":
+        store = FakeVectorStore(
+            dimension=config.FAKE_STORE_DIMENSION,
+            latency_ms=config.FAKE_STORE_LATENCY_MS,
+            tail_latency_ms=config.FAKE_STORE_TAIL_LATENCY_MS,
+            tail_probability=config.FAKE_STORE_TAIL_PROBABILITY,
+            error_rate=config.FAKE_STORE_ERROR_RATE
+        )
+    else:
+        raise ValueError(f"Unknown vector backend '{backend}', expected 'pinecone', 'local' or 'fake'")
+
+    # Imported here: resilient_store builds on this module
+    from resilient_store import ResilientVectorStore
+
+    return ResilientVectorStore(
+        store,
+        timeout=config.VECTOR_TIMEOUT_S,
+        retries=config.VECTOR_RETRIES,
+        backoff_base=config.VECTOR_RETRY_BASE_MS / 1000,
+        backoff_max=config.VECTOR_RETRY_MAX_MS / 1000,
+        hedge=config.VECTOR_HEDGE,
+        hedge_percentile=config.VECTOR_HEDGE_PERCENTILE,
+        hedge_min_delay=config.VECTOR_HEDGE_MIN_MS / 1000,
+        max_workers=config.PINECONE_POOL_THREADS * 2
+    )